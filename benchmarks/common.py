@@ -0,0 +1,33 @@
+import os
+import json
+from typing import Dict, List
+
+
+def load_baseline(path: str) -> Dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, baseline: Dict) -> None:
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=4, sort_keys=True)
+        f.write("\n")
+    print(f"Baseline saved to {path}")
+
+
+def check_limit(value: float, limit) -> str:
+    """
+    Status of a measurement against its recorded limit (lower is better).
+    """
+    if limit is None:
+        return "no baseline"
+    return "REGRESSION" if value > limit else "ok"
+
+
+def print_table(headers: List[str], rows: List[List]) -> None:
+    print("| " + " | ".join(headers) + " |")
+    print("|" + " | ".join(["---"] * len(headers)) + "|")
+    for row in rows:
+        print("| " + " | ".join("" if cell is None else str(cell) for cell in row) + " |")
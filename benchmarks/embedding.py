@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import argparse
+from typing import Dict, List
+
+import numpy as np
+
+from common import print_table
+from scoring import DEFAULT_RESULTS, load_rows
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_root = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.append(os.path.join(repo_root, "src", "metrics"))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Throughput and accuracy of the embedding backends against the fp32 model")
+    parser.add_argument('--embedding_path', required=True, type=str, help="Path to the embedding model")
+    parser.add_argument('--backends', nargs='+', type=str, default=['torch', 'int8', 'onnx'], help="Backends to measure; 'torch' (fp32) is always measured as the reference")
+    parser.add_argument('--onnx_file', type=str, default=None, help="ONNX export in the model directory for the onnx backend")
+    parser.add_argument('--results_path', type=str, default=DEFAULT_RESULTS, help="Results file (JSON list or JSONL) with question, response and answer fields")
+    parser.add_argument('--repeat', type=int, default=3, help="Encoding passes per backend; the fastest is reported")
+    parser.add_argument('--min_cosine', type=float, default=0.98, help="Lowest allowed cosine between a backend's vector and the fp32 one")
+    parser.add_argument('--max_score_delta', type=float, default=0.02, help="Largest allowed change of a Semantic_Similarity score")
+    return parser.parse_args()
+
+
+def measure(backend, texts: List[str], repeat: int) -> Dict:
+    started = time.perf_counter()
+    vectors = backend.encode(texts[:1])
+    load_s = time.perf_counter() - started
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        vectors = backend.encode(texts)
+        best = min(best, time.perf_counter() - started)
+    return {"load_s": load_s, "encode_s": best, "vectors": np.asarray(vectors, dtype=np.float32)}
+
+
+def main():
+    args = parse_args()
+    from embedding_backends import load_backend
+
+    rows = load_rows(args.results_path)
+    texts = list(dict.fromkeys(text for row in rows for text in (row["question"], row["answer"], row["response"]) if text))
+    position = {text: i for i, text in enumerate(texts)}
+    # Semantic_Similarity pairs: response against answer
+    pairs = np.array([[position[row["response"]], position[row["answer"]]] for row in rows if row["response"] and row["answer"]])
+
+    kinds = ['torch'] + [kind for kind in args.backends if kind != 'torch']
+    table = []
+    reference = None
+    failed = False
+    for kind in kinds:
+        backend = load_backend(kind, args.embedding_path, file_name=args.onnx_file)
+        try:
+            result = measure(backend, texts, args.repeat)
+        except ImportError as e:
+            if reference is None:
+                raise
+            table.append([kind, len(texts), None, None, None, None, None, f"unavailable: {e}"])
+            continue
+        vectors = result["vectors"]
+        scores = np.einsum('ij,ij->i', vectors[pairs[:, 0]], vectors[pairs[:, 1]])
+        if reference is None:
+            reference = vectors, scores
+            cosine = delta = None
+            status = "reference"
+        else:
+            cosine = np.einsum('ij,ij->i', vectors, reference[0])
+            delta = float(np.abs(scores - reference[1]).max())
+            ok = cosine.min() >= args.min_cosine and delta <= args.max_score_delta
+            failed |= not ok
+            status = "ok" if ok else "INACCURATE"
+            cosine = round(float(cosine.min()), 4)
+            delta = round(delta, 4)
+        table.append([
+            kind, len(texts), round(result["load_s"], 2), round(len(texts) / result["encode_s"], 1),
+            cosine, delta, round(float(scores.mean()), 4), status,
+        ])
+
+    print_table(["backend", "texts", "load (s)", "texts/s", "min cosine vs fp32", "max score delta", "mean similarity", "status"], table)
+    if failed:
+        print(f"Backends outside min cosine {args.min_cosine} / max score delta {args.max_score_delta}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
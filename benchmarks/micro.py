@@ -0,0 +1,332 @@
+import io
+import os
+import sys
+import json
+import timeit
+import argparse
+import itertools
+import threading
+import contextlib
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from common import load_baseline, save_baseline, check_limit, print_table
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_root = os.path.abspath(os.path.join(current_dir, ".."))
+src_dir = os.path.join(repo_root, "src")
+sys.path.append(src_dir)
+sys.path.append(os.path.join(src_dir, "ai_search"))
+sys.path.append(os.path.join(src_dir, "metrics"))
+
+FIXTURES_DIR = os.path.join(current_dir, "fixtures")
+BASELINE_PATH = os.path.join(current_dir, "micro_baseline.json")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks of the pipeline's pure-Python hot paths")
+    parser.add_argument('--cases', nargs='+', default=None, help="Cases to run (default: all)")
+    parser.add_argument('--repeat', type=int, default=5, help="Timing repeats; the fastest is reported")
+    parser.add_argument('--update', action='store_true', help="Record the measurements as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="Allowed relative increase of a case's calls per op when recording a baseline")
+    return parser.parse_args()
+
+
+def load_fixture(name: str):
+    path = os.path.join(FIXTURES_DIR, name)
+    if name.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# A case prepares its inputs and returns (run, ops, failures): `run` processes every
+# fixture item once, `ops` is the number of items and `failures` counts the items
+# the code under test could not handle (checked, like the calls, against the baseline).
+Case = Callable[[], Tuple[Callable[[], None], int, int]]
+
+
+def case_json_parser():
+    from util import Operation_Utils
+    texts = [output["text"] for output in load_fixture("llm_outputs.json")]
+
+    def run():
+        # Failed parses print an error; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            return [Operation_Utils.Json_parser(text) for text in texts]
+    failures = sum(1 for result in run() if not result)
+    return run, len(texts), failures
+
+
+def case_prompt_builders():
+    from util import Prompt
+    from actions import ActionExecutor, SearchAction, SelectAction
+    tool_info, _ = ActionExecutor.get_tool_info(SearchAction, SelectAction)
+    search_tool_info_string = json.dumps(tool_info[0], ensure_ascii=False)
+    select_tool_info_string = json.dumps(tool_info[1], ensure_ascii=False)
+    outputs = load_fixture("llm_outputs.json")
+    messages = [{"role": "user", "content": "今年TGA年度最佳游戏提名作品的具体发售时间分别是什么？"}]
+    for output in outputs[:8]:
+        messages.append({"role": "assistant", "content": output["text"]})
+        messages.append({"role": "user", "content": "继续"})
+
+    def run():
+        Prompt._add_thought(messages)
+        Prompt._get_web_search_prompt(messages, search_tool_info_string)
+        Prompt._get_searcher_thought_prompt(messages)
+        Prompt._get_web_select_prompt(messages, select_tool_info_string)
+        Prompt._get_summary_prompt(messages)
+    return run, 5, 0
+
+
+def case_filter_results():
+    from plugins.web_search import BaseSearch
+    searcher = BaseSearch(topk=6, black_list=['enoN', 'youtube.com', 'bilibili.com', 'researchgate.net'])
+    results = [[tuple(item) for item in items] for items in load_fixture("search_results.json").values()]
+
+    def run():
+        for items in results:
+            searcher._filter_results(items)
+    return run, len(results), 0
+
+
+def case_search_merge():
+    from plugins.web_search import BaseSearch
+    from actions import SearchAction
+    fixture = load_fixture("search_results.json")
+
+    class FixtureSearch(BaseSearch):
+        def search(self, query: str) -> dict:
+            return self._filter_results([tuple(item) for item in fixture[query]])
+
+    action = SearchAction(topk=6, searcher_class=FixtureSearch)
+    arguments = {"query": list(fixture)}
+
+    def run():
+        action.call(arguments)
+    failures = 0 if action.call(arguments) else 1
+    return run, 1, failures
+
+
+def case_html_extract():
+    from actions.search_action import ContentFetcher
+    html = load_fixture("news_page.html")
+
+    def run():
+        ContentFetcher.extract_text(html)
+    failures = 0 if ContentFetcher.extract_text(html).strip() else 1
+    return run, 1, failures
+
+
+def case_token_scorers():
+    from token_eval import rouge_zh_score, qa_f1_zh_score, qa_recall_zh_score, tokenize_zh
+    rows = load_fixture("scorer_rows.json")
+
+    def run():
+        # Cold segmentation cache, as in a fresh evaluation run
+        tokenize_zh.cache_clear()
+        for row in rows:
+            for func in (rouge_zh_score, qa_f1_zh_score, qa_recall_zh_score):
+                func(row["response"], row["answer"])
+    return run, len(rows), 0
+
+
+def case_query_serialization():
+    from util import Operation_Utils, ResultSaves
+    from writer import ResultWriter
+    from plugins.web_search import BaseSearch
+    from actions.search_action import ContentFetcher
+    searcher = BaseSearch(topk=6, black_list=[])
+    fixture = load_fixture("search_results.json")
+    results = [[tuple(item) for item in items] for items in fixture.values()][:2]
+    page = ContentFetcher.extract_text(load_fixture("news_page.html"))[:2048]
+    selected = [
+        {str(index): dict(result, content=page) for index, result in searcher._filter_results(items).items() if index < 3}
+        for items in results
+    ]
+
+    def run():
+        # The serialization of one query with two searchers: the search and
+        # select observations, then the result line handed to the writer
+        agent_result = ResultSaves(response=page[:512], thought_depth=1)
+        for items, pages in zip(results, selected):
+            Operation_Utils.Json_dumps(searcher._filter_results(items))
+            Operation_Utils.Json_dumps(pages)
+            agent_result.add_search([items[0][2]])
+            agent_result.search_function += 1
+        ResultWriter.encode({
+            "question": "q",
+            "answer": "a",
+            "response": agent_result.response,
+            "search": agent_result.search,
+            "thought_depth": agent_result.thought_depth,
+            "search_nums": agent_result.search_nums,
+            "search_function": agent_result.search_function,
+            "cut_stages": agent_result.cut_stages,
+        })
+    return run, 1, 0
+
+
+def case_prompt_budget():
+    from serve import PromptBudget
+    budget = PromptBudget(max_model_len=32768)
+    outputs = load_fixture("llm_outputs.json")
+    observations = json.dumps(load_fixture("search_results.json"), ensure_ascii=False)
+    messages = [{"role": "system", "content": "你是一个搜索任务规划师。" * 50}]
+    for output in outputs[:6]:
+        messages.append({"role": "assistant", "content": output["text"]})
+        messages.append({"role": "user", "content": observations})
+
+    def run():
+        # One turn that fits (cached counts only) and one that must be cut
+        budget.fit(messages[:5], 2048)
+        budget.fit(messages, 2048)
+    return run, 2, 0
+
+
+def case_disabled_logging():
+    import logs
+    logs.configure(debug=False)
+    logger = logs.AgentLogger(debug=False)
+    outputs = load_fixture("llm_outputs.json")
+    messages = [{"role": "assistant", "content": output["text"]} for output in outputs]
+
+    def run():
+        # The agents' per-turn debug calls in a non-debug run
+        for output in outputs:
+            logger.debug("Response: {}", output["text"])
+        logger.debug("Messages received: {}", messages)
+        logger.observation("web search", outputs[0]["text"])
+    return run, len(outputs) + 2, 0
+
+
+def case_rouge_l():
+    import jieba
+    from rouge_l import rouge_l_batch
+    rows = load_fixture("scorer_rows.json")
+    pairs = [(" ".join(jieba.cut(row["response"])), " ".join(jieba.cut(row["answer"]))) for row in rows]
+    # A long answer against a long reference, the case the DP table made slow
+    long_answer = " ".join(hypothesis for hypothesis, _ in pairs)
+    pairs.append((long_answer, " ".join(reversed(long_answer.split(" ")))))
+
+    def run():
+        rouge_l_batch(pairs)
+    return run, len(pairs), 0
+
+
+CASES: Dict[str, Case] = {
+    "json_parser": case_json_parser,
+    "prompt_builders": case_prompt_builders,
+    "filter_results": case_filter_results,
+    "search_merge": case_search_merge,
+    "html_extract": case_html_extract,
+    "token_scorers": case_token_scorers,
+    "disabled_logging": case_disabled_logging,
+    "prompt_budget": case_prompt_budget,
+    "query_serialization": case_query_serialization,
+    "rouge_l": case_rouge_l,
+}
+
+
+# Comprehensions are separate calls before Python 3.12 only
+INLINED_CODE = {"<listcomp>", "<dictcomp>", "<setcomp>"}
+
+
+def count_calls(run: Callable[[], None]) -> int:
+    """
+    Calls made by the repository's own code while running `run` once, in any
+    thread: the calls between its functions and into the standard library and
+    third-party packages, not those inside them. Unlike time, the count is the
+    same on every machine, so it is what the baseline limits.
+    """
+    counter = itertools.count()
+
+    def profile(frame, event, arg):
+        if event == "call":
+            if frame.f_code.co_name in INLINED_CODE:
+                return
+            frame = frame.f_back
+        elif event != "c_call":
+            return
+        if frame is not None and frame.f_code.co_filename.startswith(src_dir):
+            next(counter)
+
+    threading.setprofile(profile)
+    sys.setprofile(profile)
+    try:
+        run()
+    finally:
+        sys.setprofile(None)
+        threading.setprofile(None)
+    return next(counter)
+
+
+def peak_alloc(run: Callable[[], None]) -> int:
+    """
+    Peak memory allocated while running `run` once, in bytes.
+    """
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def measure(case: Case, repeat: int) -> Dict:
+    run, ops, failures = case()
+    timer = timeit.Timer(run)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {
+        "us_per_op": round(best / ops * 1e6, 2),
+        "calls_per_op": round(count_calls(run) / ops, 1),
+        "alloc_per_op": round(peak_alloc(run) / ops),
+        "failures": failures,
+    }
+
+
+def main():
+    args = parse_args()
+    names = args.cases or list(CASES)
+    unknown = [name for name in names if name not in CASES]
+    if unknown:
+        raise ValueError(f"Unknown cases: {', '.join(unknown)}")
+
+    baseline = load_baseline(BASELINE_PATH)
+    results = {name: measure(CASES[name], args.repeat) for name in names}
+
+    rows = []
+    regressions: List[str] = []
+    for name, result in results.items():
+        recorded = baseline.get(name, {})
+        status = check_limit(result["calls_per_op"], recorded.get("max_calls"))
+        if recorded and result["failures"] > recorded.get("failures", 0):
+            status = "MORE FAILURES"
+        if status not in ("ok", "no baseline"):
+            regressions.append(name)
+        rows.append([name, result["calls_per_op"], recorded.get("calls_per_op"), recorded.get("max_calls"), result["us_per_op"], recorded.get("us_per_op"), result["alloc_per_op"], result["failures"], status])
+    # Timings depend on the machine and its load: they are reported, the calls are checked
+    print_table(["case", "calls/op", "baseline calls/op", "max calls/op", "us/op", "baseline us/op", "peak B/op", "failures", "status"], rows)
+
+    if args.update:
+        for name, result in results.items():
+            baseline[name] = {
+                "us_per_op": result["us_per_op"],
+                "calls_per_op": result["calls_per_op"],
+                "max_calls": round(result["calls_per_op"] * (1 + args.tolerance), 1),
+                "alloc_per_op": result["alloc_per_op"],
+                "failures": result["failures"],
+            }
+        save_baseline(BASELINE_PATH, baseline)
+    elif regressions:
+        print(f"Micro-benchmark regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+from typing import Dict, List
+
+from common import load_baseline, save_baseline, check_limit, print_table
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_root = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.append(os.path.join(repo_root, "src"))
+sys.path.append(os.path.join(repo_root, "src", "metrics"))
+
+BASELINE_PATH = os.path.join(current_dir, "scoring_baseline.json")
+DEFAULT_RESULTS = os.path.join(current_dir, "fixtures", "scorer_rows.json")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Throughput of the token_eval scorers over a results file")
+    parser.add_argument('--results_path', type=str, default=DEFAULT_RESULTS, help="Results file (JSON list or JSONL) with response and answer fields")
+    parser.add_argument('--repeat', type=int, default=3, help="Passes over the file; the fastest is reported")
+    parser.add_argument('--check_rouge', action='store_true', help="Compare rouge_zh_score with the `rouge` package (must be installed)")
+    parser.add_argument('--workers', nargs='+', type=int, default=None, help="Also run the multi-process scorer of token_eval with these worker counts")
+    parser.add_argument('--scale', type=int, default=20, help="Copies of the rows scored by the --workers runs, each made distinct")
+    parser.add_argument('--update', action='store_true', help="Record the measurements as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed relative regression when recording a baseline")
+    return parser.parse_args()
+
+
+def load_rows(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = json.load(f)
+    return [row for row in rows if row.get("response") is not None and row.get("answer") is not None]
+
+
+def score_pass(rows: List[Dict], eval_funcs: List) -> float:
+    """
+    Seconds to score every row with every scorer, starting from a cold
+    tokenization cache as a fresh evaluation run does.
+    """
+    from token_eval import tokenize_zh
+    tokenize_zh.cache_clear()
+    started = time.perf_counter()
+    for row in rows:
+        for func in eval_funcs:
+            func(row["response"], row["answer"])
+    return time.perf_counter() - started
+
+
+# Fresh interpreter per worker count: time to a loaded segmenter, then to all rows scored
+POOL_RUN = (
+    "import sys, json, time; started = time.perf_counter(); "
+    "sys.path[:0] = sys.argv[3:]; "
+    "from token_eval import ChunkScorer, EVAL_FUNCS, init_segmenter; "
+    "rows = json.load(open(sys.argv[1])); "
+    "init_segmenter(); ready = time.perf_counter()\n"
+    "with ChunkScorer(EVAL_FUNCS, int(sys.argv[2])) as scorer: scorer.score(rows)\n"
+    "print(json.dumps({'startup_s': ready - started, 'score_s': time.perf_counter() - ready}))"
+)
+
+
+def pool_runs(rows: List[Dict], workers: List[int], scale: int) -> List[List]:
+    # Distinct copies, so that the tokenization cache does not hide the work
+    scaled = [
+        {"response": f"{row['response']} {copy}", "answer": row["answer"]}
+        for copy in range(scale) for row in rows
+    ]
+    table = []
+    with tempfile.NamedTemporaryFile("w", suffix=".json", encoding="utf-8") as f:
+        json.dump(scaled, f, ensure_ascii=False)
+        f.flush()
+        for count in workers:
+            proc = subprocess.run(
+                [sys.executable, "-c", POOL_RUN, f.name, str(count), os.path.join(repo_root, "src"), os.path.join(repo_root, "src", "metrics")],
+                capture_output=True,
+                text=True,
+            )
+            if proc.returncode != 0:
+                table.append([count, len(scaled), None, None, None, proc.stderr.strip().splitlines()[-1]])
+                continue
+            timing = json.loads(proc.stdout.strip().splitlines()[-1])
+            total = timing["startup_s"] + timing["score_s"]
+            table.append([count, len(scaled), round(timing["startup_s"], 2), round(timing["score_s"], 2), round(len(scaled) / total, 1), ""])
+    return table
+
+
+def check_rouge(rows: List[Dict]) -> int:
+    """
+    Rows whose ROUGE-L differs by more than 1e-6 from the `rouge` package's.
+    Rows the package fails on (it hits the recursion limit on long answers and
+    the scorer used to return 0.0 then) are not compared.
+    """
+    import jieba
+    from rouge import Rouge
+    from token_eval import rouge_zh_score
+    mismatches = 0
+    for row in rows:
+        prediction = " ".join(jieba.cut(row["response"], cut_all=False))
+        ground_truth = " ".join(jieba.cut(row["answer"], cut_all=False))
+        try:
+            expected = Rouge().get_scores([prediction], [ground_truth], avg=True)["rouge-l"]["f"]
+        except RecursionError:
+            continue
+        except ValueError:
+            expected = 0.0
+        if abs(rouge_zh_score(row["response"], row["answer"]) - expected) > 1e-6:
+            mismatches += 1
+    return mismatches
+
+
+def main():
+    args = parse_args()
+    import jieba
+    from token_eval import rouge_zh_score, qa_f1_zh_score, qa_recall_zh_score
+    # The dictionary load is a one-off cost, not part of the scoring throughput
+    jieba.initialize()
+    eval_funcs = [rouge_zh_score, qa_f1_zh_score, qa_recall_zh_score]
+
+    rows = load_rows(args.results_path)
+    if not rows:
+        raise ValueError(f"No rows with a response and an answer in {args.results_path}")
+    if args.check_rouge:
+        mismatches = check_rouge(rows)
+        print(f"ROUGE-L mismatches against the rouge package: {mismatches}/{len(rows)}")
+        if mismatches:
+            sys.exit(1)
+    best = min(score_pass(rows, eval_funcs) for _ in range(args.repeat))
+    result = {
+        "rows": len(rows),
+        "rows_per_s": round(len(rows) / best, 1),
+        "us_per_row": round(best / len(rows) * 1e6, 1),
+    }
+
+    # Throughput depends on the answers' lengths: baselines are per results file
+    name = os.path.basename(args.results_path)
+    baseline = load_baseline(BASELINE_PATH)
+    recorded = baseline.get(name, {})
+    status = check_limit(result["us_per_row"], recorded.get("max_us_per_row"))
+    print_table(
+        ["results", "rows", "rows/s", "us/row", "baseline us/row", "max us/row", "status"],
+        [[name, result["rows"], result["rows_per_s"], result["us_per_row"], recorded.get("us_per_row"), recorded.get("max_us_per_row"), status]],
+    )
+
+    if args.workers:
+        print_table(["workers", "rows", "startup (s)", "scoring (s)", "rows/s overall", "error"], pool_runs(rows, args.workers, args.scale))
+
+    if args.update:
+        baseline[name] = {
+            "us_per_row": result["us_per_row"],
+            "max_us_per_row": round(result["us_per_row"] * (1 + args.tolerance), 1),
+        }
+        save_baseline(BASELINE_PATH, baseline)
+    elif status == "REGRESSION":
+        print(f"Scoring regression: {name}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from typing import Dict, List
+
+from common import load_baseline, save_baseline, check_limit, print_table
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+repo_root = os.path.abspath(os.path.join(current_dir, ".."))
+
+BASELINE_PATH = os.path.join(current_dir, "startup_baseline.json")
+
+# Entry points, relative to the repository root
+ENTRY_POINTS = {
+    "search": "src/ai_search/search.py",
+    "token_eval": "src/metrics/token_eval.py",
+    "llm_eval": "src/metrics/llm_eval.py",
+    "trace_report": "src/tracing/report.py",
+    "terminal": "example/terminal.py",
+}
+
+# Execute the module body of a script (its imports) without running its main()
+LOADER = (
+    "import os, sys, runpy; "
+    "sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[1]))); "
+    "runpy.run_path(sys.argv[1], run_name='__startup__')"
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure the import time of the CLI entry points")
+    parser.add_argument('--entries', nargs='+', default=list(ENTRY_POINTS), choices=list(ENTRY_POINTS), help="Entry points to measure")
+    parser.add_argument('--runs', type=int, default=5, help="Runs per entry point; the median is reported")
+    parser.add_argument('--update', action='store_true', help="Record the measurements as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative regression when recording a baseline")
+    parser.add_argument('--slack_ms', type=float, default=30.0, help="Allowed absolute regression when recording a baseline")
+    return parser.parse_args()
+
+
+def parse_importtime(stderr: str) -> Dict[str, int]:
+    """
+    Cumulative import time in microseconds of every top-level import,
+    from the `-X importtime` report.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented under their importer
+        if name.startswith(" ") and not name.startswith("  "):
+            try:
+                modules[name.strip()] = int(cumulative)
+            except ValueError:
+                continue
+    return modules
+
+
+def measure(path: str) -> Dict:
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", LOADER, os.path.join(repo_root, path)],
+        cwd=repo_root,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    if proc.returncode != 0:
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit code {proc.returncode}"
+        return {"error": error}
+    modules = parse_importtime(proc.stderr)
+    return {"import_ms": sum(modules.values()) / 1000, "wall_ms": wall * 1000, "modules": modules}
+
+
+def benchmark(path: str, runs: int) -> Dict:
+    samples = [measure(path) for _ in range(runs)]
+    failed = [sample for sample in samples if "error" in sample]
+    if failed:
+        return {"error": failed[0]["error"]}
+    heaviest = sorted(samples[-1]["modules"].items(), key=lambda item: item[1], reverse=True)[:5]
+    return {
+        "import_ms": round(statistics.median(sample["import_ms"] for sample in samples), 1),
+        "wall_ms": round(statistics.median(sample["wall_ms"] for sample in samples), 1),
+        "heaviest": [f"{name} ({us / 1000:.0f}ms)" for name, us in heaviest],
+    }
+
+
+def main():
+    args = parse_args()
+    baseline = load_baseline(BASELINE_PATH)
+    results = {name: benchmark(ENTRY_POINTS[name], args.runs) for name in args.entries}
+
+    rows = []
+    regressions: List[str] = []
+    for name, result in results.items():
+        limit = baseline.get(name, {}).get("max_ms")
+        if "error" in result:
+            regressions.append(name)
+            rows.append([name, None, None, limit, f"error: {result['error']}", None])
+            continue
+        status = check_limit(result["import_ms"], limit)
+        if status == "REGRESSION":
+            regressions.append(name)
+        rows.append([name, result["import_ms"], result["wall_ms"], limit, status, ", ".join(result["heaviest"])])
+    print_table(["entry", "import_ms", "wall_ms", "max_ms", "status", "heaviest imports"], rows)
+
+    if args.update:
+        for name, result in results.items():
+            if "error" not in result:
+                baseline[name] = {
+                    "import_ms": result["import_ms"],
+                    "max_ms": round(result["import_ms"] * (1 + args.tolerance) + args.slack_ms, 1),
+                }
+        save_baseline(BASELINE_PATH, baseline)
+    elif regressions:
+        print(f"Startup regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
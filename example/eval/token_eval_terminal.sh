@@ -10,17 +10,11 @@ NUM_SERVICES=1
 
 EVAL_FOLDER_PATH=${WORK_DIR}/data/metrics_rlts/model_api
 # 手动选择
-# EVAL_FILE_NAME=(
-#     "moonshot-v1-128k.jsonl" \
+# EVAL_FILES=(
+#     "${EVAL_FOLDER_PATH}/moonshot-v1-128k.jsonl" \
 # )
-# 自动选择
-EVAL_FILE_NAME=($(find "$EVAL_FOLDER_PATH" -maxdepth 1 -type f -name "*.jsonl" -exec basename {} \;))
+# 自动选择: 目录下所有 *.jsonl 文件在同一个进程池中评测, 并一次写出汇总排行榜
+EVAL_FILES=("$EVAL_FOLDER_PATH/*.jsonl")
 
-for FILE_NAME in "${EVAL_FILE_NAME[@]}"
-do
-    echo "Processing evaluation file: $FILE_NAME"
-    
-    python ${WORK_DIR}/src/metrics/token_eval.py \
-        --eval_folder_path $EVAL_FOLDER_PATH \
-        --eval_name $FILE_NAME
-done
+python ${WORK_DIR}/src/metrics/eval_all.py \
+    --results "${EVAL_FILES[@]}"
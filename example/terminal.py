@@ -7,12 +7,14 @@ from dotenv import load_dotenv
 
 current_dir = os.path.dirname(__file__)  
 project_root = os.path.abspath(os.path.join(current_dir, ".."))
-sys.path.append(project_root)
+# Import the packages the way src/ modules import each other, so that each is
+# loaded once instead of again under a `src.` prefix
+sys.path.append(os.path.join(project_root, 'src'))
 
-from src.serve import VllmServer
-from src.plugins import QihooWebSearch, BingSearch
-from src.actions import ActionExecutor, SearchAction, SelectAction
-from src.ai_search import ResultSaves, PlanningAgent, SearcherAgent, SearchDistributor
+from serve import VllmServer
+from plugins import QihooWebSearch, BingSearch
+from actions import ActionExecutor, SearchAction, SelectAction
+from ai_search import ResultSaves, PlanningAgent, SearcherAgent, SearchDistributor
 
 env_path = os.path.join(project_root, 'config', '.env')
 load_dotenv(dotenv_path=env_path)
@@ -46,11 +48,17 @@ def main():
     )
 
     query = "今年TGA年度最佳游戏提名作品的具体发售时间分别是什么？"
-    agent_result = None
-    for agent_result in agent.stream_chat(query):
-        pass
-    print("=="*20,"最终答案","=="*20)
-    print(colored(agent_result.response,"light_green"))
+    answer_started = False
+    for event in agent.stream_chat(query):
+        if event.kind == 'summary_delta':
+            if not answer_started:
+                print("=="*20,"最终答案","=="*20)
+                answer_started = True
+            print(colored(event.text,"light_green"), end='', flush=True)
+        elif event.kind == 'finished' and not answer_started:
+            print("=="*20,"最终答案","=="*20)
+            print(colored(event.result.response,"light_green"), end='')
+    print()
 
 if __name__ == "__main__":
     main()
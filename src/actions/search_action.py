@@ -6,7 +6,7 @@ from bs4 import BeautifulSoup
 from cachetools import TTLCache, cached
 from typing import List, Optional, Tuple, Type, Union
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
 from termcolor import colored
 
 import re
@@ -20,6 +20,7 @@ project_root = os.path.abspath(os.path.join(current_dir, ".."))
 sys.path.append(project_root)
 
 from plugins import QihooWebSearch, BingSearch
+from tracing import span, propagate
 
 class ContentFetcher:
 
@@ -28,20 +29,28 @@ class ContentFetcher:
 
     @cached(cache=TTLCache(maxsize=100, ttl=600))
     def fetch(self, url: str) -> Tuple[bool, str]:
-        try:
-            response = requests.get(
-                url, 
-                timeout=self.timeout,
-                headers={'User-Agent': 'Mozilla/5.0'}
-            )
-            response.raise_for_status()
-            html = response.content
-        except requests.RequestException as e:
-            return False, str(e)
+        with span('fetch', url=url) as fetch_span:
+            try:
+                response = requests.get(
+                    url, 
+                    timeout=self.timeout,
+                    headers={'User-Agent': 'Mozilla/5.0'}
+                )
+                response.raise_for_status()
+                html = response.content
+            except requests.RequestException as e:
+                fetch_span.set(ok=False)
+                return False, str(e)
+            fetch_span.set(ok=True, bytes=len(html))
+
+        with span('parse', kind='html', url=url):
+            cleaned_text = self.extract_text(html)
+        return True, cleaned_text
 
+    @staticmethod
+    def extract_text(html: Union[bytes, str]) -> str:
         text = BeautifulSoup(html, 'html.parser').get_text()
-        cleaned_text = re.sub(r'\n+', '\n', text)
-        return True, cleaned_text
+        return re.sub(r'\n+', '\n', text)
 
 
 class SearchAction:
@@ -57,12 +66,15 @@ class SearchAction:
         self,
         topk: str = 3,
         searcher_class: Type = None,
+        deadline=None,
     ) -> None:
         self.topk = topk
+        self.deadline = deadline
         black_list = ['enoN','youtube.com','bilibili.com','researchgate.net']
         if searcher_class is None:
             searcher_class = QihooWebSearch
-        self.searcher = searcher_class(black_list=black_list, topk=self.topk)
+        timeout = deadline.timeout(10) if deadline is not None else None
+        self.searcher = searcher_class(black_list=black_list, topk=self.topk, timeout=timeout)
     def call(self, arguments: dict) -> dict:
         if isinstance(arguments['query'], list):
             queries = arguments['query'] 
@@ -70,13 +82,14 @@ class SearchAction:
             queries = [arguments['query']]
         search_results = {}
 
-        with ThreadPoolExecutor() as executor:
-            future_to_query = {
-                executor.submit(self.searcher.search, q): q
-                for q in queries
-            }
-
-            for future in as_completed(future_to_query):
+        executor = ThreadPoolExecutor()
+        future_to_query = {
+            executor.submit(propagate(self.searcher.search), q): q
+            for q in queries
+        }
+        timeout = self.deadline.remaining() if self.deadline is not None else None
+        try:
+            for future in as_completed(future_to_query, timeout=timeout):
                 query = future_to_query[future]
                 try:
                     results = future.result()
@@ -89,6 +102,11 @@ class SearchAction:
                         else:
                             search_results[
                                 result['url']]['summ'] += f"\n{result['summ']}"
+        except TimeoutError:
+            warnings.warn('web search cut by deadline, returning partial results')
+        finally:
+            # Do not block on searches still running past the deadline
+            executor.shutdown(wait=False, cancel_futures=True)
 
         observation = {
             idx: result
@@ -113,26 +131,32 @@ class SelectAction:
         self,
         topk: str = 3,
         searcher_class: Type = None,
+        deadline=None,
         **kwargs
     ) -> None:
-        timeout = 5
+        self.deadline = deadline
+        timeout = deadline.timeout(5) if deadline is not None else 5
         self.fetcher = ContentFetcher(timeout=timeout)
     def call(self, arguments: dict) -> dict:
         select_ids = arguments['select_ids']
         search_results = arguments['search_results']
         if not search_results:
             raise ValueError('No search results to select from.')
+        if self.deadline is not None and self.deadline.expired():
+            warnings.warn('web select skipped: deadline expired')
+            return {}
 
         new_search_results = {}
-        with ThreadPoolExecutor() as executor:
-            future_to_id = {
-                executor.submit(self.fetcher.fetch,
-                                search_results[select_id]['url']):
-                select_id
-                for select_id in select_ids if select_id in search_results
-            }
-
-            for future in as_completed(future_to_id):
+        executor = ThreadPoolExecutor()
+        future_to_id = {
+            executor.submit(propagate(self.fetcher.fetch),
+                            search_results[select_id]['url']):
+            select_id
+            for select_id in select_ids if select_id in search_results
+        }
+        timeout = self.deadline.remaining() if self.deadline is not None else None
+        try:
+            for future in as_completed(future_to_id, timeout=timeout):
                 select_id = future_to_id[future]
                 try:
                     web_success, web_content = future.result()
@@ -145,6 +169,10 @@ class SelectAction:
                         new_search_results[select_id] = search_results[
                             select_id].copy()
                         new_search_results[select_id].pop('summ')
+        except TimeoutError:
+            warnings.warn('web select cut by deadline, returning fetched pages only')
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
         return new_search_results
     def __call__(self, arguments: dict) -> dict:
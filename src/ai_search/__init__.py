@@ -1,10 +1,29 @@
-from .util import Operation_Utils, ResultSaves
+from .util import Operation_Utils, ResultSaves, expected_cost, fill_work_queue, report_utilisation
 from .component import PlanningAgent, SearcherAgent, SearchDistributor
+from .events import (
+    AgentEvent,
+    PlanProduced,
+    SubSearchStarted,
+    SubSearchFinished,
+    ToolCalled,
+    SummaryDelta,
+    AgentFinished
+)
 
 __all__ = [
     'Operation_Utils',
+    'expected_cost',
+    'fill_work_queue',
+    'report_utilisation',
     'PlanningAgent',
     'SearcherAgent',
     'SearchDistributor',
-    'ResultSaves'
+    'ResultSaves',
+    'AgentEvent',
+    'PlanProduced',
+    'SubSearchStarted',
+    'SubSearchFinished',
+    'ToolCalled',
+    'SummaryDelta',
+    'AgentFinished'
 ]
@@ -0,0 +1,254 @@
+import os
+import json
+import hashlib
+import threading
+from types import SimpleNamespace
+from collections import Counter
+from typing import Dict, Generator, List, Tuple, Type
+
+from writer import question_key
+
+
+_MISSING = object()
+
+
+class Checkpoint:
+    """
+    Compact resume index for a results file.
+
+    `<save_path>.ckpt` is a JSONL log of {"key", "status", "offset"} entries keyed
+    by question hash, where status is "running" or "done" and offset is the byte
+    offset of the record in the results file. The last entry of a key wins.
+    In-progress queries keep their LLM and tool results in `<save_path>.steps/`
+    so that a restart can replay them instead of redoing the whole query.
+    """
+    def __init__(self, save_path: str):
+        self.save_path = save_path
+        self.index_path = save_path + '.ckpt'
+        self.steps_dir = save_path + '.steps'
+        self._lock = threading.Lock()
+
+    def repair(self) -> int:
+        """
+        Truncate a partially written trailing line of the results file.
+        Returns the size of the valid part.
+        """
+        if not os.path.exists(self.save_path):
+            return 0
+        with open(self.save_path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return 0
+            f.seek(size - 1)
+            if f.read(1) == b'\n':
+                return size
+            # Scan back to the last complete line
+            block = 1 << 16
+            pos = size
+            while pos > 0:
+                start = max(0, pos - block)
+                f.seek(start)
+                chunk = f.read(pos - start)
+                newline = chunk.rfind(b'\n')
+                if newline != -1:
+                    valid = start + newline + 1
+                    break
+                pos = start
+            else:
+                valid = 0
+            f.truncate(valid)
+            return valid
+
+    def load(self) -> Dict[str, str]:
+        """
+        Return the status of every known question key.
+
+        The results file is repaired first; "done" entries pointing past its valid
+        end are dropped. Without an index, one is rebuilt from the results file.
+        """
+        valid_size = self.repair()
+        if not os.path.exists(self.index_path):
+            return self._rebuild()
+        status = {}
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry['status'] == 'done' and entry.get('offset', 0) >= valid_size:
+                    continue
+                status[entry['key']] = entry['status']
+        return status
+
+    def _rebuild(self) -> Dict[str, str]:
+        status = {}
+        entries = []
+        if os.path.exists(self.save_path):
+            offset = 0
+            with open(self.save_path, 'rb') as f:
+                for line in f:
+                    try:
+                        key = question_key(json.loads(line)['question'])
+                    except (json.JSONDecodeError, KeyError):
+                        offset += len(line)
+                        continue
+                    status[key] = 'done'
+                    entries.append({'key': key, 'status': 'done', 'offset': offset})
+                    offset += len(line)
+        self._append(entries)
+        return status
+
+    def _append(self, entries: List[Dict]) -> None:
+        if not entries:
+            return
+        data = ''.join(json.dumps(entry) + '\n' for entry in entries).encode('utf-8')
+        with self._lock:
+            fd = os.open(self.index_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            try:
+                os.write(fd, data)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def mark_running(self, keys: List[str]) -> None:
+        self._append([{'key': key, 'status': 'running'} for key in keys])
+
+    def mark_done(self, done: List[Tuple[str, int]]) -> None:
+        """
+        Record (key, offset) pairs whose results are durably written, and drop
+        their step caches.
+        """
+        self._append([{'key': key, 'status': 'done', 'offset': offset} for key, offset in done])
+        for key, _ in done:
+            try:
+                os.remove(self.steps_path(key))
+            except FileNotFoundError:
+                pass
+
+    def steps_path(self, key: str) -> str:
+        return os.path.join(self.steps_dir, key + '.jsonl')
+
+    def step_cache(self, question: str) -> "StepCache":
+        os.makedirs(self.steps_dir, exist_ok=True)
+        return StepCache(self.steps_path(question_key(question)))
+
+
+class StepCache:
+    """
+    Append-only cache of the LLM responses and tool results of one query.
+
+    Steps are keyed by their inputs and by how many times these inputs were seen
+    before in the query (see `next_key`): a call repeated with the same inputs,
+    such as a planning retry after an unparsable plan, is a new step that gets a
+    new response, and a resumed query replays the steps in the order they ran.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.hits = 0
+        self._steps: Dict[str, object] = {}
+        self._seen: Counter = Counter()
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        step = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._steps[step['k']] = step['v']
+
+    @staticmethod
+    def key(*parts) -> str:
+        payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def next_key(self, *parts) -> str:
+        """
+        Key of the next occurrence of a step with these inputs in this query.
+        """
+        base = self.key(*parts)
+        with self._lock:
+            occurrence = self._seen[base]
+            self._seen[base] += 1
+        return self.key(base, occurrence) if occurrence else base
+
+    def get(self, key: str):
+        value = self._steps.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+        return value
+
+    def put(self, key: str, value) -> None:
+        line = json.dumps({'k': key, 'v': value}, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._steps[key] = value
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+
+def _chunk(text: str) -> SimpleNamespace:
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason='stop')])
+
+
+class CachedLLM:
+    """
+    VllmServer wrapper that replays responses recorded in a StepCache.
+
+    Only complete responses are recorded: a stream that ends without a finish
+    reason (closed at the deadline) or raises is asked again on resume.
+    """
+    def __init__(self, llm, cache: StepCache):
+        self.llm = llm
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    def stream_chat(self, messages: List[Dict], **kwargs) -> Generator:
+        key = self.cache.next_key('stream_chat', messages)
+        cached = self.cache.get(key)
+        if cached is not _MISSING:
+            yield _chunk(cached)
+            return
+        parts = []
+        finished = False
+        for chunk in self.llm.stream_chat(messages, **kwargs):
+            if chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            finished = getattr(chunk.choices[0], 'finish_reason', None) is not None
+            yield chunk
+        if finished:
+            self.cache.put(key, ''.join(parts))
+
+    def chat(self, messages: List[Dict], **kwargs) -> str:
+        key = self.cache.next_key('chat', messages)
+        cached = self.cache.get(key)
+        if cached is not _MISSING:
+            return cached
+        response = self.llm.chat(messages, **kwargs)
+        self.cache.put(key, response)
+        return response
+
+
+def cached_tool(tool_cls: Type, cache: StepCache):
+    """
+    Wrap a tool class so that its results are recorded in, and replayed from, `cache`.
+    The wrapper is a drop-in entry for a SearcherAgent tool_map. A call that ends
+    past its deadline may have returned partial results and is not recorded.
+    """
+    def build(*args, deadline=None, **kwargs):
+        tool = tool_cls(*args, deadline=deadline, **kwargs)
+
+        def call(parameters: dict) -> dict:
+            key = cache.next_key('tool', tool_cls.name, parameters)
+            cached = cache.get(key)
+            if cached is not _MISSING:
+                return cached
+            result = tool(parameters)
+            if deadline is None or not deadline.expired():
+                cache.put(key, result)
+            return result
+        return call
+    build.name = tool_cls.name
+    return build
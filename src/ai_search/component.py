@@ -1,20 +1,28 @@
 import re
 import json
+import queue
 import traceback
 
-from copy import deepcopy
 from datetime import datetime
 from termcolor import colored
-from typing import Dict, List, Optional, Generator, Type
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Generator, Type, Union
+from concurrent.futures import ThreadPoolExecutor
 
 from serve import VllmServer
-from util import ResultSaves, CustomLogger, Prompt, Operation_Utils
+from util import ResultSaves, Prompt, Operation_Utils, Deadline
+from logs import AgentLogger
+from tracing import span, propagate
+from events import (
+    AgentEvent,
+    PlanProduced,
+    SubSearchStarted,
+    SubSearchFinished,
+    ToolCalled,
+    SummaryDelta,
+    AgentFinished
+)
 from actions import ActionExecutor, SearchAction, SelectAction
 
-import multiprocessing
-from termcolor import colored
-
 
 
 class SearcherAgent:
@@ -27,6 +35,7 @@ class SearcherAgent:
         tool_info: List[Dict] = [],
         tool_map: Dict = {},
         debug: bool = False,
+        tool_info_strings: Optional[List[str]] = None,
         **kwargs
     ) -> None:
         self.llm = llm
@@ -35,80 +44,119 @@ class SearcherAgent:
         self.searcher_class=searcher_class
         self.tool_map = tool_map
         self.tool_info = tool_info
+        # Serialized once; they key the cached tool prompts
+        if tool_info_strings is None:
+            tool_info_strings = [json.dumps(info, ensure_ascii=False) for info in tool_info]
+        self.tool_info_strings = tool_info_strings
         self.debug = debug
-        self.logger = CustomLogger(debug=self.debug)
+        self.logger = AgentLogger(debug=self.debug)
 
-    def _execute_tool_call(self, func_calls: Dict) -> str:
+    def _execute_tool_call(self, func_calls: Dict, deadline: Optional[Deadline] = None) -> str:
         """
         Simulate the execution of tool calls.
         """
         available_tools = self.tool_map
         call_function = available_tools[func_calls['name']]
         parameters = func_calls['parameters']
-        func = call_function(self.topk,self.searcher_class)
+        func = call_function(self.topk,self.searcher_class,deadline=deadline)
         result = func(parameters)
-        result_str = json.dumps(result,ensure_ascii=False)
-        return result_str
+        return Operation_Utils.Json_dumps(result)
 
-    def _information_sufficient(self, inner_history: List) -> bool:
+    def _information_sufficient(self, inner_history: List, deadline: Optional[Deadline] = None) -> bool:
         thought = Prompt._get_searcher_thought_prompt(inner_history, few_shot=True)        
-        response = self._stream_chat(thought,'light_green')
+        response = self._stream_chat(thought,'light_green',deadline)
         try:
             is_sufficient = Operation_Utils.Json_parser(response)
             return "False" in str(is_sufficient.get('action'))
         except json.JSONDecodeError:
             return False
 
-    def _stream_chat(self, message: list, color: str) -> str:
+    def _stream_chat(self, message: list, color: str, deadline: Optional[Deadline] = None) -> str:
         """直接从模型获取响应。"""
+        if deadline is not None and deadline.expired():
+            return ''
+        timeout = deadline.remaining() if deadline is not None else None
         response = ''.join(
             chunk.choices[0].delta.content
-            for chunk in self.llm.stream_chat(message)
+            for chunk in self.llm.stream_chat(message, timeout=timeout)
             if chunk.choices[0].delta.content
         )
-        self.logger.log(f"Response: {response}", "debug")
+        self.logger.debug("Response: {}", response)
         return response
 
-    def get_response(self, query: str, agent_result: ResultSaves) -> str:
+    @staticmethod
+    def _partial_response(inner_history: List) -> str:
+        """Return the latest tool observation when the deadline cuts the searcher short."""
+        observations = [step['content'] for step in inner_history[1:] if step['role'] == 'user']
+        return observations[-1] if observations else ''
+
+    def get_response(
+        self,
+        query: str,
+        agent_result: ResultSaves,
+        deadline: Optional[Deadline] = None,
+        emit: Optional[Callable[[AgentEvent], None]] = None
+    ) -> str:
+        with span('searcher', query=query):
+            return self._search(query, agent_result, deadline, emit)
+
+    def _search(
+        self,
+        query: str,
+        agent_result: ResultSaves,
+        deadline: Optional[Deadline] = None,
+        emit: Optional[Callable[[AgentEvent], None]] = None
+    ) -> str:
+        sub_query = query
         query = f"## 当前问题\n{query}"
         message = [{'role': 'user', 'content': query}]
         inner_history = message[:]
         max_turn = 3
-        is_sufficient = self._information_sufficient(inner_history)
+        is_sufficient = self._information_sufficient(inner_history, deadline)
         func_params = {"name": None}
         for _ in range(max_turn):
+            if deadline is not None and deadline.expired():
+                self.logger.warning("Deadline reached, returning partial searcher result")
+                agent_result.add_cut('searcher')
+                return self._partial_response(inner_history)
             if is_sufficient or _ == max_turn-1:
-                return self._stream_chat(inner_history,'red')
+                return self._stream_chat(inner_history,'red',deadline)
             else:
                 if not func_params['name'] or func_params['name'] == 'web_select':
-                    self.logger.log("==========调用 web search 工具==========", "debug")
-                    search_tool_info_string = json.dumps(self.tool_info[0], ensure_ascii=False)
-                    search_tool_prompt = Prompt._get_web_search_prompt(inner_history,search_tool_info_string,few_shot=True)
-                    response = self._stream_chat(search_tool_prompt,'red')
+                    self.logger.debug("==========调用 web search 工具==========")
+                    search_tool_prompt = Prompt._get_web_search_prompt(inner_history,self.tool_info_strings[0],few_shot=True)
+                    response = self._stream_chat(search_tool_prompt,'red',deadline)
                     func_params = Operation_Utils.Json_parser(response)
                     inner_history.append({"role": "assistant", "content": response})
                     if func_params.get('parameters', {}) == {} or func_params.get('parameters', {}).get('query', []) == []:
                         break
-                    search_observation = self._execute_tool_call(func_params)
-                    self.logger.log(f"web search 返回结果\n{search_observation}", "debug")
+                    if emit is not None:
+                        emit(ToolCalled(sub_query, func_params['name'], json.dumps(func_params['parameters'], ensure_ascii=False)))
+                    search_observation = self._execute_tool_call(func_params, deadline)
+                    if deadline is not None and deadline.expired():
+                        agent_result.add_cut('web_search')
+                    self.logger.observation("web search", search_observation)
                     inner_history.append({"role": "user", "content": search_observation})
                     agent_result.search_function += 1 
                 elif func_params['name'] == 'web_search':
-                    self.logger.log("==========调用 web select 工具==========", "debug")
-                    select_tool_info_string = json.dumps(self.tool_info[1], ensure_ascii=False)
-                    select_prompt = Prompt._get_web_select_prompt(inner_history,select_tool_info_string,few_shot=True)
-                    response = self._stream_chat(select_prompt,'red')
+                    self.logger.debug("==========调用 web select 工具==========")
+                    select_prompt = Prompt._get_web_select_prompt(inner_history,self.tool_info_strings[1],few_shot=True)
+                    response = self._stream_chat(select_prompt,'red',deadline)
                     func_params = Operation_Utils.Json_parser(response)
                     inner_history.append({"role": "assistant", "content": response})    
+                    if emit is not None:
+                        emit(ToolCalled(sub_query, func_params.get('name'), json.dumps(func_params.get('parameters'), ensure_ascii=False)))
                     func_params['parameters']['search_results'] = json.loads(search_observation)
-                    select_observation = self._execute_tool_call(func_params)
-                    self.logger.log(f"web select 返回结果\n{select_observation}", "debug")
+                    select_observation = self._execute_tool_call(func_params, deadline)
+                    if deadline is not None and deadline.expired():
+                        agent_result.add_cut('web_select')
+                    self.logger.observation("web select", select_observation)
                     inner_history.append({"role": "user", "content": select_observation})
                 else:
                     # TODO feedback
-                    self.logger.log("Unknown function call or feedback required", "error")
+                    self.logger.error("Unknown function call or feedback required")
                     break
-            is_sufficient = self._information_sufficient(inner_history)
+            is_sufficient = self._information_sufficient(inner_history, deadline)
 
 class SearchDistributor:
     def __init__(
@@ -127,29 +175,60 @@ class SearchDistributor:
         self.max_turn = max_turn
         self.searcher_type = searcher_type
         self.tool_info = tool_info
+        self.tool_info_strings = [json.dumps(info, ensure_ascii=False) for info in tool_info]
         self.tool_map = tool_map
 
-    def distribute_searches(self, queries, agent_saves, debug):
+    def stream_searches(self, queries, agent_saves, debug, deadline: Optional[Deadline] = None) -> Generator:
+        """
+        Run one searcher per query in parallel, yielding their events as they happen.
 
-        self.searchers = [self.searcher_type(self.llm, self.max_turn, self.topk, self.searcher_class, self.tool_info, self.tool_map, debug) for _ in range(len(queries))]
-        # 创建一个字典来保存Future对象和对应的query
-        future_to_query = {}
+        Searcher threads and future completions feed a single queue that is drained
+        here, so events reach the caller in real time. The joined searcher answers
+        are the generator's return value.
+        """
+        searchers = [self.searcher_type(self.llm, self.max_turn, self.topk, self.searcher_class, self.tool_info, self.tool_map, debug, tool_info_strings=self.tool_info_strings) for _ in range(len(queries))]
+        events = queue.Queue()
 
-        with ThreadPoolExecutor(max_workers=len(self.searchers)) as executor:
-            for query, searcher in zip(queries, self.searchers):
-                future = executor.submit(searcher.get_response, query, agent_saves)
-                future_to_query[future] = query
-            content = ''
-            for future in as_completed(future_to_query):
-                query = future_to_query[future]
+        executor = ThreadPoolExecutor(max_workers=len(searchers))
+        for query, searcher in zip(queries, searchers):
+            future = executor.submit(propagate(searcher.get_response), query, agent_saves, deadline, events.put)
+            # Completed futures are queued as (query, future) next to the searcher events
+            future.add_done_callback(lambda f, q=query: events.put((q, f)))
+            yield SubSearchStarted(query)
+        content = ''
+        pending = len(searchers)
+        try:
+            while pending:
+                try:
+                    item = events.get(timeout=deadline.remaining() if deadline is not None else None)
+                except queue.Empty:
+                    # Searchers still running stop at their next deadline check
+                    agent_saves.add_cut('searcher')
+                    break
+                if isinstance(item, AgentEvent):
+                    yield item
+                    continue
+                query, future = item
+                pending -= 1
                 try:
-                    result = '##当前问题:' + query + '\n' + future.result() + '\n'
-                    content += result
-                    #print(f"Query: {query} => {result}")
+                    response = future.result()
+                    content += '##当前问题:' + query + '\n' + response + '\n'
+                    yield SubSearchFinished(query, response)
                 except Exception as exc:
                     print(f"Query: {query} generated an exception: {exc}")
+                    yield SubSearchFinished(query, '', error=str(exc))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return content
 
-            return content
+    def distribute_searches(self, queries, agent_saves, debug, deadline: Optional[Deadline] = None) -> str:
+        stream = self.stream_searches(queries, agent_saves, debug, deadline)
+        while True:
+            try:
+                next(stream)
+            except StopIteration as stop:
+                return stop.value
 
 class PlanningAgent:
     def __init__(
@@ -158,59 +237,125 @@ class PlanningAgent:
         searcher: SearchDistributor =None,
         max_turn: int = 3,
         debug: bool = False,
+        summary_reserve: float = 10.0,
+        min_summary_timeout: float = 5.0,
     ) -> None:
         self.llm = llm
         self.max_turn = max_turn
         self.searchagent = searcher
         self.debug = debug
-        self.logger = CustomLogger(debug=self.debug)
-    
+        self.summary_reserve = summary_reserve
+        self.min_summary_timeout = min_summary_timeout
+        self.logger = AgentLogger(debug=self.debug)
+
+    def _summarize(self, inner_history: List[Dict], agent_saves: ResultSaves, deadline: Deadline) -> Generator:
+        """
+        Stream the final answer as SummaryDelta events and return the full text.
+
+        The summary gets at least `min_summary_timeout` seconds even when the
+        deadline has passed; if it times out, what was streamed is the answer.
+        """
+        summary = Prompt._get_summary_prompt(inner_history)
+        timeout = deadline.remaining(hard=True)
+        if timeout is not None:
+            timeout = max(timeout, self.min_summary_timeout)
+        parts = []
+        finish_reason = None
+        with span('summary'):
+            try:
+                for chunk in self.llm.stream_chat(summary, timeout=timeout):
+                    text = chunk.choices[0].delta.content
+                    finish_reason = chunk.choices[0].finish_reason
+                    if text:
+                        parts.append(text)
+                        yield SummaryDelta(text)
+            except TimeoutError as e:
+                self.logger.warning("Summary cut: {}", e)
+            # A stream that stopped early has no finish reason on its last chunk
+            if finish_reason is None:
+                agent_saves.add_cut('summary')
+        response = ''.join(parts)
+        self.logger.debug("==========总结答案==========\n{}", response)
+        return response
+
+    def chat(self, messages: List[Dict], deadline: Union[Deadline, float, None] = None) -> ResultSaves:
+        """
+        Run stream_chat to completion and return the final ResultSaves.
+        """
+        result = None
+        for event in self.stream_chat(messages, deadline):
+            if event.kind == 'finished':
+                result = event.result
+        return result
 
-    def stream_chat(self, messages: List[Dict]) -> Generator:
+    def stream_chat(self, messages: List[Dict], deadline: Union[Deadline, float, None] = None) -> Generator:
+        """
+        Run the planning loop for a query, yielding AgentEvent deltas as it progresses.
+
+        The last event is always AgentFinished carrying the ResultSaves of the query.
+
+        :param messages: The user query as a string, a message dict or a list of messages.
+        :param deadline: Latency budget in seconds, or a Deadline shared with the caller.
+            When it runs low outstanding searches are cancelled and the answer is
+            summarised from whatever has been gathered; `cut_stages` records what was cut.
+        """
         if isinstance(messages, str):
             messages = [{'role': 'user', 'content': messages}]
         elif isinstance(messages, dict):
             messages = [messages]
-        self.logger.log(f"Messages received: {messages}", "debug")
-        inner_history = messages[:]
-        # code_history = get_code_prompt([])
-        agent_saves = ResultSaves()
-        for turn in range(self.max_turn):
-            self.logger.log(f"----------第{turn}轮思考----------","debug")
-            thought_prompt = Prompt._add_thought(inner_history,few_shot=True)
-            response = ''.join(
-                chunk.choices[0].delta.content
-                for chunk in self.llm.stream_chat(thought_prompt)
-                if chunk.choices[0].delta.content
-            )
-            self.logger.log(f"Response: {response}", "debug")
-            check = Operation_Utils.Json_parser(response)
-            if check == {}:
-                agent_saves.response = response
-                if turn == self.max_turn - 1:
-                    if not response:
-                        response = "错误"
-                    inner_history.append({"role": "assistant", "content": response})
+        if not isinstance(deadline, Deadline):
+            deadline = Deadline(deadline, reserve=self.summary_reserve)
+        with span('query', query=messages[-1].get('content', ''), budget=deadline.remaining(hard=True)):
+            self.logger.debug("Messages received: {}", messages)
+            inner_history = messages[:]
+            # code_history = get_code_prompt([])
+            agent_saves = ResultSaves()
+            for turn in range(self.max_turn):
+                if deadline.expired():
+                    self.logger.warning("Deadline reached, summarising gathered information")
+                    agent_saves.add_cut('planning')
                     agent_saves.inner_steps = inner_history
-                    yield deepcopy(agent_saves)
+                    agent_saves.response = yield from self._summarize(inner_history, agent_saves, deadline)
+                    yield AgentFinished(agent_saves)
                     return
-            elif check['search'] == [] or (turn == self.max_turn - 1):
-                summary = Prompt._get_summary_prompt(inner_history)
-                response = ''.join(
-                    chunk.choices[0].delta.content
-                    for chunk in self.llm.stream_chat(summary)
-                    if chunk.choices[0].delta.content
-                )
-                self.logger.log(f"==========总结答案==========\n{response}", "debug")
-                agent_saves.response = response
-                yield deepcopy(agent_saves)
-                return
-            else:
-                agent_saves.thought_depth += 1
-                inner_history.append({"role": "assistant", "content": response})
-                agent_saves.inner_steps = inner_history
-                agent_saves.add_search(check['search'])
-                result = self.searchagent.distribute_searches(check['search'],agent_saves,self.debug)
-                if result:
-                    inner_history.append({"role": "user", "content": result})
-        yield deepcopy(agent_saves)
+                with span('planning_turn', turn=turn):
+                    self.logger.debug("----------第{}轮思考----------", turn)
+                    thought_prompt = Prompt._add_thought(inner_history,few_shot=True)
+                    try:
+                        response = ''.join(
+                            chunk.choices[0].delta.content
+                            for chunk in self.llm.stream_chat(thought_prompt, timeout=deadline.remaining())
+                            if chunk.choices[0].delta.content
+                        )
+                    except TimeoutError as e:
+                        self.logger.warning("Planning cut: {}, summarising gathered information", e)
+                        agent_saves.add_cut('planning')
+                        agent_saves.inner_steps = inner_history
+                        agent_saves.response = yield from self._summarize(inner_history, agent_saves, deadline)
+                        yield AgentFinished(agent_saves)
+                        return
+                    self.logger.debug("Response: {}", response)
+                    check = Operation_Utils.Json_parser(response)
+                    if check == {}:
+                        agent_saves.response = response
+                        if turn == self.max_turn - 1:
+                            if not response:
+                                response = "错误"
+                            inner_history.append({"role": "assistant", "content": response})
+                            agent_saves.inner_steps = inner_history
+                            yield AgentFinished(agent_saves)
+                            return
+                    elif check['search'] == [] or (turn == self.max_turn - 1):
+                        agent_saves.response = yield from self._summarize(inner_history, agent_saves, deadline)
+                        yield AgentFinished(agent_saves)
+                        return
+                    else:
+                        agent_saves.thought_depth += 1
+                        inner_history.append({"role": "assistant", "content": response})
+                        agent_saves.inner_steps = inner_history
+                        agent_saves.add_search(check['search'])
+                        yield PlanProduced(turn, str(check.get('thought', '')), tuple(check['search']))
+                        result = yield from self.searchagent.stream_searches(check['search'],agent_saves,self.debug,deadline)
+                        if result:
+                            inner_history.append({"role": "user", "content": result})
+            yield AgentFinished(agent_saves)
@@ -0,0 +1,67 @@
+from dataclasses import dataclass, asdict
+from typing import Any, ClassVar, Dict, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class AgentEvent:
+    """
+    Base class of the events yielded by PlanningAgent.stream_chat.
+
+    Events are immutable deltas; consumers dispatch on `kind` so that they work
+    regardless of which import path loaded this module.
+    """
+    kind: ClassVar[str] = 'event'
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'event': self.kind, **asdict(self)}
+
+
+@dataclass(frozen=True)
+class PlanProduced(AgentEvent):
+    """The planner decided on the sub-questions of a turn."""
+    kind: ClassVar[str] = 'plan'
+    turn: int
+    thought: str
+    search: Tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class SubSearchStarted(AgentEvent):
+    """A searcher was started for a sub-question."""
+    kind: ClassVar[str] = 'search_started'
+    query: str
+
+
+@dataclass(frozen=True)
+class SubSearchFinished(AgentEvent):
+    """A searcher returned (or failed) for a sub-question."""
+    kind: ClassVar[str] = 'search_finished'
+    query: str
+    response: str
+    error: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class ToolCalled(AgentEvent):
+    """A searcher called a tool; `parameters` is the JSON encoded argument object."""
+    kind: ClassVar[str] = 'tool_call'
+    query: str
+    name: str
+    parameters: str
+
+
+@dataclass(frozen=True)
+class SummaryDelta(AgentEvent):
+    """A chunk of the final answer as it is decoded."""
+    kind: ClassVar[str] = 'summary_delta'
+    text: str
+
+
+@dataclass(frozen=True)
+class AgentFinished(AgentEvent):
+    """Last event of a query, carrying the complete ResultSaves."""
+    kind: ClassVar[str] = 'finished'
+    result: Any
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'event': self.kind, 'result': self.result.to_dict(self.result)}
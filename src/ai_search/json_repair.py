@@ -0,0 +1,138 @@
+import re
+import json
+from typing import List, Optional, Tuple
+
+import json5
+
+
+# Characters that can change the scanner state, outside strings and inside a string
+# closed by the given quote; everything between them is copied as is
+_OUTSIDE = re.compile(r'["\'“”{}\[\]\\]')
+_INSIDE = {
+    '"': re.compile(r'["\\\n\r\t]'),
+    "'": re.compile(r'[\'"\\\n\r\t]'),
+    '”': re.compile(r'[”"\\\n\r\t]'),
+}
+_NON_SPACE = re.compile(r'\S')
+# Quote characters that open a string outside of one, mapped to their closing quote
+_OPEN_QUOTES = {'"': '"', "'": "'", '“': '”'}
+# A quote followed by one of these (or the end of the text) closes the string
+_AFTER_CLOSE = ',:}]'
+_CONTROL = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def _next_significant(text: str, pos: int) -> str:
+    match = _NON_SPACE.search(text, pos)
+    return match.group() if match else ''
+
+
+def _drop_trailing_comma(out: List[str]) -> None:
+    while out and not out[-1].strip():
+        out.pop()
+    if out and out[-1].rstrip().endswith(','):
+        out[-1] = out[-1].rstrip()[:-1]
+
+
+def repair_object(text: str, start: int) -> Tuple[str, int]:
+    """
+    Scan the object opening at `text[start]` up to its matching brace, in one pass,
+    and return it as JSON text together with the position after it.
+
+    Repairs made on the way:
+    - unescaped quotes inside strings (a quote is taken as closing only when the
+      next non-blank character is `,`, `:`, `}` or `]`),
+    - a missing closing quote before a comma (`["0", "1, "5"]`),
+    - strings delimited by “” or '' instead of ",
+    - raw newlines and tabs inside strings,
+    - trailing commas and mismatched closing brackets,
+    - truncation: open strings and brackets are closed at the end of the text.
+    """
+    out: List[str] = []
+    stack: List[str] = []
+    quote = None          # closing quote of the current string, None outside strings
+    string_start = 0      # index in `out` where the current string's content starts
+    pos = start
+    while True:
+        match = (_OUTSIDE if quote is None else _INSIDE[quote]).search(text, pos)
+        if match is None:
+            out.append(text[pos:])
+            pos = len(text)
+            break
+        index = match.start()
+        char = match.group()
+        out.append(text[pos:index])
+        pos = index + 1
+
+        if quote is None:
+            if char == '{' or char == '[':
+                stack.append('}' if char == '{' else ']')
+                out.append(char)
+            elif char == '}' or char == ']':
+                if not stack:
+                    break
+                _drop_trailing_comma(out)
+                out.append(stack.pop())
+                if not stack:
+                    return ''.join(out), pos
+            elif char in _OPEN_QUOTES:
+                quote = _OPEN_QUOTES[char]
+                out.append('"')
+                string_start = len(out)
+            elif char != '\\' and char != '”':
+                out.append(char)
+            continue
+
+        if char == '\\':
+            out.append(text[index:index + 2])
+            pos = index + 2
+        elif char in _CONTROL:
+            out.append(_CONTROL[char])
+        elif char == quote or (quote == '”' and char == '"'):
+            following = _next_significant(text, pos)
+            if not following or following in _AFTER_CLOSE:
+                out.append('"')
+                quote = None
+                continue
+            content = ''.join(out[string_start:]).rstrip()
+            if content.endswith(','):
+                # The previous string lost its closing quote: `"1, "5"`
+                del out[string_start:]
+                out.append(content[:-1].rstrip())
+                out.append('", "')
+                string_start = len(out)
+            else:
+                out.append('\\"' if char == '"' else char)
+        else:
+            out.append('\\"')
+
+    # Truncated output: close whatever is still open
+    if quote is not None:
+        out.append('"')
+    while stack:
+        _drop_trailing_comma(out)
+        out.append(stack.pop())
+    return ''.join(out), pos
+
+
+def extract_json(text: str, max_candidates: int = 3) -> Optional[dict]:
+    """
+    Return the first JSON object embedded in a model output, repairing common
+    defects, or None when there is none. Candidates that still fail `json.loads`
+    after repair are given to json5 (unquoted keys, comments, ...).
+    """
+    start = text.find('{')
+    for _ in range(max_candidates):
+        if start == -1:
+            return None
+        repaired, end = repair_object(text, start)
+        try:
+            result = json.loads(repaired)
+        except json.JSONDecodeError:
+            try:
+                result = json5.loads(repaired)
+            except Exception:
+                result = None
+        if isinstance(result, dict):
+            return result
+        start = text.find('{', end)
+    return None
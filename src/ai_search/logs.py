@@ -0,0 +1,113 @@
+import sys
+import itertools
+import threading
+from typing import Optional
+
+from loguru import logger
+
+
+# Loguru severities of the levels used by the agents
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40, "critical": 50}
+
+_lock = threading.Lock()
+_settings: Optional[tuple] = None
+_min_level = LEVELS["info"]
+_sample_every = 10
+_observations = itertools.count()
+
+
+def configure(debug: bool = False, log_path: Optional[str] = None, sample_every: int = 10) -> None:
+    """
+    Set up the process-wide log sinks: the terminal, and `log_path` when given.
+
+    The file sink is enqueued, so records are written by a background thread and
+    logging never blocks an agent on disk I/O. Calling again with the same settings
+    is a no-op; agents call it implicitly, so a process that wants non-default
+    settings should call it before building them. An agent built with debug=True
+    in a process configured without it turns debug on, keeping the other settings.
+
+    :param debug: Emit debug records.
+    :param log_path: Also write the records to this file.
+    :param sample_every: Dump one tool observation in `sample_every`; the others are
+        logged as a one-line summary.
+    """
+    global _settings, _min_level, _sample_every
+    settings = (debug, log_path, sample_every)
+    with _lock:
+        if settings == _settings:
+            return
+        logger.remove()
+        level = "DEBUG" if debug else "INFO"
+        logger.add(
+            sys.stdout,
+            level=level,
+            format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
+                   "<level>{level: <8}</level> | "
+                   "<level>{message}</level>",
+        )
+        if log_path:
+            logger.add(
+                log_path,
+                level=level,
+                format="{time:YYYY-MM-DD HH:mm:ss} | {process} | {level: <8} | {message}",
+                enqueue=True,
+            )
+        _min_level = LEVELS[level.lower()]
+        _sample_every = max(1, sample_every)
+        _settings = settings
+
+
+def shutdown() -> None:
+    """
+    Wait for the queued records to be written.
+    """
+    logger.complete()
+
+
+class AgentLogger:
+    """
+    Logger handed to each agent. Building one is cheap: the sinks are configured
+    once per process by `configure`.
+
+    Messages are `str.format` templates whose arguments are only formatted when
+    the level is enabled, e.g. `log.debug("Response: {}", response)`; a disabled
+    level returns after one comparison.
+    """
+
+    def __init__(self, debug: bool = False):
+        if _settings is None:
+            configure(debug=debug)
+        elif debug and not _settings[0]:
+            configure(True, *_settings[1:])
+        self.debug_enabled = debug
+
+    def _emit(self, level: str, message: str, args: tuple) -> None:
+        # depth=2 attributes the record to the agent's call site, not to this class
+        logger.opt(depth=2).log(level, message, *args)
+
+    def debug(self, message: str, *args) -> None:
+        if self.debug_enabled and _min_level <= LEVELS["debug"]:
+            self._emit("DEBUG", message, args)
+
+    def info(self, message: str, *args) -> None:
+        if _min_level <= LEVELS["info"]:
+            self._emit("INFO", message, args)
+
+    def warning(self, message: str, *args) -> None:
+        if _min_level <= LEVELS["warning"]:
+            self._emit("WARNING", message, args)
+
+    def error(self, message: str, *args) -> None:
+        self._emit("ERROR", message, args)
+
+    def observation(self, name: str, observation: str) -> None:
+        """
+        Debug-log a tool observation: in full for one call in `sample_every`,
+        otherwise only its size.
+        """
+        if not self.debug_enabled or _min_level > LEVELS["debug"]:
+            return
+        if next(_observations) % _sample_every == 0:
+            self._emit("DEBUG", "{} 返回结果\n{}", (name, observation))
+        else:
+            self._emit("DEBUG", "{} 返回结果 ({} 字符, 未采样)", (name, len(observation)))
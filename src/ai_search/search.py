@@ -1,25 +1,23 @@
 import os
 import sys
 import json
+import time
 import argparse
 from tqdm import tqdm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-import multiprocessing
-
-from io import StringIO
-import pandas as pd
-from datasets import load_dataset, Dataset, concatenate_datasets
 from dotenv import load_dotenv
 
 current_dir = os.path.dirname(__file__)  
 project_root = os.path.abspath(os.path.join(current_dir, ".."))
 sys.path.append(project_root)
 
-from util import ResultSaves
-from serve import VllmServer
-from plugins import QihooWebSearch, BingSearch
-from actions import ActionExecutor, SearchAction, SelectAction
-from component import PlanningAgent, SearcherAgent, SearchDistributor
+import tracing
+import logs
+from util import expected_cost, fill_work_queue, report_utilisation
+from writer import ResultWriter, question_key
+from checkpoint import Checkpoint, CachedLLM, cached_tool
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run PlanningAgent with VllmServer")
@@ -29,94 +27,258 @@ def parse_args():
     parser.add_argument('--api_base', nargs='+', type=str, default=["http://localhost:8000/v1"], help="Base URL of the VllmServer API")
     parser.add_argument('--input_path', required=True, type=str, help="Path to the input data file")
     parser.add_argument('--save_path', required=True, type=str, help="Base path for saving results")
+    parser.add_argument('--max_model_len', type=int, default=None, help="Context length of the served model (default: read from the server)")
+    parser.add_argument('--deadline', type=float, default=None, help="Per-query latency budget in seconds")
+    parser.add_argument('--trace_path', type=str, default=None, help="Write per-stage span traces to this JSONL file")
+    parser.add_argument('--concurrency', type=int, default=1, help="Queries kept in flight per worker process")
+    parser.add_argument('--ordered', action='store_true', help="Emit results in the order queries were pulled when --concurrency > 1")
+    parser.add_argument('--cost_order', action='store_true', help="Hand out the longest expected queries first (by type/domain)")
+    parser.add_argument('--stats_dir', type=str, default=None, help="Folder of the run statistics, throughput.jsonl and cost_profile.json (default: run_stats/ in the results folder)")
     parser.add_argument('--debug', action='store_true', help="Enable debug mode")
-    return parser.parse_args()
-
+    parser.add_argument('--log_path', type=str, default=None, help="Also write the agent logs to this file (written by a background thread)")
+    parser.add_argument('--log_sample', type=int, default=10, help="In debug mode, dump one tool observation in this many")
+    args = parser.parse_args()
+    if args.num_processes <= 0:
+        parser.error("--num_processes must be greater than 0")
+    if args.concurrency <= 0:
+        parser.error("--concurrency must be greater than 0")
+    return args
 
-def split_dataset(dataset, num_process):
-    chunk_size = len(dataset) // num_process
-    chunks = [dataset.select(range(i * chunk_size, (i + 1) * chunk_size)) for i in range(num_process - 1)]
-    chunks.append(dataset.select(range((num_process - 1) * chunk_size, len(dataset))))
-    return chunks
 
-def store_agent_result(agent_result, dataset, save_path):
+def store_agent_result(agent_result, example, result_queue):
     """
-    Process a single agent_result, compare with dataset, and save the result to a JSONL file.
+    Build the result record of a finished query and hand it to the result writer.
     
     Parameters:
-        agent_result (dict): The result from an agent, to be processed.
-        dataset (Dataset): The dataset to compare with.
-        save_path (str): The file path to save the processed result.
+        agent_result (ResultSaves): The result from an agent, to be processed.
+        example (dict): The dataset record the query was taken from.
+        result_queue (Queue): Queue consumed by the single ResultWriter of the run.
     """
-    agent_result = ResultSaves.to_dict(agent_result)
-    inner_steps = agent_result.get('inner_steps', [])
-    query = next((step.get('content', None) for step in inner_steps if step.get('role') == 'user'), None)
-    
-    if not query:
-        print("No query found in agent_result.")
-        return
+    processed_data = {
+        "question": example['question'],
+        "answer": example.get('answer', None),
+        "response": agent_result.response,
+        "search": agent_result.search,
+        "thought_depth": agent_result.thought_depth,
+        "search_nums": agent_result.search_nums,
+        "search_function": agent_result.search_function,
+        "cut_stages": agent_result.cut_stages
+    }
+    # Encoded here, in the worker, so the writer thread only appends bytes
+    result_queue.put(('result', question_key(example['question']), ResultWriter.encode(processed_data)))
 
-    matching_test = next((raw for raw in dataset if raw['question'] == query), None)
+def run_queries(chat, queries, concurrency=1, ordered=False):
+    """
+    Run `chat(query)` over `queries` keeping `concurrency` of them in flight.
 
-    if not matching_test:
-        print(f"No matching test found for query: {query}")
-        return
+    Yields (query, result, error, elapsed) tuples, in completion order, or in input order
+    when `ordered` is set. At most `concurrency` queries (4x that when ordered, to
+    keep the workers busy behind a slow head) are submitted and not yet yielded,
+    so memory stays bounded regardless of the dataset size.
+    """
+    queries = iter(queries)
+    limit = concurrency * 4 if ordered else concurrency
+    window = deque()
+    future_to_query = {}
 
-    processed_data = {
-        "question": query,
-        "answer": matching_test.get('answer', None),
-        "response": agent_result.get('response', None),
-        "search": agent_result.get('search', []),
-        "thought_depth": agent_result.get('thought_depth', 0),
-        "search_nums": agent_result.get('search_nums', 0),
-        "search_function": agent_result.get('search_function', None)
+    def timed_chat(query):
+        started = time.monotonic()
+        result = chat(query)
+        return result, time.monotonic() - started
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        def fill():
+            while len(window) < limit:
+                query = next(queries, None)
+                if query is None:
+                    return
+                future = executor.submit(timed_chat, query)
+                future_to_query[future] = query
+                window.append(future)
+
+        fill()
+        while window:
+            if ordered:
+                wait([window[0]])
+                done = []
+                while window and window[0].done():
+                    done.append(window.popleft())
+            else:
+                done, _ = wait(window, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window.remove(future)
+            for future in done:
+                query = future_to_query.pop(future)
+                try:
+                    result, elapsed = future.result()
+                    yield query, result, None, elapsed
+                except Exception as e:
+                    yield query, None, e, 0.0
+            fill()
+
+def default_stats_dir(save_path):
+    """
+    Run statistics go in a subfolder of the results folder, not next to the
+    results files, which the evaluators read as one results file per model.
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(save_path)), 'run_stats')
+
+def report_throughput(stats_dir, model_name, stats):
+    """
+    Print the throughput of this run and append it to `throughput.jsonl` in
+    `stats_dir`, so runs at different --concurrency values can be compared.
+    """
+    stats = [s for s in stats if s]
+    if not stats:
+        return
+    queries = sum(s['items'] for s in stats)
+    elapsed = max(s['end'] for s in stats) - min(s['start'] for s in stats)
+    record = {
+        "model_name": model_name,
+        "num_processes": len(stats),
+        "concurrency": stats[0]['slots'],
+        "queries": queries,
+        "elapsed": round(elapsed, 2),
+        "queries_per_s": round(queries / elapsed, 3) if elapsed > 0 else 0.0,
     }
+    os.makedirs(stats_dir, exist_ok=True)
+    report_path = os.path.join(stats_dir, 'throughput.jsonl')
+    with open(report_path, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(record, ensure_ascii=False) + '\n')
 
-    with open(save_path, 'a', encoding='utf-8') as file:
-        file.write(json.dumps(processed_data, ensure_ascii=False) + '\n')
+    with open(report_path, 'r', encoding='utf-8') as file:
+        history = [json.loads(line) for line in file if line.strip()]
+    history = sorted((h for h in history if h['model_name'] == model_name), key=lambda h: (h['num_processes'], h['concurrency']))
+    print("| num_processes | concurrency | queries | elapsed (s) | queries/s |")
+    print("|---|---|---|---|---|")
+    for h in history:
+        print(f"| {h['num_processes']} | {h['concurrency']} | {h['queries']} | {h['elapsed']} | {h['queries_per_s']} |")
 
-    
+def cost_profile_path(stats_dir):
+    return os.path.join(stats_dir, 'cost_profile.json')
+
+def update_cost_profile(stats_dir, stats):
+    """
+    Merge the measured seconds per "type/domain" (and per "type") of this run into
+    `cost_profile.json`, which --cost_order uses on the next run.
+    """
+    os.makedirs(stats_dir, exist_ok=True)
+    profile_path = cost_profile_path(stats_dir)
+    totals = {}
+    if os.path.exists(profile_path):
+        with open(profile_path, 'r', encoding='utf-8') as file:
+            totals = json.load(file).get('totals', {})
+    for s in stats:
+        if not s:
+            continue
+        for key, (seconds, count) in s['costs'].items():
+            total = totals.setdefault(key, [0.0, 0])
+            total[0] += seconds
+            total[1] += count
+    profile = {key: seconds / count for key, (seconds, count) in totals.items() if count}
+    with open(profile_path, 'w', encoding='utf-8') as file:
+        json.dump({'profile': profile, 'totals': totals}, file, ensure_ascii=False, indent=4)
+
+def load_cost_profile(stats_dir):
+    profile_path = cost_profile_path(stats_dir)
+    if not os.path.exists(profile_path):
+        return None
+    with open(profile_path, 'r', encoding='utf-8') as file:
+        return json.load(file).get('profile')
 
-def run_agent_instance(model_name, api_key, api_base, dataset, save_path, debug, progress_queue):
+def run_agent_instance(model_name, api_key, api_base, dataset, work_queue, result_queue, save_path, debug, progress_queue, deadline=None, trace_path=None, concurrency=1, ordered=False, log_path=None, log_sample=10, max_model_len=None):
+    """
+    Worker process: pull dataset indices from the shared work queue until the stop
+    marker and run the agent on them, keeping `concurrency` queries in flight.
+    Results go to `result_queue`, drained by the ResultWriter of the main process.
+    """
+    # The agent stack is only needed in the workers, not in the main process
+    from serve import VllmServer
+    from plugins import BingSearch
+    from actions import ActionExecutor, SearchAction, SelectAction
+    from component import PlanningAgent, SearcherAgent, SearchDistributor
+
+    logs.configure(debug=debug, log_path=log_path, sample_every=log_sample)
+    if trace_path:
+        tracing.configure(trace_path)
     llm = VllmServer(
         model_name=model_name,
         api_key=api_key,
         api_base=api_base,
+        max_model_len=max_model_len,
     )
     tool_info, tool_map = ActionExecutor.get_tool_info(SearchAction, SelectAction)
+    checkpoint = Checkpoint(save_path)
 
-    agent = PlanningAgent(
-        llm,
-        SearchDistributor(
-            searcher_type=SearcherAgent,
-            llm=llm,
-            searcher_class=BingSearch,
-            tool_info=tool_info,
-            tool_map=tool_map,
-        ),
-        max_turn=4,
-        debug=debug
-    )
+    def chat(query):
+        # LLM and tool results are recorded per query so an interrupted query
+        # replays them on resume instead of starting over
+        step_cache = checkpoint.step_cache(query)
+        cached_llm = CachedLLM(llm, step_cache)
+        agent = PlanningAgent(
+            cached_llm,
+            SearchDistributor(
+                searcher_type=SearcherAgent,
+                llm=cached_llm,
+                searcher_class=BingSearch,
+                tool_info=tool_info,
+                tool_map={name: cached_tool(cls, step_cache) for name, cls in tool_map.items()},
+            ),
+            max_turn=4,
+            debug=debug
+        )
+        return agent.chat(query, deadline=deadline)
+
+    claimed = {}
+    def pull_queries():
+        for index in iter(work_queue.get, None):
+            example = dataset[index]
+            key = question_key(example['question'])
+            claimed[key] = example
+            result_queue.put(('running', key, None))
+            yield example['question']
 
+    processed = 0
+    busy = 0.0
+    costs = {}
+    started = time.time()
     try:
-        with tqdm(total=len(dataset), desc=f"Progress on {api_base}", position=progress_queue.get()) as pbar:
-            for query in dataset['question']:
-                agent_result = None
+        with tqdm(desc=f"Progress on {api_base}", position=progress_queue.get()) as pbar:
+            for query, agent_result, error, elapsed in run_queries(chat, pull_queries(), concurrency, ordered):
+                example = claimed.pop(question_key(query), {})
                 try:
-                    for agent_result in agent.stream_chat(query):
-                        pass
-                    store_agent_result(agent_result, dataset, save_path)
+                    if error is not None:
+                        raise error
+                    store_agent_result(agent_result, example, result_queue)
+                    for key in (f"{example.get('type')}/{example.get('domain')}", f"{example.get('type')}"):
+                        cost = costs.setdefault(key, [0.0, 0])
+                        cost[0] += elapsed
+                        cost[1] += 1
                 except Exception as e:
                     print(f"Error during query processing: {e}")                
+                processed += 1
+                busy += elapsed
                 pbar.update(1)
-        print(f"Saved processed result to {save_path}")
     except Exception as e:
         print(f"Processing failed with exception: {e}")
+    finally:
+        tracing.shutdown()
+        logs.shutdown()
+    return {
+        "name": api_base,
+        "items": processed,
+        "busy": busy,
+        "slots": concurrency,
+        "start": started,
+        "end": time.time(),
+        "costs": costs,
+    }
 
 def main():
     args = parse_args()
-    if args.num_processes <= 0:
-        parser.error("--num_processes must be greater than 0")
+
+    import multiprocessing
+    from datasets import load_dataset
 
     if args.input_path.endswith(('.json', '.jsonl')):
         dataset = load_dataset('json', data_files=args.input_path, split='train')
@@ -124,33 +286,50 @@ def main():
         dataset = load_dataset(args.input_path, split='train')    
     # Ensure the directory exists
     os.makedirs(os.path.dirname(os.path.abspath(args.save_path)), exist_ok=True)
+    stats_dir = args.stats_dir or default_stats_dir(args.save_path)
     # Checkpoint
-    if os.path.exists(args.save_path) and os.path.getsize(args.save_path) > 0:
-        checkpoint_dataset = load_dataset('json', data_files=args.save_path, split='train')
-        checkpoint_questions = set(checkpoint_dataset['question'])
-        dataset = dataset.filter(lambda x: x['question'] not in checkpoint_questions)
+    checkpoint = Checkpoint(args.save_path)
+    status = checkpoint.load()
+    statuses = [status.get(question_key(question)) for question in dataset['question']]
+    resumed = statuses.count('running')
+    if resumed:
+        print(f"Resuming {resumed} in-progress queries from cached steps.")
+    dataset = dataset.select([i for i, state in enumerate(statuses) if state != 'done'])
     
     if len(dataset) == 0:  # 或者 if not dataset:
         print("No new data to process.")
     else:
-        # Split the dataset among workers
-        if args.num_processes > 1:
-            splited_dataset = split_dataset(dataset, args.num_processes)
-        else:
-            splited_dataset = [dataset]
+        # Workers pull indices from a shared queue instead of fixed shards
+        manager = multiprocessing.Manager()
+        work_queue = manager.Queue()
+        profile = load_cost_profile(stats_dir) if args.cost_order else None
+        costs = [expected_cost(example, profile) for example in dataset] if args.cost_order else [0.0] * len(dataset)
+        fill_work_queue(work_queue, costs, args.num_processes, args.cost_order)
+        # Plain rows, so workers do not need datasets to unpickle them
+        rows = dataset.to_list()
 
-        progress_queue = multiprocessing.Manager().Queue()
+        progress_queue = manager.Queue()
         for i in range(args.num_processes):
             progress_queue.put(i)
 
-        with multiprocessing.Pool(processes=args.num_processes) as pool:
-            pool.starmap(
-                run_agent_instance,
-                [
-                    (args.model_name, args.api_key, args.api_base[i], splited_dataset[i], args.save_path, args.debug, progress_queue)
-                    for i in range(args.num_processes)
-                ],
-            )
+        # Every worker funnels its records through one writer in this process
+        result_queue = manager.Queue()
+        writer = ResultWriter(args.save_path, result_queue, checkpoint)
+        try:
+            with multiprocessing.Pool(processes=args.num_processes) as pool:
+                stats = pool.starmap(
+                    run_agent_instance,
+                    [
+                        (args.model_name, args.api_key, args.api_base[i], rows, work_queue, result_queue, args.save_path, args.debug, progress_queue, args.deadline, args.trace_path, args.concurrency, args.ordered, args.log_path, args.log_sample, args.max_model_len)
+                        for i in range(args.num_processes)
+                    ],
+                )
+        finally:
+            writer.close()
+        print(f"Saved {writer.written} processed results to {args.save_path}")
+        report_utilisation(stats)
+        update_cost_profile(stats_dir, stats)
+        report_throughput(stats_dir, args.model_name, stats)
     
 
 if __name__ == '__main__':
@@ -1,17 +1,21 @@
 import os
-import re
 import sys
 import json
-from loguru import logger
+import time
+import orjson
 
-from datetime import datetime
+from datetime import date
+from functools import lru_cache
 from dataclasses import dataclass, field
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Tuple, Union
 from termcolor import colored
 
 current_dir = os.path.dirname(__file__)  
 sys.path.append(current_dir)
+sys.path.append(os.path.abspath(os.path.join(current_dir, "..")))
 
+from tracing import span
+from json_repair import extract_json
 from prompts import (
     THOUGHT_PROMPT_CN,
     THOUGHT_FEW_SHOT_1_CN,
@@ -29,10 +33,13 @@ from prompts import (
 )
 
 
-@dataclass
+@dataclass(slots=True)
 class ResultSaves:
     """
     Class to store the result of an agent's operations.
+
+    Slotted: one is built per query and per searcher, and `inner_steps` holds the
+    message history by reference rather than a copy.
     """
     response: str = ''
     inner_steps: List = field(default_factory=list)
@@ -41,6 +48,7 @@ class ResultSaves:
     search: List[str] = field(default_factory=list)
     search_nums: int = 0
     search_function: int = 0
+    cut_stages: List[str] = field(default_factory=list)
 
     def add_search(self, new_search: list) -> None:
         """
@@ -50,6 +58,13 @@ class ResultSaves:
         self.search_nums += len(new_search)
         self.search.extend(new_search)
 
+    def add_cut(self, stage: str) -> None:
+        """
+        Record a stage that was cut short by the deadline.
+        """
+        if stage not in self.cut_stages:
+            self.cut_stages.append(stage)
+
     @staticmethod
     def to_dict(obj: Union["ResultSaves", dict]) -> Union[dict, object]:
         """
@@ -64,73 +79,170 @@ class ResultSaves:
                 'thought_depth': obj.thought_depth,
                 'search': obj.search,
                 'search_nums': obj.search_nums,
-                'search_function': obj.search_function
+                'search_function': obj.search_function,
+                'cut_stages': obj.cut_stages
             }
         if isinstance(obj, dict):
             return {k: ResultSaves.to_dict(v) for k, v in obj.items()}
         return obj
 
 
-class CustomLogger:
-    def __init__(self, debug=False):
+# Largest share of a query's budget kept for the summary
+MAX_RESERVE_SHARE = 0.5
+
+
+class Deadline:
+    """
+    Wall-clock latency budget shared by every stage of a single query.
+
+    The last `reserve` seconds of the budget, at most half of it, are kept for
+    the final summary: planning, searchers, search calls and fetches stop once
+    only the reserve is left, while the summary may run until the hard deadline.
+    """
+    # Shortest per-call timeout handed out: requests rejects a timeout of 0
+    MIN_TIMEOUT = 0.1
+
+    def __init__(self, budget: Optional[float] = None, reserve: float = 0.0):
+        self.expires_at = None if budget is None else time.monotonic() + budget
+        # A short budget still leaves planning some time
+        self.reserve = min(reserve, budget * MAX_RESERVE_SHARE) if budget is not None else reserve
+
+    def remaining(self, hard: bool = False) -> Optional[float]:
         """
-        初始化日志配置
-        :param debug: 是否启用调试模式
+        Seconds left before the deadline, or None when there is no budget.
+
+        :param hard: Ignore the summary reserve and measure up to the hard deadline.
         """
-        self.debug = debug
-
-        # 配置 Loguru
-        logger.remove()  # 移除默认处理器
-        log_level = "DEBUG" if debug else "INFO"
-        # 添加终端处理器
-        logger.add(
-            sys.stdout,
-            level=log_level,
-            format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> | "
-                   "<level>{level: <8}</level> | "
-                   "<cyan>{message}</cyan>",
-        )
+        if self.expires_at is None:
+            return None
+        end = self.expires_at if hard else self.expires_at - self.reserve
+        return max(0.0, end - time.monotonic())
 
-        # 可选：添加日志文件处理器
-        # logger.add(
-        #     "application.log",
-        #     level=log_level,
-        #     format="{time:YYYY-MM-DD HH:mm:ss} | {level: <8} | {message}",
-        #     rotation="1 MB",  # 每 1 MB 生成一个新日志文件
-        #     retention="7 days",  # 保留 7 天的日志文件
-        # )
+    def expired(self, hard: bool = False) -> bool:
+        remaining = self.remaining(hard)
+        return remaining is not None and remaining <= 0.0
 
-    def log(self, message, level="info"):
+    def timeout(self, default: Optional[float] = None, hard: bool = False) -> Optional[float]:
         """
-        自定义日志方法，支持不同日志级别的颜色
-        :param message: 日志消息
-        :param level: 日志级别 (debug, info, warning, error, critical)
+        Clamp a per-call timeout to the time left in the budget, but not below
+        MIN_TIMEOUT: a call made past the deadline fails fast.
         """
-        level_colors = {
-            "debug": "blue",
-            "info": "green",
-            "warning": "yellow",
-            "error": "red",
-            "critical": "magenta"
-        }
-        color = level_colors.get(level, "white")
-        colored_message = colored(message, color)
-
-        # 使用 loguru 记录日志
-        if level == "debug":
-            logger.debug(colored_message)
-        elif level == "info":
-            logger.info(colored_message)
-        elif level == "warning":
-            logger.warning(colored_message)
-        elif level == "error":
-            logger.error(colored_message)
-        elif level == "critical":
-            logger.critical(colored_message)
-     
+        remaining = self.remaining(hard)
+        if remaining is None:
+            return default
+        remaining = max(remaining, self.MIN_TIMEOUT)
+        if default is None:
+            return remaining
+        return min(default, remaining)
+
+
+# Relative cost of the benchmark question types, used when no measured profile exists
+TYPE_COST = {
+    'simple': 1.0,
+    'condition': 2.0,
+    'comparison': 2.5,
+    'multi-hop': 3.0,
+}
+
+
+def expected_cost(example: Dict, profile: Optional[Dict[str, float]] = None) -> float:
+    """
+    Expected processing cost of a benchmark example from its `type` and `domain`.
+
+    :param profile: Measured mean seconds keyed by "type/domain" or "type", as written
+        by the batch runner after a run; falls back to TYPE_COST.
+    """
+    q_type = example.get('type')
+    if profile:
+        key = f"{q_type}/{example.get('domain')}"
+        if key in profile:
+            return profile[key]
+        if q_type in profile:
+            return profile[q_type]
+    return TYPE_COST.get(q_type, 1.0)
+
+
+def fill_work_queue(work_queue, costs: List[float], num_workers: int, cost_order: bool = False) -> None:
+    """
+    Put every dataset index on the shared work queue, followed by one stop marker
+    per worker. With `cost_order` the most expensive items are handed out first so
+    that no worker is left with a long query at the end.
+    """
+    indices = range(len(costs))
+    if cost_order:
+        indices = sorted(indices, key=costs.__getitem__, reverse=True)
+    for index in indices:
+        work_queue.put(index)
+    for _ in range(num_workers):
+        work_queue.put(None)
+
+
+def report_utilisation(stats: List[Dict]) -> None:
+    """
+    Print per-worker utilisation for a work-queue run.
+
+    Each entry holds the worker `name`, `items` processed, `busy` seconds spent on
+    items, `slots` (items processed concurrently) and `start`/`end` wall-clock times.
+    """
+    stats = [s for s in stats if s]
+    if not stats:
+        return
+    start = min(s['start'] for s in stats)
+    end = max(s['end'] for s in stats)
+    wall = max(end - start, 1e-9)
+    print("| worker | items | busy (s) | finished at (s) | utilisation |")
+    print("|---|---|---|---|---|")
+    for s in stats:
+        utilisation = s['busy'] / (wall * s.get('slots', 1))
+        print(f"| {s['name']} | {s['items']} | {s['busy']:.1f} | {s['end'] - start:.1f} | {utilisation:.2%} |")
 
 
 class Prompt:
+    """
+    Message builders for the agent prompts.
+
+    The system/user prompt messages are built once per (template, tool set, date)
+    and cached; builders return new lists that hold the cached message dicts by
+    reference, so callers must not mutate the messages they get back.
+    """
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _thought_prefix(few_shot: bool, today: date) -> Tuple[Dict, ...]:
+        timestamp = today.strftime('The current date is %Y-%m-%d.')
+        tought_prompt = THOUGHT_PROMPT_CN + '\n' + THOUGHT_FEW_SHOT_3_CN if few_shot else THOUGHT_PROMPT_CN
+        return (dict(role='system', content=timestamp), dict(role='system', content=tought_prompt))
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _web_search_prefix(tool_info_string: str, few_shot: bool, today: date) -> Tuple[Dict, ...]:
+        meta_prompt = today.strftime("当前日期: %Y-%m-%d.")
+        search_prompt = SEARCH_TOOL_PROMPT_CN.format(
+            current_date=meta_prompt,
+            tool_info=tool_info_string
+        )
+        search_prompt = search_prompt + '\n' + SEARCH_TOOL_FEW_SHOT_3_CN if few_shot else search_prompt
+        return (dict(role='system', content=search_prompt),)
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _searcher_thought_suffix(few_shot: bool) -> Tuple[Dict, ...]:
+        search_thought_prompt = SEARCHER_THOUGHT_PROMPT_CN + '\n' + SEARCHER_THOUGHT_FEW_SHOT_3_CN if few_shot else SEARCHER_THOUGHT_PROMPT_CN
+        return (dict(role='user', content=search_thought_prompt),)
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _web_select_prefix(tool_info_string: str, few_shot: bool) -> Tuple[Dict, ...]:
+        select_prompt = SELECT_TOOL_PROMPT_CN.format(
+            tool_info=tool_info_string
+        )
+        select_prompt = select_prompt + '\n' + SELECT_TOOL_FEW_SHOT_3_CN if few_shot else select_prompt
+        return (dict(role='system', content=select_prompt),)
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def _summary_prefix() -> Tuple[Dict, ...]:
+        return (dict(role='system', content=SUMMARY_PROMPT_CN),)
+
     @staticmethod
     def _add_thought(message: List[Dict], few_shot: bool = True) -> List[Dict]:
         """
@@ -139,14 +251,8 @@ class Prompt:
         :param message: List of message dictionaries to format.
         :return: Formatted list of messages including the thought prompt.
         """
-        formatted = []
-        # Add current date as a system message
-        timestamp = datetime.now().strftime('The current date is %Y-%m-%d.')
-        formatted.append(dict(role='system', content=timestamp))
-        # Add the thought prompt
-        tought_prompt = THOUGHT_PROMPT_CN + '\n' + THOUGHT_FEW_SHOT_3_CN if few_shot else THOUGHT_PROMPT_CN
-        formatted.append(dict(role='system', content=tought_prompt))
-        # Append user-provided messages
+        # Current date and thought prompt as system messages, then the user-provided messages
+        formatted = list(Prompt._thought_prefix(few_shot, date.today()))
         formatted += message
         return formatted
 
@@ -159,21 +265,7 @@ class Prompt:
         :param tool_info_string: tool_info_string to format.
         :return: Formatted list of messages including the searcher thought prompt.
         """
-        formatted = []
-        # Generate formatted date
-        meta_time = "当前日期: %Y-%m-%d."
-        meta_prompt = datetime.now().strftime(meta_time)
-
-        # Format the searcher prompt with dynamic data
-        search_prompt = SEARCH_TOOL_PROMPT_CN.format(
-            current_date=meta_prompt,
-            tool_info=tool_info_string
-        )
-        
-        search_prompt = search_prompt + '\n' + SEARCH_TOOL_FEW_SHOT_3_CN if few_shot else search_prompt
-        # Add the searcher system prompt
-        formatted.append(dict(role='system', content=search_prompt))
-        # Append user-provided messages
+        formatted = list(Prompt._web_search_prefix(tool_info_string, few_shot, date.today()))
         formatted += message
         return formatted
 
@@ -185,12 +277,8 @@ class Prompt:
         :param message: List of message dictionaries to format.
         :return: Formatted list of messages including the searcher thought prompt.
         """
-        formatted = []
-        # Append user-provided messages
-        formatted += message
-        search_thought_prompt = SEARCHER_THOUGHT_PROMPT_CN + '\n' + SEARCHER_THOUGHT_FEW_SHOT_3_CN if few_shot else SEARCHER_THOUGHT_PROMPT_CN
-        # Add the searcher thought user prompt
-        formatted.append(dict(role='user', content=search_thought_prompt))
+        formatted = list(message)
+        formatted += Prompt._searcher_thought_suffix(few_shot)
         return formatted
 
     @staticmethod
@@ -202,15 +290,7 @@ class Prompt:
         :param tool_info_string: tool_info_string to format.
         :return: Formatted list of messages including the searcher select prompt.
         """
-        formatted = []
-        # Format the searcher prompt with dynamic data
-        select_prompt = SELECT_TOOL_PROMPT_CN.format(
-            tool_info=tool_info_string
-        )
-        select_prompt = select_prompt + '\n' + SELECT_TOOL_FEW_SHOT_3_CN if few_shot else select_prompt
-        # Add the searcher select system prompt
-        formatted.append(dict(role='system', content=select_prompt))
-        # Append user-provided messages
+        formatted = list(Prompt._web_select_prefix(tool_info_string, few_shot))
         formatted += message
         # Remove the second last message
         formatted.pop(-2)
@@ -224,19 +304,25 @@ class Prompt:
         :param message: List of message dictionaries to format.
         :return: Formatted list of messages including the summary prompt.
         """
-        formatted = []
-        # Add the summary system prompt
-        formatted.append(dict(role='system', content=SUMMARY_PROMPT_CN))
-        # Append user-provided messages
+        formatted = list(Prompt._summary_prefix())
         formatted += message
-
-        # # Process assistant messages to extract chain content
-        # for item in formatted:
-        #     if item['role'] == 'assistant':
-        #         item['content'] = json.loads(item['content'])['chain']
         return formatted
 
 class Operation_Utils:
+    @staticmethod
+    def Json_dumps(obj) -> str:
+        """
+        Serialize a tool observation to JSON text, non-ASCII characters unescaped.
+
+        Observations are keyed by result index, so non-string keys are converted
+        like `json.dumps` does; output is compact.
+        """
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            # Lone surrogates in fetched pages, which orjson refuses to encode
+            return json.dumps(obj, ensure_ascii=False)
+
     @staticmethod
     def Json_parser(response: str) -> dict:
         """
@@ -245,32 +331,27 @@ class Operation_Utils:
         :param response: 包含 JSON 数据的字符串
         :return: 解析后的 JSON 数据（字典）；如果解析失败，返回空字典 {}
         """
-        result = {}
-        try:
-            result = json.loads(response)
-            return result
-        except json.JSONDecodeError:
-            matches = re.findall(r'\{.*\}', response)
-            if matches:
-                try:
-                    result = json.loads(matches[0])
-                    return result
-                except json.JSONDecodeError:
-                    pass
+        with span('parse', kind='json', chars=len(response or '')):
+            return Operation_Utils._parse_json(response)
+
+    @staticmethod
+    def _parse_json(response: str) -> dict:
+        if not response:
+            return {}
+        # Well-formed output, bare or wrapped in prose or code fences, needs a single json.loads
+        start = response.find('{')
+        end = response.rfind('}')
+        if start != -1 and end > start:
             try:
-                start = response.find("{")
-                end = response.rfind("}") + 1
-                if start != -1 and end > start:
-                    json_content = response[start:end].strip().replace("\n", "").replace("\r", "")
-                    json_content = json_content.replace("“", "\"").replace("”", "\"")
-                    result = json.loads(json_content)
+                result = json.loads(response[start:end + 1])
+                if isinstance(result, dict):
                     return result
             except json.JSONDecodeError:
-                print(colored(f"Error: 提取到的 JSON 无法解析\n{json_content}", 'red'))
-
-        except Exception as e:
-            print(colored(f"Error 未找到有效的 JSON 数据: {e}", 'red'))
-
+                pass
+        result = extract_json(response)
+        if result is None:
+            print(colored(f"Error 未找到有效的 JSON 数据\n{response}", 'red'))
+            return {}
         return result
 
 def align_json_answers(test_set_path, eval_folder_path):
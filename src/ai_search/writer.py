@@ -0,0 +1,99 @@
+import os
+import time
+import orjson
+import queue
+import hashlib
+import threading
+from typing import List, Tuple
+
+
+def question_key(question: str) -> str:
+    """
+    Stable short hash of a question, used to index results and checkpoints.
+    """
+    return hashlib.sha1(question.encode('utf-8')).hexdigest()[:16]
+
+
+class ResultWriter:
+    """
+    Single writer for a JSONL results file.
+
+    Messages arrive on `result_queue` (a multiprocessing.Manager queue shared by all
+    worker processes) as (kind, key, payload) tuples: ('result', key, line) for a
+    finished query, `line` being the record already encoded by `encode` in the
+    worker so that serialization is spread over the workers, and
+    ('running', key, None) when a worker starts one. One
+    background thread buffers them and appends whole lines with a single O_APPEND
+    write, followed by an fsync, every `batch_size` records or `flush_interval`
+    seconds, so a crash never leaves interleaved lines from different workers.
+    With a `checkpoint`, every durable batch is recorded in its index.
+    """
+    _STOP = '__stop__'
+
+    def __init__(self, save_path: str, result_queue, checkpoint=None, batch_size: int = 32, flush_interval: float = 5.0):
+        self.save_path = save_path
+        self.result_queue = result_queue
+        self.checkpoint = checkpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._buffer: List[Tuple[str, bytes]] = []
+        self._running: List[str] = []
+        self._fd = os.open(save_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._offset = os.fstat(self._fd).st_size
+        self._thread = threading.Thread(target=self._run, name='result-writer', daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def encode(record: dict) -> bytes:
+        """
+        A result record as a UTF-8 JSONL line.
+        """
+        return orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE)
+
+    def _run(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - last_flush))
+            try:
+                message = self.result_queue.get(timeout=timeout)
+            except queue.Empty:
+                message = None
+            if message == self._STOP:
+                break
+            if message is not None:
+                kind, key, payload = message
+                if kind == 'running':
+                    self._running.append(key)
+                else:
+                    line = payload if isinstance(payload, bytes) else self.encode(payload)
+                    self._buffer.append((key, line))
+            if len(self._buffer) >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval:
+                self._flush()
+                last_flush = time.monotonic()
+        self._flush()
+
+    def _flush(self) -> None:
+        if self.checkpoint is not None and self._running:
+            self.checkpoint.mark_running(self._running)
+        self._running = []
+        if not self._buffer:
+            return
+        done = []
+        for key, line in self._buffer:
+            done.append((key, self._offset))
+            self._offset += len(line)
+        os.write(self._fd, b''.join(line for _, line in self._buffer))
+        os.fsync(self._fd)
+        if self.checkpoint is not None:
+            self.checkpoint.mark_done(done)
+        self.written += len(self._buffer)
+        self._buffer = []
+
+    def close(self) -> None:
+        """
+        Write everything still queued and close the file.
+        """
+        self.result_queue.put(self._STOP)
+        self._thread.join()
+        os.close(self._fd)
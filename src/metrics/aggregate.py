@@ -0,0 +1,213 @@
+"""
+Summary of a scored results file: the leaderboard row, per-slice means and
+percentiles of the per-query stats.
+
+Scored rows are collected into typed columns as they are written out, then every
+aggregate is a NumPy operation over whole columns: slices are integer codes, and
+their counts and sums one `bincount` per metric.
+"""
+import os
+import json
+import math
+from array import array
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Question fields the scores are broken down by
+SLICES = ('type', 'source', 'domain')
+# Per-query numeric fields summarized when present: agent stats, then timing and token usage
+STATS = ('search_nums', 'search_function', 'thought_depth', 'latency', 'elapsed', 'prompt_tokens', 'completion_tokens', 'total_tokens')
+PERCENTILES = (0.5, 0.9, 0.99)
+# Leaderboard columns of the agent stats, as named in the leaderboard markdown
+LEADERBOARD_STATS = (('agent_count', 'search_nums'), ('search_count', 'search_function'))
+
+
+class ScoreColumns:
+    """
+    The columns of the scored rows that the summary needs, kept while the rows
+    themselves are written out and dropped: whether the query failed ("错误"),
+    the metric scores, the numeric stats (NaN when missing) and the slice fields
+    (codes into `labels`, -1 when missing).
+
+    :param metadata: Slice fields per question, from the benchmark file, for rows
+        that do not carry them.
+    """
+    def __init__(self, metrics: Sequence[str], metadata: Optional[Dict[str, Dict]] = None):
+        self.metrics = list(metrics)
+        self.metadata = metadata or {}
+        self.failed = array('b')
+        self.scores = {metric: array('d') for metric in self.metrics}
+        self.stats = {name: array('d') for name in STATS}
+        self.slices = {name: array('i') for name in SLICES}
+        self.labels: Dict[str, Dict[str, int]] = {name: {} for name in SLICES}
+
+    def add(self, row: Dict) -> None:
+        self.failed.append(row.get('response') == '错误')
+        for metric in self.metrics:
+            self.scores[metric].append(float(row[metric]))
+        meta = self.metadata.get(row.get('question'), {})
+        for name in SLICES:
+            label = row.get(name) or meta.get(name)
+            codes = self.labels[name]
+            self.slices[name].append(-1 if label is None else codes.setdefault(str(label), len(codes)))
+        for name in STATS:
+            value = row.get(name)
+            self.stats[name].append(float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else math.nan)
+
+    def __len__(self) -> int:
+        return len(self.failed)
+
+
+def load_metadata(benchmark_path: Optional[str]) -> Dict[str, Dict]:
+    """
+    Slice fields of the questions of a benchmark file, keyed by question.
+    """
+    if not benchmark_path:
+        return {}
+    with open(benchmark_path, 'r') as f:
+        return {row['question']: {name: row.get(name) for name in SLICES} for row in json.load(f)}
+
+
+def summarize(columns: ScoreColumns) -> Dict:
+    """
+    Metric means over the answered queries ("错误" excluded), overall and per
+    slice; stat means and pass rate over all the queries; stat percentiles.
+    Slices and stats that no row has are left out.
+    """
+    import numpy as np
+
+    answered = np.frombuffer(columns.failed, dtype=np.int8) == 0
+    scores = {metric: np.frombuffer(values, dtype=np.float64)[answered] for metric, values in columns.scores.items()}
+    count = int(answered.sum())
+    summary = {
+        "rows": len(answered),
+        "answered": count,
+        "pass_rate": count / len(answered) if len(answered) else 0.0,
+        "metrics": {metric: float(values.mean()) if count else math.nan for metric, values in scores.items()},
+        "stats": {},
+        "percentiles": {},
+        "slices": {},
+    }
+    for name, values in columns.stats.items():
+        values = np.frombuffer(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            continue
+        summary["stats"][name] = float(values.mean())
+        summary["percentiles"][name] = {
+            f"p{round(q * 100)}": float(value) for q, value in zip(PERCENTILES, np.quantile(values, PERCENTILES))
+        }
+    for name, codes in columns.slices.items():
+        if not columns.labels[name]:
+            continue
+        # Code 0 gathers the rows without the field
+        codes = np.frombuffer(codes, dtype=np.int32)[answered] + 1
+        labels = ['unknown', *columns.labels[name]]
+        counts = np.bincount(codes, minlength=len(labels))
+        sums = {metric: np.bincount(codes, weights=values, minlength=len(labels)) for metric, values in scores.items()}
+        summary["slices"][name] = {
+            label: {"count": int(counts[i]), **{metric: float(sums[metric][i] / counts[i]) for metric in scores}}
+            for i, label in enumerate(labels) if counts[i]
+        }
+    return summary
+
+
+def summary_markdown(summary: Dict, metrics: List[str]) -> str:
+    lines = []
+    for field, groups in summary["slices"].items():
+        headers = [field, "count"] + metrics
+        lines.append("| " + " | ".join(headers) + " |")
+        lines.append("|" + " | ".join(["---"] * len(headers)) + "|")
+        for group, values in sorted(groups.items()):
+            lines.append("| " + " | ".join([group, str(values["count"])] + [str(round(values[m], 4)) for m in metrics]) + " |")
+        lines.append("")
+    if summary["percentiles"]:
+        headers = ["stat", "mean"] + [f"p{round(q * 100)}" for q in PERCENTILES]
+        lines.append("| " + " | ".join(headers) + " |")
+        lines.append("|" + " | ".join(["---"] * len(headers)) + "|")
+        for name, values in summary["percentiles"].items():
+            cells = [name, str(round(summary["stats"][name], 2))] + [str(round(value, 2)) for value in values.values()]
+            lines.append("| " + " | ".join(cells) + " |")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def leaderboard_row(summary: Dict, model_name: str, metrics: List[str]) -> Tuple[List[str], List]:
+    """
+    Leaderboard headers and row of a run. The agent stat columns are only there
+    when the rows have the stats.
+    """
+    headers = ["Model Name"] + metrics
+    row = [model_name] + [round(summary["metrics"][m], 2) for m in metrics]
+    if all(stat in summary["stats"] for _, stat in LEADERBOARD_STATS):
+        headers = headers + [column for column, _ in LEADERBOARD_STATS] + ["pass_rate"]
+        row = row + [round(summary["stats"][stat], 2) for _, stat in LEADERBOARD_STATS] + [round(summary["pass_rate"], 2)]
+    return headers, row
+
+
+def append_leaderboard_row(summary: Dict, model_name: str, metrics: List[str], output_path: str) -> None:
+    """
+    Append the run to the leaderboard markdown, writing its header first when the
+    file does not start with one.
+    """
+    headers, row = leaderboard_row(summary, model_name, metrics)
+    for header, value in zip(headers[1:], row[1:]):
+        print(f"{header.replace('_', ' ') if header == 'pass_rate' else header + ' avg score'}: {value}")
+
+    try:
+        with open(output_path, "r") as file:
+            first = file.readline()
+            if not first.strip().startswith("| Model Name"):
+                raise FileNotFoundError
+    except FileNotFoundError:
+        with open(output_path, "w") as file:
+            file.write("| " + " | ".join(headers) + " |\n")
+            file.write("|" + " | ".join(["---"] * len(headers)) + "|\n")
+
+    with open(output_path, "a") as file:
+        file.write("| " + " | ".join(map(str, row)) + " |\n")
+    print(f"Results saved to {output_path}")
+
+
+def save_leaderboard(summaries: Dict[str, Dict], metrics: List[str], output_path: str) -> None:
+    """
+    Write the leaderboard of several runs at once, as markdown to `output_path`
+    and as JSON (the full summaries) next to it.
+    """
+    rows = [leaderboard_row(summary, model_name, metrics) for model_name, summary in summaries.items()]
+    headers = max((headers for headers, _ in rows), key=len, default=["Model Name"] + metrics)
+    with open(output_path, "w") as file:
+        file.write("| " + " | ".join(headers) + " |\n")
+        file.write("|" + " | ".join(["---"] * len(headers)) + "|\n")
+        for _, row in rows:
+            row = row + [''] * (len(headers) - len(row))
+            file.write("| " + " | ".join(map(str, row)) + " |\n")
+    with open(os.path.splitext(output_path)[0] + ".json", "w", encoding="utf-8") as f:
+        json.dump(summaries, f, ensure_ascii=False, indent=4)
+    print(f"Results saved to {output_path}")
+
+
+def write_summary(summary: Dict, model_name: str, metrics: List[str], summary_path: str) -> str:
+    """
+    Write the summary of a run as JSON to `summary_path` and its slice and
+    percentile tables as markdown next to it. Returns the tables.
+    """
+    tables = summary_markdown(summary, metrics)
+    os.makedirs(os.path.dirname(os.path.abspath(summary_path)), exist_ok=True)
+    with open(summary_path, "w", encoding="utf-8") as f:
+        json.dump({"model_name": model_name, **summary}, f, ensure_ascii=False, indent=4)
+    with open(os.path.splitext(summary_path)[0] + ".md", "w", encoding="utf-8") as f:
+        f.write(tables)
+    return tables
+
+
+def save_summary(columns: ScoreColumns, model_name: str, leaderboard_path: str, summary_path: str) -> Dict:
+    """
+    Summarize the scored rows: append the leaderboard row and write the summary
+    (see `write_summary`).
+    """
+    summary = summarize(columns)
+    append_leaderboard_row(summary, model_name, columns.metrics, leaderboard_path)
+    tables = write_summary(summary, model_name, columns.metrics, summary_path)
+    if tables:
+        print(tables)
+    return summary
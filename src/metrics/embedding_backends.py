@@ -0,0 +1,92 @@
+from typing import Dict, List, Optional, Type
+
+import numpy as np
+
+
+class SentenceTransformerBackend:
+    """
+    fp32 SentenceTransformer embeddings, the reference of the other backends.
+
+    Backends load their model on the first `encode`, so that a run whose texts
+    are all in the EmbeddingCache never loads one. `name` keys the cache: vectors
+    of different backends are never mixed.
+    """
+    kind = 'torch'
+
+    def __init__(self, model_path: str, batch_size: int = 64, device: Optional[str] = None, **kwargs):
+        self.model_path = model_path
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+
+    @property
+    def name(self) -> str:
+        return self.model_path
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        return SentenceTransformer(self.model_path, device=self.device)
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = self._load()
+        return self._model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """
+        Normalized embeddings of `texts`, as a (len(texts), dim) float32 array.
+        """
+        return self.model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True, convert_to_numpy=True)
+
+
+class Int8Backend(SentenceTransformerBackend):
+    """
+    The SentenceTransformer with its linear layers dynamically quantized to int8,
+    for CPU-only evaluation machines.
+    """
+    kind = 'int8'
+
+    @property
+    def name(self) -> str:
+        return f"{self.model_path}#int8"
+
+    def _load(self):
+        import torch
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(self.model_path, device='cpu')
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend(SentenceTransformerBackend):
+    """
+    The SentenceTransformer run by ONNX Runtime on CPU (needs optimum and
+    onnxruntime). `file_name` selects an export inside the model directory,
+    e.g. a quantized one such as 'onnx/model_qint8_avx512_vnni.onnx'; without it
+    the model is exported on first use.
+    """
+    kind = 'onnx'
+
+    def __init__(self, model_path: str, batch_size: int = 64, device: Optional[str] = None, file_name: Optional[str] = None, **kwargs):
+        super().__init__(model_path, batch_size, device)
+        self.file_name = file_name
+
+    @property
+    def name(self) -> str:
+        return f"{self.model_path}#onnx:{self.file_name or 'model.onnx'}"
+
+    def _load(self):
+        from sentence_transformers import SentenceTransformer
+        model_kwargs = {'file_name': self.file_name} if self.file_name else None
+        return SentenceTransformer(self.model_path, device='cpu', backend='onnx', model_kwargs=model_kwargs)
+
+
+BACKENDS: Dict[str, Type[SentenceTransformerBackend]] = {
+    backend.kind: backend for backend in (SentenceTransformerBackend, Int8Backend, OnnxBackend)
+}
+
+
+def load_backend(kind: str, model_path: str, **kwargs) -> SentenceTransformerBackend:
+    if kind not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{kind}', expected one of {', '.join(BACKENDS)}")
+    return BACKENDS[kind](model_path, **kwargs)
@@ -0,0 +1,180 @@
+import os
+import glob
+import time
+import fcntl
+import hashlib
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+# Segments kept before they are merged into one when a cache is opened
+MAX_SEGMENTS = 64
+KEY_SIZE = 20
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode('utf-8')).digest()
+
+
+def model_key(model_name: str) -> str:
+    """
+    File name of a model's cache: readable base name plus a hash of the full path.
+    """
+    base = os.path.basename(os.path.normpath(model_name)) or 'model'
+    return f"{base}-{hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def segment_keys(records: np.ndarray) -> List[bytes]:
+    """
+    The keys of a segment as stored: reading them as 'S' items would strip the
+    trailing zero bytes of a digest.
+    """
+    raw = np.ascontiguousarray(records['key']).tobytes()
+    return [raw[start:start + KEY_SIZE] for start in range(0, len(raw), KEY_SIZE)]
+
+
+class EmbeddingCache:
+    """
+    Normalized text embeddings of one model, persisted across evaluation runs.
+
+    The cache is a directory of append-only .npy segments of (sha1 of the text,
+    vector) records, opened memory-mapped: a run reads only the vectors it needs
+    and encodes only the texts no earlier run has seen. The key index is built
+    once, and then extended with the segments written since, by this or by
+    another evaluator sharing the cache. Each write is a new segment, renamed
+    into place under the cache's file lock, so writers never lose each other's
+    vectors and readers never see a partial segment.
+
+    :param cache_dir: Directory of the caches, one subdirectory per model.
+    :param model_name: Embedding model path or name, part of the cache key.
+    :param encode: Encodes a list of texts into a (len(texts), dim) array of
+        normalized embeddings; only called for texts missing from the cache.
+    """
+
+    def __init__(self, cache_dir: str, model_name: str, encode: Callable[[List[str]], np.ndarray]):
+        self.dir = os.path.join(cache_dir, model_key(model_name))
+        os.makedirs(self.dir, exist_ok=True)
+        self.lock_path = os.path.join(self.dir, '.lock')
+        self.encode = encode
+        self.hits = 0
+        self.misses = 0
+        self._segments: Dict[str, np.ndarray] = {}
+        self._index: Dict[bytes, Tuple[str, int]] = {}
+        if len(self._segment_paths()) > MAX_SEGMENTS:
+            self.compact()
+        self._refresh()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _segment_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.dir, 'segment-*.npy')))
+
+    def _refresh(self) -> None:
+        """
+        Index the segments written since the last refresh.
+        """
+        for path in self._segment_paths():
+            name = os.path.basename(path)
+            if name in self._segments:
+                continue
+            try:
+                records = np.load(path, mmap_mode='r')
+            except FileNotFoundError:
+                # Merged away by another evaluator's compact(); its records are in the merged segment
+                continue
+            self._segments[name] = records
+            for row, key in enumerate(segment_keys(records)):
+                self._index.setdefault(key, (name, row))
+
+    def _write_segment(self, keys: List[bytes], vectors: np.ndarray) -> str:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dtype = np.dtype([('key', f'S{KEY_SIZE}'), ('vector', np.float32, (vectors.shape[1],))])
+        name = f"segment-{time.time_ns()}-{os.getpid()}.npy"
+        tmp_path = os.path.join(self.dir, name + '.tmp')
+        records = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=(len(keys),))
+        records['key'] = keys
+        records['vector'] = vectors
+        records.flush()
+        del records
+        os.replace(tmp_path, os.path.join(self.dir, name))
+        return name
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray) -> None:
+        with self._locked():
+            # Another evaluator may have stored some of them meanwhile
+            self._refresh()
+            new = [i for i, key in enumerate(keys) if key not in self._index]
+            if new:
+                self._write_segment([keys[i] for i in new], np.asarray(vectors)[new])
+            self._refresh()
+
+    def compact(self) -> None:
+        """
+        Merge the segments into one. Vectors already mapped by a running
+        evaluator stay readable: removed segments live on until it unmaps them.
+        """
+        with self._locked():
+            paths = self._segment_paths()
+            if len(paths) < 2:
+                return
+            seen = set()
+            keys = []
+            rows = []
+            vectors = []
+            for path in paths:
+                records = np.load(path, mmap_mode='r')
+                for row, key in enumerate(segment_keys(records)):
+                    if key not in seen:
+                        seen.add(key)
+                        keys.append(key)
+                        rows.append(row)
+                vectors.append(records['vector'][rows])
+                rows = []
+            self._write_segment(keys, np.concatenate(vectors))
+            for path in paths:
+                os.remove(path)
+        self._segments = {}
+        self._index = {}
+        self._refresh()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        Embeddings of `texts`, in order, as a (len(texts), dim) float32 array.
+        Each distinct text is looked up, or encoded, once.
+        """
+        unique = list(dict.fromkeys(texts))
+        if not unique:
+            return np.zeros((0, 0), dtype=np.float32)
+        keys = [text_key(text) for text in unique]
+        missing = [i for i, key in enumerate(keys) if key not in self._index]
+        if missing:
+            # Written by another evaluator since the last lookup
+            self._refresh()
+            missing = [i for i in missing if keys[i] not in self._index]
+        self.hits += len(unique) - len(missing)
+        self.misses += len(missing)
+        if missing:
+            self._append([keys[i] for i in missing], self.encode([unique[i] for i in missing]))
+        # One gather per segment
+        by_segment: Dict[str, Tuple[List[int], List[int]]] = {}
+        for i, key in enumerate(keys):
+            name, row = self._index[key]
+            positions, rows = by_segment.setdefault(name, ([], []))
+            positions.append(i)
+            rows.append(row)
+        vectors = None
+        for name, (positions, rows) in by_segment.items():
+            segment = self._segments[name]['vector'][rows]
+            if vectors is None:
+                vectors = np.empty((len(keys), segment.shape[1]), dtype=np.float32)
+            vectors[positions] = segment
+        position = {text: i for i, text in enumerate(unique)}
+        return vectors[[position[text] for text in texts]]
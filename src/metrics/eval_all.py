@@ -0,0 +1,256 @@
+"""
+Token evaluation of many results files in one run.
+
+Every file is read in chunks of `--task_size` rows, and the chunks of all the
+files are scored on a single pool of forked workers: jieba is loaded once before
+the fork, and each worker keeps its tokenization cache across files, so the
+ground truths shared by the runs of a benchmark are segmented once per worker.
+Results are written out file by file, in order, and the combined leaderboard is
+written once at the end.
+"""
+import os
+import sys
+import glob
+import json
+import argparse
+import multiprocessing
+
+from collections import Counter, deque
+from contextlib import nullcontext
+from typing import Dict, Iterator, List, Optional, Tuple
+
+current_dir = os.path.dirname(__file__)
+project_root = os.path.abspath(os.path.join(current_dir, ".."))
+parent_of_project_root = os.path.abspath(os.path.join(project_root, ".."))
+sys.path.append(project_root)
+
+from run_store import RunStore, save_leaderboard_markdown
+from result_stream import JsonArrayWriter, batched, iter_results, peak_rss_mb
+from aggregate import ScoreColumns, load_metadata, save_leaderboard, summarize, write_summary
+from token_eval import EVAL_FUNCS, EVALUATOR, _init_worker, _score_pair, default_num_proc, init_segmenter
+
+RESULT_SUFFIXES = ('.json', '.jsonl')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Token evaluation of several results files on one worker pool")
+    parser.add_argument('--results', required=True, nargs='+', type=str, help="Results files, folders (their *.json and *.jsonl files) or glob patterns")
+    parser.add_argument('--metrics', nargs='+', type=str, default=None, choices=[func.__name__ for func in EVAL_FUNCS], help="Metrics to compute (default: all)")
+    parser.add_argument('--leaderboard_path', type=str, default=None, help="Combined leaderboard markdown (default: <folder>_token_eval_leaderboard.md next to the repository, <folder> being the results' common folder)")
+    parser.add_argument('--db_path', type=str, default=None, help="SQLite run store to import responses into and write scores into")
+    parser.add_argument('--benchmark_path', type=str, default=None, help="Benchmark file providing type/source/domain of the questions")
+    parser.add_argument('--incremental', action='store_true', help="Only score the rows added or changed since the last run (uses --db_path, default: <folder>/eval_runs.sqlite)")
+    parser.add_argument('--task_size', type=int, default=64, help="Rows scored per worker task")
+    parser.add_argument('--num_proc', type=int, default=None, help="Scoring worker processes (default: one per available core)")
+    parser.add_argument('--jieba_dict', type=str, default=None, help="Main jieba dictionary replacing the default one")
+    parser.add_argument('--jieba_userdict', type=str, default=None, help="User dictionary loaded on top of the main jieba dictionary")
+    parser.add_argument('--jieba_cache', type=str, default=None, help="Serialized jieba prefix dictionary to load (written when missing)")
+    return parser.parse_args()
+
+
+def is_results_file(path: str) -> bool:
+    """
+    Whether the first row of `path` is an agent result, with a question and a
+    response: not one of the run's side files (throughput.jsonl,
+    cost_profile.json, ...) kept next to the results.
+    """
+    try:
+        row = next(iter_results(path), None)
+    except (ValueError, UnicodeDecodeError):
+        return False
+    return isinstance(row, dict) and 'question' in row and 'response' in row
+
+
+def expand_results(patterns: List[str]) -> List[str]:
+    """
+    Results files named by `patterns`: files, folders (their top-level .json and
+    .jsonl files) and glob patterns, each file once, in order. Files that do not
+    hold results are skipped.
+    """
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        for path in matches:
+            if os.path.isdir(path):
+                found = sorted(
+                    os.path.join(path, name) for name in os.listdir(path)
+                    if name.endswith(RESULT_SUFFIXES) and os.path.isfile(os.path.join(path, name))
+                )
+            elif os.path.isfile(path):
+                found = [path]
+            else:
+                raise FileNotFoundError(f"No results file matches '{pattern}'")
+            for name in found:
+                if is_results_file(name):
+                    paths.append(name)
+                else:
+                    print(f"Skipping {name}: not a results file")
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+def _score_chunk(pairs: List[Tuple[str, str]]) -> List[Dict]:
+    return [_score_pair(pair) for pair in pairs]
+
+
+class FileEvaluation:
+    """
+    Where the scores of one results file go: the run store, or the file's
+    `eval_rlts/<model>-token-eval.json` and its summary.
+    """
+    def __init__(self, path: str, metrics: List[str], store: Optional[RunStore], incremental: bool, metadata: Dict[str, Dict]):
+        self.path = path
+        self.folder = os.path.dirname(path)
+        self.model_name = os.path.basename(path).rpartition('.')[0]
+        self.metrics = metrics
+        self.store = store
+        self.incremental = incremental
+        self.read = self.scored = 0
+        self.summary = None
+        if store is not None:
+            self.run_id = store.run_id(self.model_name, path)
+            self.writer = nullcontext()
+        else:
+            self.columns = ScoreColumns(metrics, metadata)
+            os.makedirs(os.path.join(self.folder, 'eval_rlts'), exist_ok=True)
+            self.writer = JsonArrayWriter(os.path.join(self.folder, 'eval_rlts', self.model_name + "-token-eval.json"))
+        self.writer.__enter__()
+
+    def pending(self, chunk: List[Dict]) -> List[Dict]:
+        """
+        Import a chunk read from the file and return its rows to score.
+        """
+        self.read += len(chunk)
+        if self.store is not None:
+            self.store.import_results(self.run_id, chunk)
+            if self.incremental:
+                chunk = self.store.pending_rows(self.run_id, EVALUATOR, chunk)
+        return chunk
+
+    def write(self, chunk: List[Dict], scores: List[Dict]) -> None:
+        for row, row_scores in zip(chunk, scores):
+            row.update(row_scores)
+        if self.store is not None:
+            self.store.write_scores(self.run_id, ((row['question'], {m: row[m] for m in self.metrics}) for row in chunk))
+            self.store.mark_scored(self.run_id, EVALUATOR, chunk)
+        else:
+            for row in chunk:
+                self.writer.write(row)
+                self.columns.add(row)
+        self.scored += len(chunk)
+
+    def close(self) -> None:
+        self.writer.__exit__(None, None, None)
+        print(f"{self.model_name}: scored {self.scored} rows of {self.read}")
+        if self.store is None:
+            self.summary = summarize(self.columns)
+            write_summary(self.summary, self.model_name, self.metrics, os.path.join(self.folder, 'eval_rlts', self.model_name + "-token-eval-summary.json"))
+
+
+def leaderboard_names(evaluations: List[FileEvaluation]) -> Dict[str, str]:
+    """
+    Leaderboard name of each evaluated file, by path: the model name, followed
+    by the file's folder when files of different folders share it.
+    """
+    names = Counter(evaluation.model_name for evaluation in evaluations)
+    return {
+        evaluation.path: (
+            f"{evaluation.model_name} ({os.path.basename(evaluation.folder)})"
+            if names[evaluation.model_name] > 1 else evaluation.model_name
+        )
+        for evaluation in evaluations
+    }
+
+
+def iter_tasks(paths: List[str], make_evaluation, task_size: int) -> Iterator[Tuple[FileEvaluation, Optional[List[Dict]]]]:
+    """
+    (evaluation, rows to score) for every chunk of every file, then
+    (evaluation, None) once the file is read.
+    """
+    for path in paths:
+        evaluation = make_evaluation(path)
+        for chunk in batched(iter_results(path), task_size):
+            chunk = evaluation.pending(chunk)
+            if chunk:
+                yield evaluation, chunk
+        yield evaluation, None
+
+
+def main():
+    args = parse_args()
+    metrics = args.metrics or [func.__name__ for func in EVAL_FUNCS]
+    eval_funcs = [func for func in EVAL_FUNCS if func.__name__ in metrics]
+    metrics = [func.__name__ for func in eval_funcs]
+
+    paths = expand_results(args.results)
+    if not paths:
+        raise FileNotFoundError(f"No results files in {' '.join(args.results)}")
+    common_folder = os.path.commonpath([os.path.dirname(path) for path in paths])
+    if args.leaderboard_path is None:
+        # Not the <folder>_llm_eval_benchmark.md that the single-file evaluators append to
+        args.leaderboard_path = os.path.join(parent_of_project_root, os.path.basename(common_folder) + "_token_eval_leaderboard.md")
+
+    if args.incremental and not args.db_path:
+        args.db_path = os.path.join(common_folder, 'eval_runs.sqlite')
+    store = None
+    if args.db_path:
+        store = RunStore(args.db_path)
+        if args.benchmark_path:
+            with open(args.benchmark_path, 'r') as f:
+                store.import_questions(json.load(f))
+    metadata = load_metadata(args.benchmark_path) if store is None else {}
+
+    def make_evaluation(path: str) -> FileEvaluation:
+        return FileEvaluation(path, metrics, store, args.incremental, metadata)
+
+    init_segmenter(args.jieba_dict, args.jieba_userdict, args.jieba_cache)
+    _init_worker(eval_funcs)
+    num_proc = args.num_proc or default_num_proc()
+    # Tasks in flight: enough to keep the workers busy, few enough to bound the memory
+    window = num_proc * 4
+    summaries = {}
+    pool = multiprocessing.get_context('fork').Pool(num_proc) if num_proc > 1 else None
+    try:
+        pending = deque()
+
+        def finish(evaluation: FileEvaluation, chunk: Optional[List[Dict]], result) -> None:
+            if chunk is None:
+                evaluation.close()
+                if evaluation.summary is not None:
+                    # Keyed by path: results files of different folders may share a name
+                    summaries[evaluation.path] = evaluation
+            else:
+                evaluation.write(chunk, result.get() if pool is not None else result)
+
+        for evaluation, chunk in iter_tasks(paths, make_evaluation, args.task_size):
+            if chunk is None:
+                result = None
+            else:
+                pairs = [(row.get('response'), row.get('answer')) for row in chunk]
+                result = pool.apply_async(_score_chunk, (pairs,)) if pool is not None else _score_chunk(pairs)
+            pending.append((evaluation, chunk, result))
+            # Results are written in the order the rows were read
+            while len(pending) > window:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if store is not None:
+        save_leaderboard_markdown(store, args.leaderboard_path, metrics)
+        store.close()
+    else:
+        names = leaderboard_names(list(summaries.values()))
+        save_leaderboard(
+            {names[path]: evaluation.summary for path, evaluation in summaries.items()},
+            metrics,
+            args.leaderboard_path,
+        )
+    rss = peak_rss_mb()
+    print(f"Evaluated {len(paths)} files. Peak RSS: {rss['main']} MB (largest scoring worker: {rss['workers']} MB)")
+
+
+if __name__ == '__main__':
+    main()
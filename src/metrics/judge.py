@@ -0,0 +1,122 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from ai_search import Operation_Utils
+
+T = TypeVar('T')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS verdicts (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    verdict TEXT NOT NULL,
+    created_at REAL
+);
+"""
+
+
+def as_judge(eval_model) -> "JudgeEngine":
+    """
+    `eval_model` as a JudgeEngine: engines are used as they are, and a bare
+    VllmServer (the judge argument of the metrics before JudgeEngine) is wrapped
+    in an engine without cache.
+    """
+    return eval_model if isinstance(eval_model, JudgeEngine) else JudgeEngine(eval_model)
+
+
+def verdict_key(model: str, messages: List[Dict]) -> str:
+    """
+    Cache key of a judge request: the judge model and the prompt, which holds the
+    template and the inputs, so editing either one misses the cache.
+    """
+    payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class VerdictCache:
+    """
+    Parsed judge verdicts persisted across evaluation runs, in SQLite (WAL mode, so
+    the worker processes of a run share it). Only verdicts that passed validation
+    are stored: a failed request is asked again on the next run.
+    """
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # One connection per process, shared by its judge threads under the lock
+        self.conn = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            row = self.conn.execute("SELECT verdict FROM verdicts WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, verdict: Dict) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?)",
+                (key, model, json.dumps(verdict, ensure_ascii=False), time.time()),
+            )
+
+
+class JudgeEngine:
+    """
+    Runs judge prompts on a VllmServer: one chat call per request, answered from the
+    VerdictCache when the same model already judged the same prompt.
+
+    A reply that is not valid JSON, or that `validate` rejects, is asked again up to
+    `retries` times; only that request is repeated, not the rest of the row.
+    The engine is safe to share between the judge threads of a worker.
+    """
+    def __init__(self, llm, cache: Optional[VerdictCache] = None, retries: int = 2):
+        self.llm = llm
+        self.cache = cache
+        self.retries = retries
+        self.requests = 0
+        self.parse_failures = 0
+        # The counters are shared by the judge threads of the worker
+        self._lock = threading.Lock()
+
+    def judge(self, prompt: str, validate: Callable[[Dict], T], **inputs) -> T:
+        """
+        Format `prompt` with `inputs`, ask the judge model, and return
+        `validate(verdict)`. `validate` raises (ValueError, KeyError, TypeError)
+        on a malformed verdict.
+        """
+        messages = [{"role": "user", "content": prompt.format(**inputs)}]
+        key = verdict_key(self.llm.model, messages)
+        if self.cache is not None:
+            verdict = self.cache.get(key)
+            if verdict is not None:
+                return validate(verdict)
+        for attempt in range(self.retries + 1):
+            with self._lock:
+                self.requests += 1
+            verdict = Operation_Utils.Json_parser(self.llm.chat(messages=messages))
+            try:
+                result = validate(verdict)
+            except (ValueError, KeyError, TypeError) as e:
+                with self._lock:
+                    self.parse_failures += 1
+                if attempt == self.retries:
+                    raise ValueError(f"Invalid verdict after {attempt + 1} attempts: {verdict}") from e
+                continue
+            if self.cache is not None:
+                self.cache.put(key, self.llm.model, verdict)
+            return result
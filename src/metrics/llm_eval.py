@@ -3,27 +3,32 @@ import sys
 import json
 import time
 import argparse
-import numpy as np
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer
 
 current_dir = os.path.dirname(__file__)  
 project_root = os.path.abspath(os.path.join(current_dir, ".."))
 parent_of_project_root = os.path.abspath(os.path.join(project_root, ".."))
 sys.path.append(project_root)
 
-from ai_search import Operation_Utils
-from serve import VllmServer
+from ai_search import Operation_Utils, report_utilisation
 
-from datasets import Dataset, concatenate_datasets, load_dataset, Value
-import pandas as pd
-from io import StringIO
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 
-from typing import Dict, List, Optional, Union
+from run_store import RunStore, save_leaderboard_markdown, store_leaderboard_path, breakdown_markdown
+from result_stream import JsonArrayWriter, batched, iter_results, peak_rss_mb
+from aggregate import ScoreColumns, load_metadata, save_summary
 
+import queue
+import threading
+from contextlib import nullcontext
 import multiprocessing
 from termcolor import colored
 
+if TYPE_CHECKING:
+    from embedding_cache import EmbeddingCache
+    from judge import JudgeEngine
+    from serve import VllmServer
+
 
 RELEVANCE_PROMPT = """请根据以下提供的答案，构建与其内容相符的 5 个问题。在生成问题之前，请先分析答案的主题和关键信息，并明确可能的提问方向，以确保问题与提供的答案高度相关。
 
@@ -107,13 +112,25 @@ CORRECTNESS_PROMPT = """请根据以下提供的信息，判断预测答案是
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run PlanningAgent with VllmServer")
-    parser.add_argument('--num_processes', type=int, default=1, help="Server num processes (must be > 0)")
+    parser.add_argument('--num_processes', type=int, default=None, help="Judge worker processes, spread over the --api_base endpoints (default: one per endpoint)")
+    parser.add_argument('--concurrency', type=int, default=1, help="Judge requests kept in flight per worker process")
     parser.add_argument('--model_name', type=str, default='Qwen/Qwen2.5-7B-Instruct', help="Model name to use for saving results")
     parser.add_argument('--api_key', type=str, default="EMPTY", help="API KEY of the VllmServer API")
     parser.add_argument('--api_base', nargs='+', type=str, default=["http://localhost:8000/v1"], help="Base URL of the VllmServer API")
+    parser.add_argument('--judge_cache', type=str, default=None, help="SQLite cache of judge verdicts (default: <eval_folder_path>/judge_cache.sqlite)")
+    parser.add_argument('--no_judge_cache', action='store_true', help="Ask the judge model again for every row")
+    parser.add_argument('--judge_retries', type=int, default=2, help="Retries of a judge request whose reply cannot be parsed")
     parser.add_argument('--embedding_path', required=True, type=str, help="Path to the embedding model")
+    parser.add_argument('--embedding_backend', type=str, default='torch', choices=['torch', 'int8', 'onnx'], help="Embedding backend: fp32 SentenceTransformer, int8-quantized on CPU, or ONNX Runtime")
+    parser.add_argument('--onnx_file', type=str, default=None, help="ONNX export in the embedding model directory for --embedding_backend onnx, e.g. onnx/model_qint8_avx512_vnni.onnx")
+    parser.add_argument('--embedding_cache', type=str, default=None, help="Directory of the embedding cache (default: <eval_folder_path>/embedding_cache)")
     parser.add_argument('--eval_folder_path', required=True, type=str, help="Base path for eval data")
     parser.add_argument('--eval_name', required=True, type=str, help="File name for eval data")
+    parser.add_argument('--cost_order', action='store_true', help="Score the longest responses first")
+    parser.add_argument('--incremental', action='store_true', help="Only score the rows added or changed since the last run (uses --db_path, default: <eval_folder_path>/eval_runs.sqlite)")
+    parser.add_argument('--chunk_size', type=int, default=1000, help="Rows read, scored and written at a time")
+    parser.add_argument('--db_path', type=str, default=None, help="SQLite run store to read responses from and write scores into; its leaderboard is written next to it as <db>_leaderboard.md")
+    parser.add_argument('--benchmark_path', type=str, default=None, help="Benchmark file providing type/source/domain of the questions")
     parser.add_argument('--debug', action='store_true', help="Enable debug mode")
     return parser.parse_args()
 
@@ -130,159 +147,335 @@ def Semantic_Relevance(eval_model,embedding_model,question: str, prediction: str
         score = 0.0
         return score
     else:
-        messages = [{"role": "user", "content": RELEVANCE_PROMPT.format(answer=prediction)}]
-        result = Operation_Utils.Json_parser(eval_model.chat(messages=messages))
-        if debug:
-            print(colored(f"Semantic Relevance：{result}", 'blue'))
-        score = Semantic_Similarity(embedding_model,[question], result['question'], debug)
+        questions = Relevance_Questions(eval_model, prediction, debug)
+        score = Semantic_Similarity(embedding_model,[question], questions, debug)
         return float(score.max())
 
-def Factual_Correctness(eval_model,question: str, ground_truth: str, prediction: str, debug, **kwargs):
+def relevance_questions(verdict: Dict) -> List[str]:
+    questions = verdict['question']
+    if not questions or not all(isinstance(q, str) for q in questions):
+        raise ValueError(f"Invalid relevance questions: {questions}")
+    return questions
+
+def correctness_score(verdict: Dict) -> float:
+    return float(verdict['score'] / 10)
+
+def Relevance_Questions(judge: Union["JudgeEngine", "VllmServer"], prediction: str, debug, **kwargs) -> List[str]:
+    """The questions the judge model derives from a prediction, for Semantic_Relevance."""
+    from judge import as_judge
+    questions = as_judge(judge).judge(RELEVANCE_PROMPT, relevance_questions, answer=prediction)
+    if debug:
+        print(colored(f"Semantic Relevance：{questions}", 'blue'))
+    return questions
+
+def Factual_Correctness(judge: Union["JudgeEngine", "VllmServer"],question: str, ground_truth: str, prediction: str, debug, **kwargs):
     if prediction == "错误":
         score = 0.0
         return score 
     else:
-        messages = [{"role": "user", "content": CORRECTNESS_PROMPT.format(question=question, standard_answer=ground_truth,predicted_answer=prediction)}]
-        result = eval_model.chat(messages=messages)
-        result = Operation_Utils.Json_parser(eval_model.chat(messages=messages))
+        from judge import as_judge
+        score = as_judge(judge).judge(CORRECTNESS_PROMPT, correctness_score, question=question, standard_answer=ground_truth, predicted_answer=prediction)
         if debug:
-            print(colored(f"Factual Correctness：{result}", 'blue'))
-        score = float(result['score'] / 10)
+            print(colored(f"Factual Correctness：{score}", 'blue'))
         return score
 
-def split_dataset(dataset,num_process):
-    chunk_size = len(dataset) // num_process
-    chunks = [dataset.select(range(i * chunk_size, (i + 1) * chunk_size)) for i in range(num_process - 1)]
-    chunks.append(dataset.select(range((num_process - 1) * chunk_size, len(dataset))))
-    return chunks
-
-def scorer(llm, embedding, dataset, eval_funcs, debug):
-    def compute_score(example):
-        scores = {}
-        for func in eval_funcs:
-            question = example['question']
-            ground_truth = example['answer']
-            prediction = example['response']
-            try:
-                if func.__name__ == "Semantic_Similarity":
-                    scores[func.__name__] = func(embedding, ground_truth, prediction, debug)
-                elif func.__name__ == "Semantic_Relevance":
-                    scores[func.__name__] = func(llm, embedding, question, prediction, debug)
-                elif func.__name__ == "Factual_Correctness":
-                    scores[func.__name__] = func(llm, question, ground_truth, prediction, debug)
-                else:
-                    # TODO warning have no this eval func
-                    scores[func.__name__] = 0.0
-            except Exception as e:
-                print(colored(e,'red'))
-                scores[func.__name__] = 0.0001
-        return scores
-        
-    scored_dataset = dataset.map(compute_score,num_proc=1)
-    return scored_dataset
-
-def store_eval_rlts(eval_folder_path, eval_model_name, all_results):
-    model_name = eval_model_name + '-llm-eval.json'
-    store_data_dir = eval_folder_path + '/eval_rlts'
-    store_file_path = os.path.join(store_data_dir, model_name) 
-    df = all_results.to_pandas()
-    df.to_json(store_file_path, orient="records", force_ascii=False, indent=4)
-
-def save_scores_to_markdown(eval_folder_path, eval_model_name, eval_funcs, all_results):
-    avg_scores = []
-    headers = ["Model Name"] + [func.__name__ for func in eval_funcs]
-
+def compute_scores(judge: "JudgeEngine", example, eval_funcs, debug):
+    """
+    Judge-model part of the scores of a row. The embedding metrics are left to
+    `embedding_scores`: Semantic_Similarity is skipped and Semantic_Relevance is
+    set to the generated questions to compare with the row's question.
+    """
+    scores = {}
     for func in eval_funcs:
-        total_score = sum(num for resp, num in zip(all_results["response"], all_results[func.__name__]) if resp != "错误")
-        total_acc_num =  sum(1 for resp in all_results["response"] if resp != "错误")
-        avg_score = round(total_score / total_acc_num, 2)
-        avg_scores.append(avg_score)
-        print(f"{func.__name__} avg score: {avg_score}")
-
-    required_fields = {"search_nums", "search_function"}
-    if required_fields.issubset(all_results.column_names):
-        headers = headers + ["agent_count","search_count","pass_rate"]
-        avg_search_nums = round(sum(all_results["search_nums"]) / len(all_results), 2)
-        avg_search_function = round(sum(all_results["search_function"]) / len(all_results), 2)
-        pass_rate = round((len(all_results) - all_results['response'].count("错误")) / len(all_results), 2)
-        avg_scores.append(avg_search_nums)
-        avg_scores.append(avg_search_function)
-        avg_scores.append(pass_rate)
-        print(f"agent_count avg score: {avg_search_nums}")
-        print(f"search_count avg score: {avg_search_function}")
-        print(f"pass rate: {pass_rate}")
-
-    data_row = [eval_model_name] + avg_scores
-    mk_name = eval_folder_path.split("/")[-1] + "_llm_eval_benchmark.md"
-    output_path = os.path.join(parent_of_project_root,mk_name)
-    try:
-        with open(output_path, "r") as file:
-            lines = file.readlines()
-            if not lines or not lines[0].strip().startswith("| Model Name"):
-                raise FileNotFoundError  
-    except FileNotFoundError:
-        with open(output_path, "w") as file:
-            file.write("| " + " | ".join(headers) + " |\n")
-            file.write("|" + " | ".join(["---"] * len(headers)) + "|\n")
-
-    with open(output_path, "a") as file:
-        file.write("| " + " | ".join(map(str, data_row)) + " |\n")
-
-    print(f"Results saved to {output_path}")
-
-def run_eval(api_key,api_base,model_name,embedding_path,dataset,eval_funcs, debug, progress_queue):
+        question = example['question']
+        ground_truth = example['answer']
+        prediction = example['response']
+        try:
+            if func.__name__ == "Semantic_Similarity":
+                continue
+            elif func.__name__ == "Semantic_Relevance":
+                scores[func.__name__] = 0.0 if prediction == "错误" else Relevance_Questions(judge, prediction, debug)
+            elif func.__name__ == "Factual_Correctness":
+                scores[func.__name__] = func(judge, question, ground_truth, prediction, debug)
+            else:
+                # TODO warning have no this eval func
+                scores[func.__name__] = 0.0
+        except Exception as e:
+            print(colored(e,'red'))
+            scores[func.__name__] = 0.0001
+    return scores
+
+def embedding_scores(rows: List[Dict], row_scores: List[Dict], eval_funcs, cache: "EmbeddingCache") -> None:
+    """
+    Fill in Semantic_Similarity and Semantic_Relevance for every row: all the texts
+    of the dataset are embedded in one deduplicated batch (through `cache`), then
+    each metric is a single vectorized operation.
+    Rows whose texts cannot be embedded score 0.0001, like other scoring errors.
+    """
+    names = {func.__name__ for func in eval_funcs}
+    similarity_rows = []
+    if "Semantic_Similarity" in names:
+        for i, row in enumerate(rows):
+            if isinstance(row['answer'], str) and isinstance(row['response'], str):
+                similarity_rows.append(i)
+            else:
+                row_scores[i]["Semantic_Similarity"] = 0.0001
+    relevance_rows = []
+    if "Semantic_Relevance" in names:
+        relevance_rows = [i for i, scores in enumerate(row_scores) if isinstance(scores.get("Semantic_Relevance"), list)]
+
+    texts = [rows[i]['answer'] for i in similarity_rows] + [rows[i]['response'] for i in similarity_rows]
+    texts += [rows[i]['question'] for i in relevance_rows]
+    generated = [row_scores[i]["Semantic_Relevance"] for i in relevance_rows]
+    texts += [question for questions in generated for question in questions]
+    if not texts:
+        return
+    import numpy as np
+    vectors = cache.embed(texts)
+
+    count = len(similarity_rows)
+    similarity = np.einsum('ij,ij->i', vectors[:count], vectors[count:2 * count])
+    for i, score in zip(similarity_rows, similarity):
+        row_scores[i]["Semantic_Similarity"] = float(score)
+
+    if relevance_rows:
+        offset = 2 * count
+        questions = vectors[offset:offset + len(relevance_rows)]
+        generated_vectors = vectors[offset + len(relevance_rows):]
+        lengths = [len(questions_of_row) for questions_of_row in generated]
+        owners = np.repeat(np.arange(len(relevance_rows)), lengths)
+        # Similarity of every generated question with its row's question, then the best per row
+        similarity = np.einsum('ij,ij->i', generated_vectors, questions[owners])
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+        for i, score in zip(relevance_rows, np.maximum.reduceat(similarity, starts)):
+            row_scores[i]["Semantic_Relevance"] = float(score)
+
+def run_eval(api_key,api_base,model_name,work_queue,result_queue,eval_funcs, debug, progress_queue, concurrency=1, judge_cache=None, judge_retries=2):
+    """
+    Worker process, alive for the whole run: run the judge model on the
+    (index, row) items it pulls from the shared work queue, with `concurrency`
+    rows in flight against its endpoint, and put the (index, scores) pairs on
+    the result queue. Returns its utilisation stats once it takes a stop marker.
+    """
+    # Heavy model dependencies are imported in the workers only
+    from serve import VllmServer
+    from judge import JudgeEngine, VerdictCache
+
     llm = VllmServer(
         model_name=model_name,
         api_key=api_key,
         api_base=api_base,
     )
-    embedding = SentenceTransformer(embedding_path)
-    with tqdm(total=len(dataset), desc=f"Progress on {api_base}", position=progress_queue.get()) as pbar:
-        scored_dataset = scorer(llm, embedding, dataset, eval_funcs, debug)
-    return scored_dataset
+    cache = VerdictCache(judge_cache) if judge_cache else None
+    judge = JudgeEngine(llm, cache, judge_retries)
+    items = 0
+    busy = [0.0]
+    lock = threading.Lock()
+    started = time.time()
+    with tqdm(desc=f"Progress on {api_base}", position=progress_queue.get()) as pbar:
+        def judge_rows():
+            nonlocal items
+            # Each thread pulls rows until it takes one of the stop markers
+            for index, row in iter(work_queue.get, None):
+                row_started = time.monotonic()
+                try:
+                    scores = compute_scores(judge, row, eval_funcs, debug)
+                except BaseException as e:
+                    # Fails the run instead of leaving it waiting for the row
+                    result_queue.put((index, e))
+                    raise
+                result_queue.put((index, scores))
+                with lock:
+                    items += 1
+                    busy[0] += time.monotonic() - row_started
+                    pbar.update(1)
+
+        threads = [threading.Thread(target=judge_rows, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    stats = {
+        "name": api_base, "items": items, "busy": busy[0], "slots": concurrency,
+        "start": started, "end": time.time(),
+        "requests": judge.requests, "parse_failures": judge.parse_failures,
+        "cached": cache.hits if cache is not None else 0,
+    }
+    if cache is not None:
+        cache.close()
+    return stats
+
+class ChunkJudge:
+    """
+    Scores rows chunk by chunk. The judge workers (one process per endpoint
+    slot, each with its own VllmServer and JudgeEngine) and the embedding cache
+    are set up on the first chunk and live for the whole run: each chunk is
+    handed out over the shared work queue, then its embedding metrics are
+    computed here over all its rows at once. Usage and cache stats are
+    reported on exit.
+    """
+    def __init__(self, args, eval_funcs, judge_cache: Optional[str], backend):
+        self.args = args
+        self.eval_funcs = eval_funcs
+        self.judge_cache = judge_cache
+        self.backend = backend
+        self._pool = None
+
+    def __enter__(self) -> "ChunkJudge":
+        return self
+
+    def _start(self) -> None:
+        args = self.args
+        from embedding_cache import EmbeddingCache
+        cache_dir = args.embedding_cache or os.path.join(args.eval_folder_path, 'embedding_cache')
+        self.cache = EmbeddingCache(cache_dir, self.backend.name, self.backend.encode)
+
+        # Workers pull rows from a shared queue instead of fixed shards
+        self._manager = multiprocessing.Manager()
+        self.work_queue = self._manager.Queue()
+        self.result_queue = self._manager.Queue()
+        progress_queue = self._manager.Queue()
+        for i in range(args.num_processes):
+            progress_queue.put(i)
+        self._pool = multiprocessing.Pool(processes=args.num_processes)
+        self._workers = self._pool.starmap_async(
+            run_eval,
+            [
+                (args.api_key,args.api_base[i % len(args.api_base)],args.model_name,self.work_queue,self.result_queue,self.eval_funcs, args.debug, progress_queue, args.concurrency, self.judge_cache, args.judge_retries)
+                for i in range(args.num_processes)
+            ]
+        )
+
+    def _next_result(self):
+        while True:
+            try:
+                return self.result_queue.get(timeout=1)
+            except queue.Empty:
+                if self._workers.ready():
+                    # Re-raises a worker's error; otherwise they all stopped early
+                    self._workers.get()
+                    raise RuntimeError("Judge workers stopped before scoring every row")
+
+    def score(self, rows: List[Dict]) -> List[Dict]:
+        if self._pool is None:
+            self._start()
+        indices = range(len(rows))
+        if self.args.cost_order:
+            # The most expensive rows first, so that no worker is left with a long one at the end
+            indices = sorted(indices, key=lambda i: len(rows[i]['response'] or ''), reverse=True)
+        for index in indices:
+            self.work_queue.put((index, rows[index]))
+        row_scores = [None] * len(rows)
+        for _ in rows:
+            index, scores = self._next_result()
+            if isinstance(scores, BaseException):
+                raise scores
+            row_scores[index] = scores
+        embedding_scores(rows, row_scores, self.eval_funcs, self.cache)
+        return row_scores
+
+    def __exit__(self, exc_type, *exc) -> None:
+        if self._pool is None:
+            return
+        if exc_type is not None:
+            self._pool.terminate()
+            self._manager.shutdown()
+            return
+        # One stop marker per judge thread
+        for _ in range(self.args.num_processes * self.args.concurrency):
+            self.work_queue.put(None)
+        results = self._workers.get()
+        self._pool.close()
+        self._pool.join()
+        self._manager.shutdown()
+        report_utilisation(results)
+        requests = sum(stats["requests"] for stats in results)
+        parse_failures = sum(stats["parse_failures"] for stats in results)
+        cached = sum(stats["cached"] for stats in results)
+        print(f"Judge: {cached} cached verdicts, {requests} requests, {parse_failures} unparsable replies")
+        print(f"Embeddings: {self.cache.hits} cached, {self.cache.misses} encoded")
 
 def main():
     args = parse_args()
+    if args.num_processes is None:
+        args.num_processes = len(args.api_base)
     if args.num_processes <= 0:
-        parser.error("--num_processes must be greater than 0")
+        raise ValueError("--num_processes must be greater than 0")
+    if args.concurrency <= 0:
+        raise ValueError("--concurrency must be greater than 0")
+    judge_cache = None
+    if not args.no_judge_cache:
+        judge_cache = args.judge_cache or os.path.join(args.eval_folder_path, 'judge_cache.sqlite')
 
     eval_funcs = [Semantic_Similarity,Semantic_Relevance,Factual_Correctness]
-    
-    eval_path = os.path.join(args.eval_folder_path,args.eval_name)
-    if args.eval_name.endswith(('.json', '.jsonl')):
-        try:
-            dataset = load_dataset('json', data_files=eval_path, split='train')
-        except Exception as e:
-            with open(eval_path,'r') as f:
-                datas = json.load(f)
-            datas = [{k: v for k, v in data.items() if k != 'search'} for data in datas]
-            dataset = Dataset.from_list(datas)
-    else:
-        dataset = load_dataset(eval_path, split='train')
-
-    splited_testset = split_dataset(dataset,args.num_processes)
-    progress_queue = multiprocessing.Manager().Queue()
-    for i in range(args.num_processes):
-        progress_queue.put(i)
-
-    with multiprocessing.Pool(processes=args.num_processes) as pool:
-        results = pool.starmap(
-            run_eval,
-            [
-                (args.api_key,args.api_base[i],args.model_name,args.embedding_path,splited_testset[i],eval_funcs, args.debug, progress_queue)
-                for i in range(args.num_processes)
-            ]
-        )
-    for dset in results:
-        for func in eval_funcs:
-            dset = dset.cast_column(func.__name__, Value("float32"))
-    all_results = concatenate_datasets(results)
 
+    eval_path = os.path.join(args.eval_folder_path,args.eval_name)
     eval_model_name = args.eval_name.rpartition('.')[0]
 
-    store_eval_rlts(args.eval_folder_path,eval_model_name,all_results)
-
-    save_scores_to_markdown(args.eval_folder_path, eval_model_name, eval_funcs, all_results)
+    from embedding_backends import load_backend
+    backend = load_backend(args.embedding_backend, args.embedding_path, file_name=args.onnx_file)
+    # Scores depend on the judge model and the embedding backend too
+    evaluator = f"llm_eval:{args.model_name}:{backend.name}"
+
+    if args.incremental and not args.db_path:
+        args.db_path = os.path.join(args.eval_folder_path, 'eval_runs.sqlite')
+    store = None
+    if args.db_path:
+        store = RunStore(args.db_path)
+        if args.benchmark_path:
+            with open(args.benchmark_path, 'r') as f:
+                store.import_questions(json.load(f))
+        run_id = store.run_id(eval_model_name, eval_path)
+
+    if store is not None and not os.path.exists(eval_path):
+        rows = store.load_rows(run_id)
+    elif args.eval_name.endswith(('.json', '.jsonl')):
+        rows = iter_results(eval_path)
+    else:
+        from datasets import load_dataset
+        rows = load_dataset(eval_path, split='train')
+
+    metrics = [func.__name__ for func in eval_funcs]
+    columns = ScoreColumns(metrics, load_metadata(args.benchmark_path) if store is None else None)
+    store_file_path = os.path.join(args.eval_folder_path + '/eval_rlts', eval_model_name + '-llm-eval.json')
+    writer = JsonArrayWriter(store_file_path) if store is None else nullcontext()
+    read = scored = 0
+    with writer, ChunkJudge(args, eval_funcs, judge_cache, backend) as judge:
+        for chunk in batched(rows, args.chunk_size):
+            read += len(chunk)
+            if store is not None:
+                if os.path.exists(eval_path):
+                    store.import_results(run_id, chunk)
+                if args.incremental:
+                    chunk = store.pending_rows(run_id, evaluator, chunk)
+            if not chunk:
+                continue
+            # Plain rows of the scored fields only, pickled to the workers
+            judged = [{k: row.get(k) for k in ('question', 'answer', 'response')} for row in chunk]
+            for row, scores in zip(chunk, judge.score(judged)):
+                row.update({name: float(scores[name]) for name in metrics})
+            if store is not None:
+                store.write_scores(run_id, ((row['question'], {m: row[m] for m in metrics}) for row in chunk))
+                store.mark_scored(run_id, evaluator, chunk)
+            else:
+                for row in chunk:
+                    writer.write(row)
+                    columns.add(row)
+            scored += len(chunk)
+    print(f"Scored {scored} rows of {read}")
+
+    mk_name = args.eval_folder_path.split("/")[-1] + "_llm_eval_benchmark.md"
+    output_path = os.path.join(parent_of_project_root, mk_name)
+    if store is not None:
+        save_leaderboard_markdown(store, store_leaderboard_path(args.db_path), metrics)
+        print(breakdown_markdown(store, run_id, metrics, 'domain'))
+        print(breakdown_markdown(store, run_id, metrics, 'type'))
+        print(breakdown_markdown(store, run_id, metrics, 'source'))
+        store.close()
+    else:
+        save_summary(columns, eval_model_name, output_path, os.path.join(args.eval_folder_path, 'eval_rlts', eval_model_name + '-llm-eval-summary.json'))
+    rss = peak_rss_mb()
+    print(f"Peak RSS: {rss['main']} MB (largest judge worker: {rss['workers']} MB)")
 
 if __name__ == '__main__':
     multiprocessing.set_start_method("spawn", force=True)
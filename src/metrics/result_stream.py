@@ -0,0 +1,116 @@
+"""
+Bounded-memory reading and writing of results files.
+
+Rows are plain dicts read one at a time, so files whose rows do not share a
+schema are read as they are, and no Arrow cache is written next to them.
+"""
+import json
+import resource
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List
+
+CHUNK_SIZE = 1 << 20
+
+
+def _iter_json_array(f, chunk_size: int = CHUNK_SIZE) -> Iterator[Dict]:
+    """
+    Elements of the JSON array in `f`, decoded one at a time from a sliding buffer.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    opened = False
+    eof = False
+    while True:
+        # Skip whitespace and separators, reading more when the buffer runs out
+        while position < len(buffer) and buffer[position] in ' \t\r\n,[':
+            if buffer[position] == '[':
+                if opened:
+                    break
+                opened = True
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        if position < len(buffer):
+            try:
+                row, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # A number may continue in the next chunk: only accept a delimited value
+                if eof or (end < len(buffer) and buffer[end] in ' \t\r\n,]'):
+                    yield row
+                    position = end
+                    continue
+        if eof:
+            return
+        data = f.read(chunk_size)
+        eof = not data
+        buffer = buffer[position:] + data
+        position = 0
+
+
+def iter_results(path: str) -> Iterator[Dict]:
+    """
+    Rows of a results file, a JSON list or JSONL, read incrementally. A JSONL file
+    may still be appended to by a running benchmark: an unterminated last line is
+    left for the next read.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        head = f.read(1)
+        while head.isspace():
+            head = f.read(1)
+        f.seek(0)
+        if head == '[':
+            yield from _iter_json_array(f)
+            return
+        for line in f:
+            if not line.endswith('\n'):
+                break
+            if line.strip():
+                yield json.loads(line)
+
+
+def batched(rows: Iterable[Dict], size: int) -> Iterator[List[Dict]]:
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+class JsonArrayWriter:
+    """
+    Writes records as an indented JSON array, one at a time.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def __enter__(self) -> "JsonArrayWriter":
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write('[')
+        return self
+
+    def write(self, record: Dict) -> None:
+        text = json.dumps(record, ensure_ascii=False, indent=4)
+        self._file.write((',\n    ' if self.count else '\n    ') + text.replace('\n', '\n    '))
+        self.count += 1
+
+    def __exit__(self, *exc) -> None:
+        self._file.write('\n]' if self.count else ']')
+        self._file.close()
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """
+    Peak resident set size, in MB, of this process and of its largest finished
+    child process (the scoring workers).
+    """
+    # ru_maxrss is in kilobytes on Linux
+    main = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {'main': round(main, 1), 'workers': round(workers, 1)}
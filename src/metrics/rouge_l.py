@@ -0,0 +1,117 @@
+"""
+ROUGE-L F1 as computed by the `rouge` package (1.0.1) with its default settings,
+which the token_eval scores have always used: summary-level ROUGE-L over
+sentences split on '.', counting distinct words.
+
+For a hypothesis with sentences c_1..c_v and a reference with sentences
+r_1..r_u, the overlap is the number of distinct words in the union of the
+longest common subsequences LCS(r_i, c_k), each reconstructed with the
+package's tie-breaking. Recall and precision divide it by the number of
+distinct words of the reference and of the hypothesis.
+
+Words are mapped to integer ids and the LCS table is computed bit-parallel
+(one Python int per reference word, bit j for hypothesis position j), so long
+answers cost O(n * m / word size) instead of a dictionary entry per cell.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+
+def split_sentences(text: str) -> List[List[str]]:
+    """
+    Sentences and words exactly as the `rouge` package splits them.
+    """
+    sentences = [" ".join(part.split()) for part in text.split(".") if len(part) > 0]
+    return [sentence.split(" ") for sentence in sentences]
+
+
+def _lcs_rows(x: Sequence[int], y: Sequence[int]) -> List[int]:
+    """
+    Rows of the LCS table of x and y, bit-encoded: a zero at bit j of row i means
+    LCS(x[:i], y[:j + 1]) = LCS(x[:i], y[:j]) + 1 (Allison-Dix).
+    """
+    mask = (1 << len(y)) - 1
+    matches: Dict[int, int] = {}
+    for j, token in enumerate(y):
+        matches[token] = matches.get(token, 0) | (1 << j)
+    rows = [mask]
+    row = mask
+    for token in x:
+        u = row & matches.get(token, 0)
+        row = ((row + u) | (row - u)) & mask
+        rows.append(row)
+    return rows
+
+
+def lcs_tokens(x: Sequence[int], y: Sequence[int]) -> set:
+    """
+    The distinct tokens of the LCS of x and y, walking back from the end of both
+    like `rouge`: take a match, otherwise step back in x when that keeps a longer
+    LCS than stepping back in y.
+    """
+    if not x or not y:
+        return set()
+    rows = _lcs_rows(x, y)
+
+    def table(i: int, j: int) -> int:
+        # LCS(x[:i], y[:j]): the increments among the first j bits of row i
+        return j - (rows[i] & ((1 << j) - 1)).bit_count()
+
+    tokens = set()
+    i, j = len(x), len(y)
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            tokens.add(x[i - 1])
+            i -= 1
+            j -= 1
+        elif table(i - 1, j) > table(i, j - 1):
+            i -= 1
+        else:
+            j -= 1
+    return tokens
+
+
+def _to_ids(sentences: List[List[str]], vocab: Dict[str, int]) -> List[List[int]]:
+    return [[vocab.setdefault(word, len(vocab)) for word in sentence] for sentence in sentences]
+
+
+def rouge_l_ids(hypothesis: List[List[int]], reference: List[List[int]]) -> Optional[Tuple[float, float, float]]:
+    """
+    (f, p, r) of sentences of token ids, or None when either side has no
+    sentence (the `rouge` package raises ValueError).
+    """
+    if not hypothesis or not reference:
+        return None
+    union = set()
+    for reference_sentence in reference:
+        for hypothesis_sentence in hypothesis:
+            union |= lcs_tokens(reference_sentence, hypothesis_sentence)
+    m = len({token for sentence in reference for token in sentence})
+    n = len({token for sentence in hypothesis for token in sentence})
+    r = len(union) / m
+    p = len(union) / n
+    f = 2.0 * ((p * r) / (p + r + 1e-8))
+    return f, p, r
+
+
+def rouge_l(hypothesis: str, reference: str) -> float:
+    """
+    ROUGE-L F1 of two texts whose words are separated by spaces, 0.0 when either
+    has no sentence.
+    """
+    return rouge_l_batch([(hypothesis, reference)])[0]
+
+
+def rouge_l_batch(pairs: Iterable[Tuple[str, str]]) -> List[float]:
+    """
+    ROUGE-L F1 of many (hypothesis, reference) pairs. Words are interned once in
+    a vocabulary shared by the batch.
+    """
+    vocab: Dict[str, int] = {}
+    scores = []
+    for hypothesis, reference in pairs:
+        result = rouge_l_ids(
+            _to_ids(split_sentences(hypothesis), vocab),
+            _to_ids(split_sentences(reference), vocab),
+        )
+        scores.append(0.0 if result is None else result[0])
+    return scores
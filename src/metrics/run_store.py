@@ -0,0 +1,389 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+current_dir = os.path.dirname(__file__)
+sys.path.append(os.path.abspath(os.path.join(current_dir, "..", "ai_search")))
+
+from writer import question_key
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    source_path TEXT,
+    created_at REAL,
+    UNIQUE (name, source_path)
+);
+CREATE TABLE IF NOT EXISTS questions (
+    question_id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    question TEXT NOT NULL,
+    answer TEXT,
+    type TEXT,
+    source TEXT,
+    domain TEXT
+);
+CREATE TABLE IF NOT EXISTS responses (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    question_id INTEGER NOT NULL REFERENCES questions(question_id),
+    response TEXT,
+    search TEXT,
+    cut_stages TEXT,
+    PRIMARY KEY (run_id, question_id)
+);
+CREATE TABLE IF NOT EXISTS stage_metrics (
+    run_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, question_id, name)
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL,
+    PRIMARY KEY (run_id, question_id, metric)
+);
+CREATE TABLE IF NOT EXISTS score_sums (
+    run_id INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    total REAL NOT NULL,
+    answered INTEGER NOT NULL,
+    PRIMARY KEY (run_id, metric)
+);
+CREATE TABLE IF NOT EXISTS scored_rows (
+    run_id INTEGER NOT NULL,
+    question_id INTEGER NOT NULL,
+    evaluator TEXT NOT NULL,
+    row_hash TEXT NOT NULL,
+    PRIMARY KEY (run_id, question_id, evaluator)
+);
+CREATE INDEX IF NOT EXISTS scores_by_metric ON scores (metric, run_id);
+CREATE INDEX IF NOT EXISTS questions_by_domain ON questions (domain, type);
+"""
+
+# Per-query agent statistics of a results row, stored in stage_metrics
+STAGE_FIELDS = ("thought_depth", "search_nums", "search_function")
+
+
+def row_hash(row: Dict) -> str:
+    """
+    Content hash of a results row: what its scores depend on.
+    """
+    payload = json.dumps([row.get('question'), row.get('answer'), row.get('response')], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class RunStore:
+    """
+    Embedded SQLite store for agent results and evaluation scores.
+
+    One run per evaluated results file, keyed by the model name and the file's
+    absolute path; questions are shared between runs. The database is opened in
+    WAL mode and every write is a single batched transaction.
+
+    `score_sums` holds, per run and metric, the sum and count of the scores of
+    answered questions. Every write adjusts it for the rows it touches, so the
+    leaderboard never rescans the scores. `scored_rows` records the content hash
+    of the rows each evaluator scored, for incremental evaluation.
+    """
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute("CREATE TEMP TABLE touched (question_id INTEGER PRIMARY KEY)")
+        self.conn.execute("CREATE TEMP TABLE chunk_rows (key TEXT NOT NULL, row_hash TEXT NOT NULL)")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def run_id(self, name: str, source_path: Optional[str] = None) -> int:
+        """
+        Id of the run of results file `source_path` for model `name`, created on
+        first use. Files of the same name in different folders are different runs.
+        """
+        if source_path:
+            source_path = os.path.abspath(source_path)
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT run_id FROM runs WHERE name = ? AND source_path IS ?", (name, source_path)
+            ).fetchone()
+            if row is not None:
+                return row[0]
+            return self.conn.execute(
+                "INSERT INTO runs (name, source_path, created_at) VALUES (?, ?, ?)",
+                (name, source_path, time.time()),
+            ).lastrowid
+
+    def _question_ids(self, rows: Iterable[Dict]) -> Dict[str, int]:
+        """
+        Upsert the questions of `rows`, keeping known metadata, and map key -> id.
+        """
+        params = []
+        for row in rows:
+            params.append((
+                question_key(row['question']), row['question'], row.get('answer'),
+                row.get('type'), row.get('source'), row.get('domain'),
+            ))
+        self.conn.executemany(
+            """INSERT INTO questions (key, question, answer, type, source, domain) VALUES (?, ?, ?, ?, ?, ?)
+               ON CONFLICT(key) DO UPDATE SET
+                   answer = COALESCE(excluded.answer, answer),
+                   type = COALESCE(excluded.type, type),
+                   source = COALESCE(excluded.source, source),
+                   domain = COALESCE(excluded.domain, domain)""",
+            params,
+        )
+        keys = [p[0] for p in params]
+        ids = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            ids.update(self.conn.execute(
+                f"SELECT key, question_id FROM questions WHERE key IN ({placeholders})", chunk
+            ).fetchall())
+        return ids
+
+    def _touch(self, question_ids: Iterable[int]) -> None:
+        self.conn.execute("DELETE FROM touched")
+        self.conn.executemany("INSERT OR IGNORE INTO touched VALUES (?)", ((i,) for i in question_ids))
+
+    def _add_sums(self, run_id: int, sign: int) -> None:
+        """
+        Add (sign 1) or remove (sign -1) the scores of the touched questions to the
+        partial sums of the run.
+        """
+        self.conn.execute(
+            """INSERT INTO score_sums (run_id, metric, total, answered)
+               SELECT s.run_id, s.metric, ? * SUM(s.value), ? * COUNT(*)
+               FROM scores s JOIN touched t ON t.question_id = s.question_id
+               JOIN responses r ON r.run_id = s.run_id AND r.question_id = s.question_id
+               WHERE s.run_id = ? AND r.response IS NOT '错误'
+               GROUP BY s.metric
+               ON CONFLICT (run_id, metric) DO UPDATE SET
+                   total = total + excluded.total,
+                   answered = answered + excluded.answered""",
+            (sign, sign, run_id),
+        )
+
+    def import_questions(self, rows: Iterable[Dict]) -> None:
+        """
+        Register benchmark questions with their type/source/domain metadata.
+        """
+        with self.conn:
+            self._question_ids(list(rows))
+
+    def import_results(self, run_id: int, rows: List[Dict]) -> None:
+        """
+        Store the rows of a results file (question, answer, response, agent stats).
+        The scores of a question whose response changed are dropped, for every
+        evaluator: they are recomputed on its next run.
+        """
+        with self.conn:
+            ids = self._question_ids(rows)
+            self._touch(ids.values())
+            self._add_sums(run_id, -1)
+            previous = dict(self.conn.execute(
+                "SELECT question_id, response FROM responses JOIN touched USING (question_id) WHERE run_id = ?", (run_id,)
+            ).fetchall())
+            stale = [
+                (run_id, ids[question_key(row['question'])]) for row in rows
+                if previous.get(ids[question_key(row['question'])], row.get('response')) != row.get('response')
+            ]
+            self.conn.executemany("DELETE FROM scores WHERE run_id = ? AND question_id = ?", stale)
+            self.conn.executemany("DELETE FROM scored_rows WHERE run_id = ? AND question_id = ?", stale)
+            responses = []
+            stages = []
+            for row in rows:
+                question_id = ids[question_key(row['question'])]
+                responses.append((
+                    run_id, question_id, row.get('response'),
+                    json.dumps(row.get('search', []), ensure_ascii=False),
+                    json.dumps(row.get('cut_stages', []), ensure_ascii=False),
+                ))
+                for name in STAGE_FIELDS:
+                    if row.get(name) is not None:
+                        stages.append((run_id, question_id, name, float(row[name])))
+            self.conn.executemany("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", responses)
+            self.conn.executemany("INSERT OR REPLACE INTO stage_metrics VALUES (?, ?, ?, ?)", stages)
+            self._add_sums(run_id, 1)
+
+    def pending_rows(self, run_id: int, evaluator: str, rows: List[Dict]) -> List[Dict]:
+        """
+        The rows of `rows` that `evaluator` has not scored with their current content.
+        Only the hashes of these rows are looked up, so the cost is that of the chunk
+        whatever the size of the run.
+        """
+        keyed = [(question_key(row['question']), row_hash(row)) for row in rows]
+        with self.conn:
+            self.conn.execute("DELETE FROM chunk_rows")
+            self.conn.executemany("INSERT INTO chunk_rows VALUES (?, ?)", keyed)
+            current = set(self.conn.execute(
+                """SELECT c.key, c.row_hash FROM chunk_rows c
+                   JOIN questions q ON q.key = c.key
+                   JOIN scored_rows s ON s.run_id = ? AND s.question_id = q.question_id
+                       AND s.evaluator = ? AND s.row_hash = c.row_hash""",
+                (run_id, evaluator),
+            ).fetchall())
+        return [row for row, key in zip(rows, keyed) if key not in current]
+
+    def mark_scored(self, run_id: int, evaluator: str, rows: List[Dict]) -> None:
+        """
+        Record that `evaluator` scored `rows` with their current content.
+        """
+        with self.conn:
+            ids = self._question_ids({'question': row['question']} for row in rows)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO scored_rows VALUES (?, ?, ?, ?)",
+                [(run_id, ids[question_key(row['question'])], evaluator, row_hash(row)) for row in rows],
+            )
+
+    def load_rows(self, run_id: int) -> List[Dict]:
+        """
+        Rows of a run in the shape of the results file, with agent stats as columns.
+        """
+        rows = {}
+        for question_id, question, answer, response, search in self.conn.execute(
+            """SELECT q.question_id, q.question, q.answer, r.response, r.search
+               FROM responses r JOIN questions q USING (question_id)
+               WHERE r.run_id = ? ORDER BY q.question_id""",
+            (run_id,),
+        ):
+            rows[question_id] = {
+                "question": question,
+                "answer": answer,
+                "response": response,
+                "search": json.loads(search) if search else [],
+            }
+        for question_id, name, value in self.conn.execute(
+            "SELECT question_id, name, value FROM stage_metrics WHERE run_id = ?", (run_id,)
+        ):
+            if question_id in rows:
+                rows[question_id][name] = value
+        return list(rows.values())
+
+    def write_scores(self, run_id: int, scored: Iterable[Tuple[str, Dict[str, float]]]) -> None:
+        """
+        Store metric scores given as (question, {metric: value}) pairs.
+        """
+        with self.conn:
+            scored = list(scored)
+            ids = self._question_ids({'question': question} for question, _ in scored)
+            self._touch(ids.values())
+            self._add_sums(run_id, -1)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)",
+                [
+                    (run_id, ids[question_key(question)], metric, float(value))
+                    for question, scores in scored
+                    for metric, value in scores.items()
+                ],
+            )
+            self._add_sums(run_id, 1)
+
+    def metrics(self) -> List[str]:
+        return [m for (m,) in self.conn.execute("SELECT DISTINCT metric FROM scores ORDER BY metric")]
+
+    def leaderboard(self, metrics: List[str]) -> List[List]:
+        """
+        One row per run: mean of each metric over answered questions ("错误" excluded),
+        then agent_count, search_count and pass_rate over all questions. Runs of
+        the same model name are told apart by the folder of their results file.
+        """
+        rows = []
+        runs = self.conn.execute("SELECT run_id, name, source_path FROM runs ORDER BY run_id").fetchall()
+        names = Counter(name for _, name, _ in runs)
+        for run_id, name, source_path in runs:
+            if names[name] > 1 and source_path:
+                name = f"{name} ({os.path.basename(os.path.dirname(source_path))})"
+            means = dict(self.conn.execute(
+                "SELECT metric, total / answered FROM score_sums WHERE run_id = ? AND answered > 0",
+                (run_id,),
+            ).fetchall())
+            if not means:
+                continue
+            stages = dict(self.conn.execute(
+                "SELECT name, AVG(value) FROM stage_metrics WHERE run_id = ? GROUP BY name", (run_id,)
+            ).fetchall())
+            total, passed = self.conn.execute(
+                "SELECT COUNT(*), SUM(response IS NOT '错误') FROM responses WHERE run_id = ?", (run_id,)
+            ).fetchone()
+            rows.append(
+                [name]
+                + [round(means[m], 2) if m in means else '' for m in metrics]
+                + [
+                    round(stages.get('search_nums', 0.0), 2),
+                    round(stages.get('search_function', 0.0), 2),
+                    round((passed or 0) / total, 2) if total else 0.0,
+                ]
+            )
+        return rows
+
+    def breakdown(self, run_id: int, metric: str, field: str = 'domain') -> List[Tuple[str, int, float]]:
+        """
+        Mean of `metric` per question `field` (domain, type or source) for a run,
+        over answered questions as in the leaderboard.
+        """
+        if field not in ('domain', 'type', 'source'):
+            raise ValueError(f"Unknown breakdown field: {field}")
+        return self.conn.execute(
+            f"""SELECT COALESCE(q.{field}, 'unknown'), COUNT(*), ROUND(AVG(s.value), 4)
+                FROM scores s JOIN questions q USING (question_id)
+                JOIN responses r ON r.run_id = s.run_id AND r.question_id = s.question_id
+                WHERE s.run_id = ? AND s.metric = ? AND r.response IS NOT '错误'
+                GROUP BY q.{field} ORDER BY q.{field}""",
+            (run_id, metric),
+        ).fetchall()
+
+
+def store_leaderboard_path(db_path: str) -> str:
+    """
+    The leaderboard regenerated from a store, next to it: not the
+    <folder>_llm_eval_benchmark.md that runs without a store append to.
+    """
+    return os.path.splitext(db_path)[0] + "_leaderboard.md"
+
+
+def save_leaderboard_markdown(store: RunStore, output_path: str, metrics: Optional[List[str]] = None) -> None:
+    """
+    Regenerate the leaderboard markdown from the store, one row per run. The
+    `metrics` columns come first, in order, then any other stored metric.
+    """
+    metrics = list(metrics or [])
+    metrics += [m for m in store.metrics() if m not in metrics]
+    headers = ["Model Name"] + metrics + ["agent_count", "search_count", "pass_rate"]
+    with open(output_path, "w") as file:
+        file.write("| " + " | ".join(headers) + " |\n")
+        file.write("|" + " | ".join(["---"] * len(headers)) + "|\n")
+        for row in store.leaderboard(metrics):
+            file.write("| " + " | ".join(map(str, row)) + " |\n")
+    print(f"Results saved to {output_path}")
+
+
+def breakdown_markdown(store: RunStore, run_id: int, metrics: List[str], field: str = 'domain') -> str:
+    """
+    Per-`field` table of the mean scores of a run.
+    """
+    columns = {}
+    counts = {}
+    for metric in metrics:
+        columns[metric] = {}
+        for group, count, score in store.breakdown(run_id, metric, field):
+            columns[metric][group] = score
+            counts[group] = max(counts.get(group, 0), count)
+    headers = [field, "count"] + metrics
+    lines = ["| " + " | ".join(headers) + " |", "|" + " | ".join(["---"] * len(headers)) + "|"]
+    for group in sorted(counts):
+        cells = [group, str(counts[group])] + [str(columns[metric].get(group, '')) for metric in metrics]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
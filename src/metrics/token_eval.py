@@ -1,27 +1,65 @@
 import os
+import gc
 import re
 import sys
 import json
 import string
+import multiprocessing
 
 import jieba
-import difflib
 import argparse
 
 from tqdm import tqdm
-from typing import List
-from rouge import Rouge
-from fuzzywuzzy import fuzz
+from typing import List, NamedTuple, Optional, Tuple
 from collections import Counter
+from contextlib import nullcontext
+from functools import lru_cache
 
 current_dir = os.path.dirname(__file__)  
 project_root = os.path.abspath(os.path.join(current_dir, ".."))
 parent_of_project_root = os.path.abspath(os.path.join(project_root, ".."))
 sys.path.append(project_root)
 
-from datasets import Dataset,load_dataset,Value
-import pandas as pd
-from io import StringIO
+from run_store import RunStore, save_leaderboard_markdown, store_leaderboard_path, breakdown_markdown
+from result_stream import JsonArrayWriter, batched, iter_results, peak_rss_mb
+from aggregate import ScoreColumns, load_metadata, save_summary
+from rouge_l import rouge_l
+
+
+def init_segmenter(dictionary: Optional[str] = None, user_dict: Optional[str] = None, cache_file: Optional[str] = None) -> None:
+    """
+    Load jieba's prefix dictionary in this process.
+
+    Called before the scoring workers are forked, so that they share the loaded
+    dictionary copy-on-write instead of each loading it on its first cut.
+
+    :param dictionary: Main dictionary replacing jieba's default one.
+    :param user_dict: Extra words added on top of the main dictionary.
+    :param cache_file: Where the serialized prefix dictionary is read from, and
+        written to when missing (default: jieba's file in the temp directory).
+    """
+    if dictionary:
+        jieba.set_dictionary(dictionary)
+    if cache_file:
+        jieba.dt.cache_file = cache_file
+    jieba.initialize()
+    if user_dict:
+        jieba.load_userdict(user_dict)
+    # Keep the collector from writing to the dictionary's pages in the workers
+    gc.freeze()
+
+
+def default_num_proc() -> int:
+    """
+    Scoring workers: one per core available to this process.
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+CN_PUNCTUATION = "！？｡。＂＃＄％＆＇（）＊＋，－／：；＜＝＞＠［＼］＾＿｀｛｜｝～｟｠｢｣､、〃》「」『』【】〔〕〖〗〘〙〚〛〜〝〞〟〰〾〿–—‘’‛“”„‟…‧﹏."
+ALL_PUNCTUATION = frozenset(string.punctuation + CN_PUNCTUATION)
 
 
 def normalize_zh_answer(s):
@@ -31,26 +69,44 @@ def normalize_zh_answer(s):
         return "".join(text.split())
 
     def remove_punc(text):
-        cn_punctuation = "！？｡。＂＃＄％＆＇（）＊＋，－／：；＜＝＞＠［＼］＾＿｀｛｜｝～｟｠｢｣､、〃》「」『』【】〔〕〖〗〘〙〚〛〜〝〞〟〰〾〿–—‘’‛“”„‟…‧﹏."
-        all_punctuation = set(string.punctuation + cn_punctuation)
-        return "".join(ch for ch in text if ch not in all_punctuation)
+        return "".join(ch for ch in text if ch not in ALL_PUNCTUATION)
 
     def lower(text):
         return text.lower()
 
     return white_space_fix(remove_punc(lower(s)))
 
+
+class Tokens(NamedTuple):
+    """
+    The segmentations of a text shared by every scorer.
+
+    words: the jieba segmentation, as given to ROUGE.
+    normalized: the words normalized by `normalize_zh_answer`, empty ones dropped,
+        as counted by F1 and recall.
+    """
+    words: Tuple[str, ...]
+    normalized: Tuple[str, ...]
+
+
+@lru_cache(maxsize=65536)
+def tokenize_zh(text: str) -> Tokens:
+    """
+    Segment a text once for all the scorers. Cached: in a row the prediction and
+    the ground truth are each segmented once however many scorers run, and
+    ground truths repeat across the runs of a benchmark.
+    """
+    words = tuple(jieba.cut(text, cut_all=False))
+    normalized = tuple(token for token in map(normalize_zh_answer, words) if token)
+    return Tokens(words, normalized)
+
+
 def rouge_score(prediction, ground_truth, **kwargs):
-    rouge = Rouge()
-    try:
-        scores = rouge.get_scores([prediction], [ground_truth], avg=True)
-    except:
-        return 0.0
-    return scores["rouge-l"]["f"]
+    return rouge_l(prediction, ground_truth)
 
 def rouge_zh_score(prediction, ground_truth, **kwargs):
-    prediction = " ".join(list(jieba.cut(prediction, cut_all=False)))
-    ground_truth = " ".join(list(jieba.cut(ground_truth, cut_all=False))) 
+    prediction = " ".join(tokenize_zh(prediction).words)
+    ground_truth = " ".join(tokenize_zh(ground_truth).words)
     score = rouge_score(prediction, ground_truth)
     return score
 
@@ -65,13 +121,7 @@ def f1_score(prediction, ground_truth, **kwargs):
     return f1
 
 def qa_f1_zh_score(prediction, ground_truth, **kwargs):
-    prediction_tokens = list(jieba.cut(prediction, cut_all=False))
-    ground_truth_tokens = list(jieba.cut(ground_truth, cut_all=False))
-    prediction_tokens = [normalize_zh_answer(token) for token in prediction_tokens]
-    ground_truth_tokens = [normalize_zh_answer(token) for token in ground_truth_tokens]
-    prediction_tokens = [token for token in prediction_tokens if len(token) > 0]
-    ground_truth_tokens = [token for token in ground_truth_tokens if len(token) > 0]
-    return f1_score(prediction_tokens, ground_truth_tokens)
+    return f1_score(tokenize_zh(prediction).normalized, tokenize_zh(ground_truth).normalized)
 
 def recall_score(prediction, ground_truth, **kwargs):
     common = Counter(prediction) & Counter(ground_truth)
@@ -82,105 +132,136 @@ def recall_score(prediction, ground_truth, **kwargs):
     return recall
 
 def qa_recall_zh_score(prediction, ground_truth, **kwargs):
-    prediction_tokens = list(jieba.cut(prediction, cut_all=False))
-    ground_truth_tokens = list(jieba.cut(ground_truth, cut_all=False))
-    prediction_tokens = [normalize_zh_answer(token) for token in prediction_tokens]
-    ground_truth_tokens = [normalize_zh_answer(token) for token in ground_truth_tokens]
-    prediction_tokens = [token for token in prediction_tokens if len(token) > 0]
-    ground_truth_tokens = [token for token in ground_truth_tokens if len(token) > 0]
-    return recall_score(prediction_tokens, ground_truth_tokens)
+    return recall_score(tokenize_zh(prediction).normalized, tokenize_zh(ground_truth).normalized)
+
 
+EVAL_FUNCS = [rouge_zh_score, qa_f1_zh_score, qa_recall_zh_score]
+
+# Key of this evaluator's scores in the run store's scored_rows
+EVALUATOR = 'token_eval'
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Run PlanningAgent with VllmServer")
     parser.add_argument('--eval_folder_path', required=True, type=str, help="Base path for eval data")
     parser.add_argument('--eval_name', required=True, type=str, help="File name for eval data")
+    parser.add_argument('--db_path', type=str, default=None, help="SQLite run store to read responses from and write scores into; its leaderboard is written next to it as <db>_leaderboard.md")
+    parser.add_argument('--benchmark_path', type=str, default=None, help="Benchmark file providing type/source/domain of the questions")
+    parser.add_argument('--incremental', action='store_true', help="Only score the rows added or changed since the last run (uses --db_path, default: <eval_folder_path>/eval_runs.sqlite)")
+    parser.add_argument('--chunk_size', type=int, default=1000, help="Rows read, scored and written at a time")
+    parser.add_argument('--num_proc', type=int, default=None, help="Scoring worker processes (default: one per available core)")
+    parser.add_argument('--jieba_dict', type=str, default=None, help="Main jieba dictionary replacing the default one")
+    parser.add_argument('--jieba_userdict', type=str, default=None, help="User dictionary loaded on top of the main jieba dictionary")
+    parser.add_argument('--jieba_cache', type=str, default=None, help="Serialized jieba prefix dictionary to load (written when missing)")
     return parser.parse_args()
 
-def scorer(dataset,eval_funcs):
-    def compute_score(example):
-        scores = {}
-        prediction = example['response']
-        ground_truth = example['answer']
-        for func in eval_funcs:
-            scores[func.__name__] = func(prediction, ground_truth)
-        return scores
-        
-    scored_datas = dataset.map(compute_score,num_proc=4)
-    return scored_datas
-
-def save_scores_to_markdown(file_name: str, eval_funcs: List, scored_datas: Dataset, output_path: str):
-    avg_scores = []
-
-    headers = ["Model Name"] + [func.__name__ for func in eval_funcs]
-
-    for func in eval_funcs:
-        total_score = sum(num for resp, num in zip(scored_datas["response"], scored_datas[func.__name__]) if resp != "错误")
-        total_acc_num =  sum(1 for resp in scored_datas["response"] if resp != "错误")
-        avg_score = round(total_score / total_acc_num, 2)
-        print(f"{func.__name__} avg score: {avg_score}")
-        avg_scores.append(avg_score)
-
-    required_fields = {"search_nums", "search_function"}
-    if required_fields.issubset(scored_datas.column_names):
-        headers = headers + ["agent_count","search_count","pass_rate"]
-        avg_search_nums = round(sum(scored_datas["search_nums"]) / len(scored_datas), 2)
-        avg_search_function = round(sum(scored_datas["search_function"]) / len(scored_datas), 2)
-        pass_rate = round((len(scored_datas) - scored_datas['response'].count("错误")) / len(scored_datas), 2)
-        avg_scores.append(avg_search_nums)
-        avg_scores.append(avg_search_function)
-        avg_scores.append(pass_rate)
-        print(f"agent_count avg score: {avg_search_nums}")
-        print(f"search_count avg score: {avg_search_function}")
-        print(f"pass rate: {pass_rate}")
-
-    data_row = [file_name] + avg_scores
-
-    try:
-        with open(output_path, "r") as file:
-            lines = file.readlines()
-            if not lines or not lines[0].strip().startswith("| Model Name"):
-                raise FileNotFoundError  
-    except FileNotFoundError:
-        with open(output_path, "w") as file:
-            file.write("| " + " | ".join(headers) + " |\n")
-            file.write("|" + " | ".join(["---"] * len(headers)) + "|\n")
-
-    with open(output_path, "a") as file:
-        file.write("| " + " | ".join(map(str, data_row)) + " |\n")
-
-    print(f"Results saved to {output_path}")
+_worker_funcs: List = []
+
+def _init_worker(eval_funcs) -> None:
+    global _worker_funcs
+    _worker_funcs = eval_funcs
+
+def _score_pair(pair) -> dict:
+    prediction, ground_truth = pair
+    return {func.__name__: func(prediction, ground_truth) for func in _worker_funcs}
+
+class ChunkScorer:
+    """
+    Scores rows chunk by chunk in `num_proc` forked workers (default: one per
+    core), started on the first chunk with rows and alive for the whole run, so
+    that they keep their tokenization caches from chunk to chunk.
+    Call init_segmenter first.
+    """
+    def __init__(self, eval_funcs, num_proc: Optional[int] = None):
+        self.eval_funcs = eval_funcs
+        self.num_proc = num_proc or default_num_proc()
+        self._pool = None
+
+    def __enter__(self) -> "ChunkScorer":
+        _init_worker(self.eval_funcs)
+        return self
+
+    def score(self, rows: List[dict]) -> List[dict]:
+        if not rows:
+            return []
+        pairs = [(row.get('response'), row.get('answer')) for row in rows]
+        # Sized for the whole run: a small first chunk must not limit the later ones
+        if self._pool is None and self.num_proc > 1:
+            self._pool = multiprocessing.get_context('fork').Pool(self.num_proc)
+        if self._pool is None:
+            return [_score_pair(pair) for pair in pairs]
+        return self._pool.map(_score_pair, pairs, chunksize=max(1, len(pairs) // (self.num_proc * 4)))
+
+    def __exit__(self, *exc) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
 
 def main():
     args = parse_args()
-    eval_funcs = [rouge_zh_score,qa_f1_zh_score,qa_recall_zh_score]
+    eval_funcs = EVAL_FUNCS
 
     eval_path = os.path.join(args.eval_folder_path, args.eval_name)
-    
-    if args.eval_name.endswith(('.json', '.jsonl')):
-        try:
-            dataset = load_dataset('json', data_files=eval_path, split='train')
-        except Exception as e:
-            with open(eval_path,'r') as f:
-                datas = json.load(f)
-            datas = [{k: v for k, v in data.items() if k != 'search'} for data in datas]
-            dataset = Dataset.from_list(datas)
-    else:
-        dataset = load_dataset(eval_path, split='train')
-    
-    scored_datas = scorer(dataset, eval_funcs)
     model_name = args.eval_name.rpartition('.')[0]
+
+    if args.incremental and not args.db_path:
+        args.db_path = os.path.join(args.eval_folder_path, 'eval_runs.sqlite')
+    store = None
+    if args.db_path:
+        store = RunStore(args.db_path)
+        if args.benchmark_path:
+            with open(args.benchmark_path, 'r') as f:
+                store.import_questions(json.load(f))
+        run_id = store.run_id(model_name, eval_path)
+
+    if store is not None and not os.path.exists(eval_path):
+        rows = store.load_rows(run_id)
+    elif args.eval_name.endswith(('.json', '.jsonl')):
+        rows = iter_results(eval_path)
+    else:
+        from datasets import load_dataset
+        rows = load_dataset(eval_path, split='train')
+
+    init_segmenter(args.jieba_dict, args.jieba_userdict, args.jieba_cache)
+    metrics = [func.__name__ for func in eval_funcs]
+    columns = ScoreColumns(metrics, load_metadata(args.benchmark_path) if store is None else None)
+    store_file_path = os.path.join(args.eval_folder_path + '/eval_rlts', model_name + "-token-eval.json")
+    writer = JsonArrayWriter(store_file_path) if store is None else nullcontext()
+    read = scored = 0
+    with ChunkScorer(eval_funcs, args.num_proc) as chunk_scorer, writer:
+        for chunk in batched(rows, args.chunk_size):
+            read += len(chunk)
+            if store is not None:
+                if os.path.exists(eval_path):
+                    store.import_results(run_id, chunk)
+                if args.incremental:
+                    chunk = store.pending_rows(run_id, EVALUATOR, chunk)
+            if not chunk:
+                continue
+            for row, scores in zip(chunk, chunk_scorer.score(chunk)):
+                row.update(scores)
+            if store is not None:
+                store.write_scores(run_id, ((row['question'], {m: row[m] for m in metrics}) for row in chunk))
+                store.mark_scored(run_id, EVALUATOR, chunk)
+            else:
+                for row in chunk:
+                    writer.write(row)
+                    columns.add(row)
+            scored += len(chunk)
+    print(f"Scored {scored} rows of {read}")
+
     mk_name = args.eval_folder_path.split("/")[-1] + "_llm_eval_benchmark.md"
     output_path = os.path.join(parent_of_project_root,mk_name)
-    save_scores_to_markdown(model_name,eval_funcs,scored_datas,output_path)
-    
-    store_data_dir = args.eval_folder_path + '/eval_rlts'
-    store_name = model_name + "-token-eval.json"
-    store_file_path = os.path.join(store_data_dir, store_name)
-    df = scored_datas.to_pandas()
-    df.to_json(store_file_path, orient="records", force_ascii=False, indent=4)
+    if store is not None:
+        save_leaderboard_markdown(store, store_leaderboard_path(args.db_path), metrics)
+        print(breakdown_markdown(store, run_id, metrics, 'domain'))
+        print(breakdown_markdown(store, run_id, metrics, 'type'))
+        print(breakdown_markdown(store, run_id, metrics, 'source'))
+        store.close()
+    else:
+        save_summary(columns, model_name, output_path, os.path.join(args.eval_folder_path, 'eval_rlts', model_name + "-token-eval-summary.json"))
+    rss = peak_rss_mb()
+    print(f"Peak RSS: {rss['main']} MB (largest scoring worker: {rss['workers']} MB)")
 
-    
 if __name__ == '__main__':
     main()
     
@@ -1,9 +1,11 @@
 import asyncio
 import json
+import orjson
 import logging
 import random
 import re
 import os
+import sys
 import time
 import warnings
 
@@ -16,13 +18,30 @@ from cachetools import TTLCache, cached
 
 import hashlib
 
+current_dir = os.path.dirname(__file__)
+project_root = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.append(project_root)
+
+from tracing import span
 
 
 class BaseSearch:
 
-    def __init__(self, topk: int = 3, black_list: List[str] = None):
+    def __init__(self, topk: int = 3, black_list: List[str] = None, timeout: Optional[float] = None):
         self.topk = topk
         self.black_list = black_list
+        self.timeout = timeout
+
+    @staticmethod
+    def _escape(snippet: str) -> str:
+        """
+        The snippet escaped as the inside of a JSON string.
+        """
+        try:
+            return orjson.dumps(snippet)[1:-1].decode()
+        except TypeError:
+            # Lone surrogates, which orjson refuses to encode
+            return json.dumps(snippet, ensure_ascii=False)[1:-1]
 
     def _filter_results(self, results: List[tuple]) -> dict:
         filtered_results = {}
@@ -32,7 +51,7 @@ class BaseSearch:
                    for domain in self.black_list) and not url.endswith('.pdf'):
                 filtered_results[count] = {
                     'url': url,
-                    'summ': json.dumps(snippet, ensure_ascii=False)[1:-1],
+                    'summ': self._escape(snippet),
                     'title': title
                 }
                 count += 1
@@ -60,13 +79,14 @@ class QihooWebSearch(BaseSearch):
         self.key = key
         self.url = url
         self.cid = cid
-        super().__init__(topk, black_list)
+        super().__init__(topk, black_list, kwargs.get('timeout'))
 
     @cached(cache=TTLCache(maxsize=100, ttl=600))
     def search(self, query: str, max_retry: int = 3) -> dict:
         for attempt in range(max_retry):
             try:
-                response = self.call_qihoo_web(query)
+                with span('search_api', engine='qihoo', query=query, attempt=attempt):
+                    response = self.call_qihoo_web(query)
                 return self._parse_response(response)
             except Exception as e:
                 logging.exception(str(e))
@@ -89,7 +109,7 @@ class QihooWebSearch(BaseSearch):
             'Authorization': f'Bearer {self.api_key}',  # 根据 API 平台的要求，可能是其他形式，例如 Basic Auth
             'Content-Type': 'application/json'  # 根据 API 的要求设置其他头部信息
         }
-        response = requests.get(self.url, params=params, headers=headers)
+        response = requests.get(self.url, params=params, headers=headers, timeout=self.timeout)
         return response.json().get('items')
 
     def calculate_md5_string(self, input_string):
@@ -147,13 +167,14 @@ class BingSearch(BaseSearch):
         self.api_key = os.getenv("BING_API")
         self.market = region
         self.proxy = kwargs.get('proxy')
-        super().__init__(topk, black_list)
+        super().__init__(topk, black_list, kwargs.get('timeout'))
 
     @cached(cache=TTLCache(maxsize=100, ttl=600))
     def search(self, query: str, max_retry: int = 3) -> dict:
         for attempt in range(max_retry):
             try:
-                response = self._call_bing_api(query)
+                with span('search_api', engine='bing', query=query, attempt=attempt):
+                    response = self._call_bing_api(query)
                 return self._parse_response(response)
             except Exception as e:
                 logging.exception(str(e))
@@ -168,7 +189,7 @@ class BingSearch(BaseSearch):
         params = {'q': query, 'mkt': self.market, 'count': f'{self.topk * 2}'}
         headers = {'Ocp-Apim-Subscription-Key': self.api_key}
         response = requests.get(
-            endpoint, headers=headers, params=params, proxies=self.proxy)
+            endpoint, headers=headers, params=params, proxies=self.proxy, timeout=self.timeout)
         response.raise_for_status()
         return response.json()
 
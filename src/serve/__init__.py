@@ -1,5 +1,7 @@
 from .vllm_server import VllmServer
+from .budget import PromptBudget
 
 __all__ = [
-    'VllmServer'
+    'VllmServer',
+    'PromptBudget'
 ]
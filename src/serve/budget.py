@@ -0,0 +1,165 @@
+import warnings
+from functools import lru_cache
+from typing import Callable, Dict, List, Set, Tuple
+
+
+# Chat-template tokens around each message (role header and end-of-turn markers)
+MESSAGE_OVERHEAD = 8
+# Content tokens below which a history message is dropped rather than cut
+MIN_KEPT_CONTENT = 32
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(model_name: str):
+    """
+    The model's tokenizer, loaded once per process, or None when it is unavailable
+    (PromptBudget then counts one token per character).
+    """
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(model_name)
+    except Exception as e:
+        warnings.warn(f'No tokenizer for {model_name} ({e}); prompt sizes are estimated from their length')
+        return None
+
+
+class PromptBudget:
+    """
+    Fits chat requests into the served context length.
+
+    Token counts are cached per content block, so the cached system prompts and
+    the history repeated across the turns of a query are only tokenized once.
+    Without the model's tokenizer every character is counted as a token, an upper
+    bound for the BPE tokenizers of the served models.
+    """
+
+    def __init__(
+        self,
+        max_model_len: int,
+        tokenizer=None,
+        min_completion: int = 256,
+        margin: int = 16,
+        cache_size: int = 1024,
+    ):
+        self.max_model_len = max_model_len
+        self.tokenizer = tokenizer
+        self.min_completion = min_completion
+        self.margin = margin
+        self.count: Callable[[str], int] = lru_cache(maxsize=cache_size)(self._count)
+
+    def _count(self, text: str) -> int:
+        if self.tokenizer is None:
+            return len(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, tokens: int) -> str:
+        """
+        The longest prefix of `text` that holds in `tokens` tokens.
+        """
+        if tokens <= 0:
+            return ''
+        if self.tokenizer is None:
+            return text[:tokens]
+        ids = self.tokenizer.encode(text, add_special_tokens=False)
+        return self.tokenizer.decode(ids[:tokens]) if len(ids) > tokens else text
+
+    def message_tokens(self, message: Dict) -> int:
+        return self.count(message.get('content') or '') + MESSAGE_OVERHEAD
+
+    def prompt_tokens(self, messages: List[Dict]) -> int:
+        return sum(self.message_tokens(message) for message in messages)
+
+    def _truncated(self, message: Dict, tokens: int) -> Dict:
+        # Prompt messages may be shared (see util.Prompt): never edit them in place
+        return dict(message, content=self.truncate(message.get('content') or '', tokens - MESSAGE_OVERHEAD))
+
+    def fit(self, messages: List[Dict], max_tokens: int) -> Tuple[List[Dict], int]:
+        """
+        Return the messages and completion length to request so that the prompt and
+        the completion fit in the context window.
+
+        The window is allocated in order to:
+        - the system messages and the last message (the current instruction), kept
+          whole unless they alone overflow: then the history is dropped and the
+          last message is cut, and if that is not enough every one of them is
+          cut to an equal share;
+        - `min_completion` tokens of completion;
+        - the history (earlier queries, answers and tool observations): messages
+          under an equal share of what is left are kept whole, the longer ones
+          (usually observations) are cut to the share. When the share would
+          leave them under MIN_KEPT_CONTENT tokens, the oldest history messages
+          are dropped until it does not.
+        - the rest of the completion, up to `max_tokens`.
+
+        Sizes are counted with the model's tokenizer, or as one token per
+        character without it.
+        """
+        counts = [self.message_tokens(message) for message in messages]
+        window = self.max_model_len - self.margin
+        total = sum(counts)
+        if total + max_tokens <= window:
+            return messages, max_tokens
+
+        last = len(messages) - 1
+        history = [i for i, message in enumerate(messages[:-1]) if message.get('role') != 'system']
+        fixed = total - sum(counts[i] for i in history)
+        completion = min(max_tokens, self.min_completion)
+        if fixed + completion > window:
+            return self._fit_fixed(messages, counts, set(history), window - completion), completion
+
+        available = window - fixed - completion
+        share = self._share([counts[i] for i in history], available)
+        while history and share - MESSAGE_OVERHEAD < MIN_KEPT_CONTENT and max(counts[i] for i in history) > share:
+            history.pop(0)
+            share = self._share([counts[i] for i in history], available)
+        kept = set(history)
+        fitted = []
+        used = 0
+        for i, message in enumerate(messages[:-1]):
+            if message.get('role') != 'system':
+                if i not in kept:
+                    continue
+                if counts[i] > share:
+                    message = self._truncated(message, share)
+                used += min(counts[i], share)
+            else:
+                used += counts[i]
+            fitted.append(message)
+        fitted.append(messages[last])
+        used += counts[last]
+        return fitted, min(max_tokens, window - used)
+
+    def _fit_fixed(self, messages: List[Dict], counts: List[int], history: Set[int], available: int) -> List[Dict]:
+        """
+        The system messages and the last message, without the history, cut to fit
+        in `available` tokens: the last message first, then all of them to an
+        equal share.
+        """
+        last = len(messages) - 1
+        fixed = [i for i in range(len(messages)) if i not in history]
+        over = sum(counts[i] for i in fixed) - available
+        if over <= counts[last] - MESSAGE_OVERHEAD - MIN_KEPT_CONTENT:
+            return [messages[i] for i in fixed[:-1]] + [self._truncated(messages[last], counts[last] - over)]
+        share = self._share([counts[i] for i in fixed], available)
+        return [self._truncated(messages[i], share) if counts[i] > share else messages[i] for i in fixed]
+
+    @staticmethod
+    def _share(counts: List[int], available: int) -> int:
+        """
+        The largest per-message cap with sum(min(count, cap)) <= available.
+        """
+        remaining = len(counts)
+        for count in sorted(counts):
+            if count * remaining > available:
+                return available // remaining
+            available -= count
+            remaining -= 1
+        return max(counts, default=0)
+
+
+@lru_cache(maxsize=None)
+def get_budget(model_name: str, max_model_len: int) -> PromptBudget:
+    """
+    Budget shared by the clients of a model in this process.
+    """
+    return PromptBudget(max_model_len, load_tokenizer(model_name))
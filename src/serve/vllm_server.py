@@ -1,6 +1,19 @@
+import os
+import sys
 import json
-from openai import OpenAI
-from typing import List, Dict, Generator
+import time
+import threading
+from typing import TYPE_CHECKING, List, Dict, Generator, Optional
+
+current_dir = os.path.dirname(__file__)
+project_root = os.path.abspath(os.path.join(current_dir, ".."))
+sys.path.append(project_root)
+
+from tracing import span
+from .budget import PromptBudget, get_budget
+
+if TYPE_CHECKING:
+    from openai import OpenAI
 
 
 class VllmServer:
@@ -9,20 +22,74 @@ class VllmServer:
         api_key: str = "EMPTY", 
         api_base: str = "http://localhost:8001/v1", 
         model_name: str = None,
+        max_model_len: Optional[int] = None,
         **kwargs):
         """
         Initialize the ChatWithTools class.
+
+        :param max_model_len: Context length of the served model. Read from the
+            server's model list when not given; requests are fitted into it (see
+            PromptBudget) unless it is unknown. The length and the tokenizer are
+            only loaded by the first request (see get_budget).
         """
-        self.client: OpenAI = OpenAI(api_key=api_key, base_url=api_base)
+        # openai is slow to import; load it only once a client is needed
+        from openai import OpenAI
+        self.client: "OpenAI" = OpenAI(api_key=api_key, base_url=api_base)
+        self._models = None
         self.model: str = model_name or self._get_default_model()
+        self.max_model_len = max_model_len
+        self._budget: Optional[PromptBudget] = None
+        self._budget_loaded = False
+        self._budget_lock = threading.Lock()
+
+    def _list_models(self):
+        """
+        The server's model list, requested once.
+        """
+        if self._models is None:
+            self._models = self.client.models.list()
+        return self._models
 
     def _get_default_model(self) -> str:
         """
         Get the default model from the API.
         """
-        models = self.client.models.list()
+        models = self._list_models()
         return models.data[0].id if models.data else None
 
+    def _get_max_model_len(self) -> Optional[int]:
+        """
+        Get the context length of the model from the API (vLLM reports it in the model list).
+        """
+        try:
+            models = self._list_models()
+        except Exception:
+            return None
+        for model in models.data:
+            if model.id == self.model:
+                return getattr(model, 'max_model_len', None)
+        return None
+
+    def get_budget(self) -> Optional[PromptBudget]:
+        """
+        The PromptBudget of the model, or None when its context length is unknown.
+        Loaded on first use, so that clients that never send a request, and the
+        start of every worker, do not pay for the tokenizer.
+        """
+        if not self._budget_loaded:
+            with self._budget_lock:
+                if not self._budget_loaded:
+                    self.max_model_len = self.max_model_len or self._get_max_model_len()
+                    self._budget = get_budget(self.model, self.max_model_len) if self.max_model_len else None
+                    self._budget_loaded = True
+        return self._budget
+
+    def _fit(self, messages: List[Dict], max_token: int):
+        budget = self.get_budget()
+        if budget is None:
+            return messages, max_token
+        return budget.fit(messages, max_token)
+
 
     def stream_chat(self, messages: List[Dict], **kwargs) -> Generator:
         """
@@ -30,23 +97,49 @@ class VllmServer:
 
         :param messages: A list of message dictionaries for the chat.
         :param kwargs: Optional parameters including tools for specific models.
+            `timeout` bounds both the request and the decoding in seconds; the
+            stream is closed early once it is exceeded. A request with a timeout
+            is not retried, and raises TimeoutError when the server does not
+            answer in time.
         :yield: A stream of chat completion chunks.
         """
         max_token = kwargs.get("max_token",2048)
         temperature = kwargs.get("temperature",0.7)
-        stream_completion = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            stream=True,
-            max_tokens=max_token,
-            temperature=temperature,
-            frequency_penalty=1.05,
-            response_format={'type':'json_schema'}
-        )
-            
-        # Yield chunks of streamed responses
-        for chunk in stream_completion:
-            yield chunk
+        timeout = kwargs.get("timeout")
+        messages, max_token = self._fit(messages, max_token)
+        from openai import APITimeoutError
+        from httpx import TimeoutException
+        # A retry would start over with the same timeout, past the caller's deadline
+        client = self.client if timeout is None else self.client.with_options(timeout=timeout, max_retries=0)
+        with span('llm_call', model=self.model, messages=len(messages), stream=True) as llm_span:
+            started = time.monotonic()
+            try:
+                stream_completion = client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    stream=True,
+                    max_tokens=max_token,
+                    temperature=temperature,
+                    frequency_penalty=1.05,
+                    response_format={'type':'json_schema'},
+                )
+
+                # Yield chunks of streamed responses
+                expires_at = None if timeout is None else started + timeout
+                chunks = 0
+                for chunk in stream_completion:
+                    if chunks == 0:
+                        llm_span.set(ttft=time.monotonic() - started)
+                    chunks += 1
+                    yield chunk
+                    if expires_at is not None and time.monotonic() >= expires_at:
+                        llm_span.set(cut=True)
+                        stream_completion.close()
+                        break
+                llm_span.set(chunks=chunks)
+            except (APITimeoutError, TimeoutException) as e:
+                llm_span.set(timed_out=True)
+                raise TimeoutError(f"{self.model} did not answer in time (timeout {timeout}s)") from e
 
     def chat(self, messages: List[Dict], **kwargs) -> str:
         """
@@ -58,12 +151,14 @@ class VllmServer:
         max_token = kwargs.get("max_token",1024)
         temperature = kwargs.get("temperature",0.7)
         frequency_penalty = kwargs.get("frequency_penalty",0.7)
-        response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                max_tokens=max_token,
-                temperature=temperature,
-                frequency_penalty=frequency_penalty,
-        )
+        messages, max_token = self._fit(messages, max_token)
+        with span('llm_call', model=self.model, messages=len(messages), stream=False):
+            response = self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_token,
+                    temperature=temperature,
+                    frequency_penalty=frequency_penalty,
+            )
         return response.choices[0].message.content
         
\ No newline at end of file
@@ -0,0 +1,10 @@
+from .tracer import configure, shutdown, enabled, span, propagate, JsonlSink
+
+__all__ = [
+    'configure',
+    'shutdown',
+    'enabled',
+    'span',
+    'propagate',
+    'JsonlSink'
+]
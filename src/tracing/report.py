@@ -0,0 +1,129 @@
+import json
+import argparse
+from collections import defaultdict
+from typing import Dict, List
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Summarise agent span traces")
+    parser.add_argument('--trace_path', required=True, type=str, help="JSONL trace file written by the tracing module")
+    parser.add_argument('--output', choices=['markdown', 'json'], default='markdown', help="Report format")
+    return parser.parse_args()
+
+
+def load_spans(trace_path: str) -> List[Dict]:
+    spans = []
+    with open(trace_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except json.JSONDecodeError:
+                # Tolerate a partially written trailing line
+                continue
+    return spans
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    pos = (len(ordered) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (pos - low)
+
+
+def stage_breakdown(spans: List[Dict]) -> List[Dict]:
+    """
+    Latency statistics per span name.
+    """
+    durations = defaultdict(list)
+    for span in spans:
+        durations[span['name']].append(span['duration'])
+    rows = []
+    for name, values in durations.items():
+        rows.append({
+            'stage': name,
+            'count': len(values),
+            'total': sum(values),
+            'mean': sum(values) / len(values),
+            'p50': percentile(values, 0.5),
+            'p90': percentile(values, 0.9),
+            'p99': percentile(values, 0.99),
+            'max': max(values),
+        })
+    return sorted(rows, key=lambda row: row['total'], reverse=True)
+
+
+def critical_path(span: Dict, children: Dict[str, List[Dict]]) -> List[Dict]:
+    """
+    Walk back from the end of `span`, repeatedly taking the child that finished
+    last before the current point: the chain of work the span was waiting on.
+    Time not covered by that chain is credited to the span itself.
+    """
+    path = []
+    cursor = span['end']
+    covered = 0.0
+    for kid in sorted(children.get(span['span_id'], []), key=lambda kid: kid['end'], reverse=True):
+        if kid['end'] <= cursor:
+            path.extend(critical_path(kid, children))
+            covered += kid['duration']
+            cursor = kid['start']
+    path.append({'stage': span['name'], 'self': max(span['duration'] - covered, 0.0)})
+    return path
+
+
+def critical_path_report(spans: List[Dict]) -> List[Dict]:
+    children = defaultdict(list)
+    roots = []
+    for span in spans:
+        if span['parent_id'] is None:
+            roots.append(span)
+        else:
+            children[span['parent_id']].append(span)
+
+    contribution = defaultdict(float)
+    appearances = defaultdict(int)
+    total = 0.0
+    for root in roots:
+        total += root['duration']
+        for step in critical_path(root, children):
+            contribution[step['stage']] += step['self']
+            appearances[step['stage']] += 1
+    rows = [
+        {
+            'stage': stage,
+            'on_path': appearances[stage],
+            'time': value,
+            'share': value / total if total else 0.0,
+        }
+        for stage, value in contribution.items()
+    ]
+    return sorted(rows, key=lambda row: row['time'], reverse=True)
+
+
+def to_markdown(title: str, rows: List[Dict]) -> str:
+    if not rows:
+        return f"### {title}\n\n(no spans)\n"
+    headers = list(rows[0].keys())
+    lines = [f"### {title}", "", "| " + " | ".join(headers) + " |", "|" + " | ".join(["---"] * len(headers)) + "|"]
+    for row in rows:
+        cells = [f"{v:.3f}" if isinstance(v, float) else str(v) for v in row.values()]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    args = parse_args()
+    spans = load_spans(args.trace_path)
+    breakdown = stage_breakdown(spans)
+    path = critical_path_report(spans)
+    if args.output == 'json':
+        print(json.dumps({'stages': breakdown, 'critical_path': path}, ensure_ascii=False, indent=4))
+    else:
+        print(to_markdown("Per-stage latency (s)", breakdown))
+        print(to_markdown("Critical path over all queries (s)", path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import os
+import json
+import time
+import uuid
+import threading
+import contextvars
+from typing import Callable, Dict, List, Optional
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+_tracer: Optional["Tracer"] = None
+
+
+class JsonlSink:
+    """
+    Append finished spans to a JSONL file with bounded buffering.
+
+    At most `buffer_size` spans are held in memory; a full buffer is written out
+    with a single O_APPEND write, so several processes can share the same file
+    without interleaving lines.
+    """
+    def __init__(self, path: str, buffer_size: int = 512):
+        self.path = path
+        self.buffer_size = buffer_size
+        self._buffer: List[str] = []
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if self._buffer:
+            os.write(self._fd, ''.join(self._buffer).encode('utf-8'))
+            self._buffer = []
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_locked()
+            os.close(self._fd)
+
+
+class Span:
+    """
+    A timed stage of the agent. Use as a context manager; nested spans, including
+    spans opened in threads started through `propagate`, record it as their parent.
+    """
+    __slots__ = ('tracer', 'name', 'trace_id', 'span_id', 'parent_id', 'attrs', 'start', 'end', 'error', '_token')
+
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict):
+        parent = _current_span.get()
+        self.tracer = tracer
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else self.span_id
+        self.attrs = attrs
+        self.start = None
+        self.end = None
+        self.error = None
+        self._token = None
+
+    def set(self, **attrs) -> None:
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.start = time.time()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end = time.time()
+        if exc_type is not None and exc_type is not GeneratorExit:
+            self.error = f'{exc_type.__name__}: {exc}'
+        try:
+            _current_span.reset(self._token)
+        except ValueError:
+            # Generators may be finalised from another context
+            pass
+        self.tracer.sink.write(self.to_dict())
+        return False
+
+    def to_dict(self) -> Dict:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': self.start,
+            'end': self.end,
+            'duration': self.end - self.start,
+            'pid': os.getpid(),
+            'thread': threading.current_thread().name,
+            'attrs': self.attrs,
+            'error': self.error,
+        }
+
+
+class _NoopSpan:
+    """Shared do-nothing span returned while tracing is disabled."""
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    def __init__(self, sink: JsonlSink):
+        self.sink = sink
+
+    def span(self, name: str, attrs: Dict) -> Span:
+        return Span(self, name, attrs)
+
+
+def configure(path: str, buffer_size: int = 512) -> Tracer:
+    """
+    Enable tracing for this process, writing spans to `path`.
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.sink.close()
+    _tracer = Tracer(JsonlSink(path, buffer_size))
+    return _tracer
+
+
+def shutdown() -> None:
+    """
+    Flush outstanding spans and disable tracing.
+    """
+    global _tracer
+    if _tracer is not None:
+        _tracer.sink.close()
+        _tracer = None
+
+
+def enabled() -> bool:
+    return _tracer is not None
+
+
+def span(name: str, **attrs):
+    """
+    Open a span named `name`. Costs a global lookup when tracing is disabled.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return tracer.span(name, attrs)
+
+
+def propagate(fn: Callable) -> Callable:
+    """
+    Bind `fn` to the current span so that it keeps its parent when submitted to
+    a thread pool.
+    """
+    if _tracer is None:
+        return fn
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)